@@ -0,0 +1,389 @@
+"""
+Admission Control
+
+Limits the chat completions sent upstream, so a burst at the start of a class
+waits its turn instead of turning into a storm of 429s.
+
+A completion has to be admitted before it is sent, and holds its place until
+its reply has finished:
+    - At most LLM_MAX_CONCURRENCY completions run at once, at most
+      LLM_MAX_CONCURRENCY_PER_SESSION for one chat session and at most
+      LLM_MAX_CONCURRENCY_PER_COHORT for one cohort (e.g. a class, named by the
+      X-Cohort request header).
+    - A token bucket holding one minute of LLM_TOKENS_PER_MINUTE, refilled
+      continuously, must cover the request's estimated tokens: the prompt plus
+      max_tokens, which is how the API counts rate limits. Tokens the reply did
+      not use are returned when it finishes.
+
+Requests that cannot start wait in a first-in, first-out queue. A request whose
+session or cohort is at its cap lets later requests pass; the token bucket does
+not, so large requests are not starved. A waiting request is shed with
+AdmissionRejected when the queue already holds LLM_QUEUE_SIZE requests, once it
+has waited LLM_QUEUE_TIMEOUT_SECONDS, or as soon as it is clear the token
+bucket cannot cover it before then. Streaming clients are told their queue
+position as it changes.
+
+Once admitted, a request that fails with a 429 or 5xx before any output is
+retried up to LLM_MAX_RETRIES times with exponential backoff and full jitter,
+waiting at least as long as the Retry-After header asks. The OpenAI SDK's own
+retries are off by default (OPENAI_MAX_RETRIES) so the two do not multiply.
+
+Settings (0 means no limit):
+    LLM_MAX_CONCURRENCY                Default 32
+    LLM_MAX_CONCURRENCY_PER_SESSION    Default 2
+    LLM_MAX_CONCURRENCY_PER_COHORT     Default 0
+    LLM_TOKENS_PER_MINUTE              Default 0
+    LLM_QUEUE_SIZE                     Default 256
+    LLM_QUEUE_TIMEOUT_SECONDS          Default 30
+    LLM_MAX_RETRIES                    Default 3
+    LLM_RETRY_BASE_SECONDS             First backoff ceiling, doubled per retry (default 0.5)
+    LLM_RETRY_MAX_SECONDS              Largest backoff (default 8)
+
+Limits are kept per worker process; divide them by the number of workers.
+"""
+
+import asyncio
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import openai
+
+import metrics
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+DEFAULT_MAX_PER_SESSION = int(os.getenv("LLM_MAX_CONCURRENCY_PER_SESSION", "2"))
+DEFAULT_MAX_PER_COHORT = int(os.getenv("LLM_MAX_CONCURRENCY_PER_COHORT", "0"))
+DEFAULT_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+DEFAULT_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "256"))
+DEFAULT_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "30"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+RETRY_BASE = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+RETRY_MAX = float(os.getenv("LLM_RETRY_MAX_SECONDS", "8"))
+
+# Request header naming the cohort a request counts against
+COHORT_HEADER = "X-Cohort"
+
+T = TypeVar("T")
+
+class AdmissionRejected(Exception):
+    """A request was shed instead of being sent upstream"""
+
+    def __init__(self, message: str, reason: str, retry_after: float):
+        """
+        Args:
+            message: Explanation for the client
+            reason: queue_full, queue_timeout or rate_limited
+            retry_after: Suggested seconds to wait before trying again
+        """
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class Ticket:
+    """
+    One request's place in the admission queue, and then its admission
+    """
+
+    def __init__(self, controller: "AdmissionController", tenants: List[str], tokens: int, deadline: float):
+        self._controller = controller
+        self.tenants = tenants
+        self.tokens = tokens
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        # 1-based position while waiting
+        self.position = 0
+        self.admitted = False
+        self.released = False
+        self.error: Optional[AdmissionRejected] = None
+        self._changed = asyncio.Event()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _notify(self) -> None:
+        self._changed.set()
+
+    async def wait(self) -> AsyncIterator[int]:
+        """
+        Wait to be admitted
+
+        Yields:
+            The queue position, each time it changes; nothing if admitted at once
+
+        Raises:
+            AdmissionRejected: The request was shed
+        """
+        reported = None
+        while True:
+            if self.error is not None:
+                raise self.error
+            if self.admitted:
+                return
+            if self.position != reported:
+                reported = self.position
+                yield self.position
+            self._changed.clear()
+            await self._changed.wait()
+
+    def release(self, completion_tokens: Optional[int] = None) -> None:
+        """
+        Leave the queue, or give back the admission once the reply has finished
+
+        Safe to call more than once.
+
+        Args:
+            completion_tokens: Tokens the reply used, if known; the rest of the
+                estimate is returned to the token bucket
+        """
+        self._controller._release(self, completion_tokens)
+
+class AdmissionController:
+    """
+    Concurrency caps, a token bucket and a bounded wait queue in front of the upstream model
+
+    Used from the event loop thread only.
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, max_per_session: int = DEFAULT_MAX_PER_SESSION,
+                 max_per_cohort: int = DEFAULT_MAX_PER_COHORT, tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, queue_timeout: float = DEFAULT_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_per_session = max_per_session
+        self.max_per_cohort = max_per_cohort
+        self.tokens_per_minute = tokens_per_minute
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self._tenants: Dict[str, int] = {}
+        self._queue: List[Ticket] = []
+        self._bucket = float(tokens_per_minute)
+        self._refilled = time.monotonic()
+        self._refill_timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._queue)
+
+    def request(self, session_id: str, tokens: int, cohort: Optional[str] = None) -> Ticket:
+        """
+        Ask to send a completion
+
+        Args:
+            session_id: The chat session the completion is for
+            tokens: Estimated prompt tokens plus max_tokens
+            cohort: The cohort the session belongs to, if any
+
+        Returns:
+            A ticket; iterate ticket.wait() before sending, and call ticket.release() afterwards
+
+        Raises:
+            AdmissionRejected: The queue is full
+        """
+        tenants = [f"session:{session_id}"]
+        if cohort:
+            tenants.append(f"cohort:{cohort}")
+        if self.tokens_per_minute:
+            # A request larger than the bucket could never be admitted
+            tokens = min(tokens, self.tokens_per_minute)
+        ticket = Ticket(self, tenants, tokens, time.monotonic() + self.queue_timeout)
+
+        self._refill()
+        if not self._queue and self._fits(ticket) and self._affordable(ticket):
+            self._admit(ticket)
+            return ticket
+
+        if len(self._queue) >= self.queue_size:
+            metrics.ADMISSION_REJECTED.labels("queue_full").inc()
+            raise AdmissionRejected("Too many requests are waiting for the model; try again shortly",
+                                    "queue_full", self.queue_timeout)
+
+        self._queue.append(ticket)
+        ticket.position = len(self._queue)
+        ticket._timer = asyncio.get_running_loop().call_at(ticket.deadline, self._expire, ticket)
+        self._dispatch()
+        return ticket
+
+    def _cap(self, tenant: str) -> int:
+        return self.max_per_session if tenant.startswith("session:") else self.max_per_cohort
+
+    def _fits(self, ticket: Ticket) -> bool:
+        """Whether the concurrency caps leave room for the ticket"""
+        if self.max_concurrency and self.running >= self.max_concurrency:
+            return False
+        return all(not self._cap(tenant) or self._tenants.get(tenant, 0) < self._cap(tenant)
+                   for tenant in ticket.tenants)
+
+    def _refill(self) -> None:
+        if not self.tokens_per_minute:
+            return
+        now = time.monotonic()
+        self._bucket = min(self._bucket + (now - self._refilled) * self.tokens_per_minute / 60,
+                           self.tokens_per_minute)
+        self._refilled = now
+
+    def _affordable(self, ticket: Ticket) -> bool:
+        return not self.tokens_per_minute or self._bucket >= ticket.tokens
+
+    def _token_wait(self, ticket: Ticket) -> float:
+        """Seconds until the bucket covers the ticket"""
+        return (ticket.tokens - self._bucket) * 60 / self.tokens_per_minute
+
+    def _admit(self, ticket: Ticket) -> None:
+        ticket.admitted = True
+        ticket.position = 0
+        if ticket._timer is not None:
+            ticket._timer.cancel()
+        self.running += 1
+        for tenant in ticket.tenants:
+            self._tenants[tenant] = self._tenants.get(tenant, 0) + 1
+        if self.tokens_per_minute:
+            self._bucket -= ticket.tokens
+        metrics.ADMISSION_WAIT.observe(time.monotonic() - ticket.enqueued)
+        ticket._notify()
+
+    def _shed(self, ticket: Ticket, error: AdmissionRejected) -> None:
+        self._queue.remove(ticket)
+        if ticket._timer is not None:
+            ticket._timer.cancel()
+        ticket.error = error
+        metrics.ADMISSION_REJECTED.labels(error.reason).inc()
+        ticket._notify()
+
+    def _expire(self, ticket: Ticket) -> None:
+        if ticket in self._queue:
+            self._shed(ticket, AdmissionRejected("Timed out waiting for the model; try again shortly",
+                                                 "queue_timeout", self.queue_timeout))
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Admit waiting requests in order while there is room, and update the positions of the rest"""
+        self._refill()
+        if self._refill_timer is not None:
+            self._refill_timer.cancel()
+            self._refill_timer = None
+
+        index = 0
+        while index < len(self._queue):
+            if self.max_concurrency and self.running >= self.max_concurrency:
+                break
+            ticket = self._queue[index]
+            if not self._fits(ticket):
+                # Its session or cohort is at its cap; let later requests pass
+                index += 1
+                continue
+            if not self._affordable(ticket):
+                wait = self._token_wait(ticket)
+                if time.monotonic() + wait > ticket.deadline:
+                    self._shed(ticket, AdmissionRejected("The model's token rate limit is exhausted; try again later",
+                                                         "rate_limited", wait))
+                    continue
+                self._refill_timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                break
+            self._queue.pop(index)
+            self._admit(ticket)
+
+        for position, ticket in enumerate(self._queue, start=1):
+            if ticket.position != position:
+                ticket.position = position
+                ticket._notify()
+        metrics.ADMISSION_QUEUE.set(len(self._queue))
+
+    def _release(self, ticket: Ticket, completion_tokens: Optional[int]) -> None:
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket._timer is not None:
+            ticket._timer.cancel()
+
+        if ticket.admitted:
+            self.running -= 1
+            for tenant in ticket.tenants:
+                count = self._tenants[tenant] - 1
+                if count:
+                    self._tenants[tenant] = count
+                else:
+                    del self._tenants[tenant]
+            if self.tokens_per_minute and completion_tokens is not None:
+                self._refill()
+                self._bucket = min(self._bucket + max(ticket.tokens - completion_tokens, 0), self.tokens_per_minute)
+        elif ticket in self._queue:
+            self._queue.remove(ticket)
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        """Current load of the controller"""
+        self._refill()
+        return {
+            "running": self.running,
+            "waiting": len(self._queue),
+            "max_concurrency": self.max_concurrency,
+            "tokens_available": int(self._bucket) if self.tokens_per_minute else None,
+            "tokens_per_minute": self.tokens_per_minute or None
+        }
+
+controller = AdmissionController()
+
+def retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    Seconds to wait before retrying a failed upstream request
+
+    Args:
+        error: The error the request failed with
+        attempt: Retries made so far
+
+    Returns:
+        The delay, or None if the error is not worth retrying
+    """
+    status = getattr(error, "status_code", None)
+    if not isinstance(error, openai.APIStatusError) or not (status == 429 or status >= 500):
+        return None
+
+    # Full jitter spreads out the clients that failed together
+    delay = random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt))
+    headers = getattr(error.response, "headers", {})
+    try:
+        if "retry-after-ms" in headers:
+            delay = max(delay, float(headers["retry-after-ms"]) / 1000)
+        elif "retry-after" in headers:
+            delay = max(delay, float(headers["retry-after"]))
+    except ValueError:
+        pass
+    return min(delay, RETRY_MAX)
+
+async def call_with_retries(call: Callable[[], Awaitable[T]], model: str, max_retries: int = MAX_RETRIES) -> T:
+    """
+    Make an upstream request, retrying 429 and 5xx responses with jittered backoff
+
+    Args:
+        call: Sends the request; called once per attempt
+        model: The model, for metrics
+        max_retries: Retries after the first attempt
+    """
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except openai.APIStatusError as e:
+            delay = retry_delay(e, attempt)
+            if delay is None or attempt >= max_retries:
+                raise
+            metrics.LLM_RETRIES.labels(model, str(e.status_code)).inc()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+def error_details(error: Exception) -> Dict[str, Any]:
+    """
+    The error event of a failed reply
+
+    Besides the message, says why the request failed where the client can act on
+    it: code is overloaded (shed before reaching the model), rate_limited or
+    upstream_unavailable, with a suggested retry_after in seconds.
+    """
+    details: Dict[str, Any] = {"error": f"Error: {str(error)}"}
+    if isinstance(error, AdmissionRejected):
+        details["code"] = "rate_limited" if error.reason == "rate_limited" else "overloaded"
+        details["retry_after"] = round(error.retry_after, 1)
+    elif isinstance(error, openai.APIStatusError) and retry_delay(error, 0) is not None:
+        details["code"] = "rate_limited" if error.status_code == 429 else "upstream_unavailable"
+        details["retry_after"] = round(RETRY_MAX, 1)
+    return details
@@ -1,37 +1,62 @@
 import os
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends
 from pydantic import BaseModel
-from dotenv import load_dotenv
-from openai import OpenAI, AsyncOpenAI
+import async_timeout
 import uvicorn
 
 # Import routers
 from scenarios_route import router as scenarios_router
 from chat_route import router as chat_router
+from chat_socket_route import router as chat_socket_router
 from evaluate_route import router as evaluate_router
+import chat_state
+import metrics
+import profiling
+import scenario_registry
+import tracing
+from openai_provider import OpenAIProvider, get_openai, openai_lifespan
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Get API key from environment variables
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY environment variable is not set")
-
-# Initialize OpenAI clients
-client = OpenAI(api_key=api_key)
-async_client = AsyncOpenAI(api_key=api_key)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Periodically drop idle chat sessions unless explicitly disabled
+    if os.getenv("CHAT_SESSION_SWEEPER", "1") != "0":
+        chat_state.start_sweeper()
+    # Hot-reload scenario files when they are served from a directory
+    if scenario_registry.SCENARIO_SOURCE == "directory":
+        from scenario_loader import get_directory
+        get_directory().start_watcher()
+    try:
+        # Share one pooled OpenAI client across all routers
+        async with openai_lifespan(app):
+            yield
+    finally:
+        chat_state.stop_sweeper()
+        if scenario_registry.SCENARIO_SOURCE == "directory":
+            get_directory().stop_watcher()
 
 # Initialize FastAPI app
 app = FastAPI(title="MedComm API", 
               description="API for medical communication training scenarios",
-              version="1.0")
+              version="1.0",
+              lifespan=lifespan)
 
 # Include routers
 app.include_router(scenarios_router, tags=["Scenarios"])
 app.include_router(chat_router, tags=["Chat"])
+app.include_router(chat_socket_router, tags=["Chat"])
 app.include_router(evaluate_router, tags=["Evaluation"])
 
+# Request timing and the /metrics endpoint, unless METRICS_ENABLED=0
+if metrics.METRICS_ENABLED:
+    from metrics_route import router as metrics_router
+    app.include_router(metrics_router, tags=["Metrics"])
+    app.add_middleware(metrics.RequestTimingMiddleware)
+
+# Per-request spans and on-demand profiles; added last so the request span covers the other middleware
+if tracing.TRACING_ENABLED or profiling.PROFILING_ENABLED:
+    app.add_middleware(tracing.TracingMiddleware)
+
 # Define request model
 class PromptRequest(BaseModel):
     prompt: str
@@ -43,16 +68,17 @@ def read_root():
     return {"message": "MedComm API - Medical Communication Training"}
 
 @app.post("/api/test-openai")
-async def test_openai(request: PromptRequest):
+async def test_openai(request: PromptRequest, openai: OpenAIProvider = Depends(get_openai)):
     try:
-        response = client.chat.completions.create(
-            model=request.model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": request.prompt}
-            ],
-            max_tokens=request.max_tokens
-        )
+        async with async_timeout.timeout(openai.request_timeout):
+            response = await openai.async_client.chat.completions.create(
+                model=request.model,
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": request.prompt}
+                ],
+                max_tokens=request.max_tokens
+            )
         
         return {
             "text": response.choices[0].message.content,
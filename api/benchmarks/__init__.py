@@ -0,0 +1,6 @@
+"""
+MedComm API benchmarks
+
+Standalone scripts that drive the FastAPI app in-process. Run them from the api
+directory, for example: python -m benchmarks.load_chat
+"""
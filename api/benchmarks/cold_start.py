@@ -0,0 +1,124 @@
+"""
+Scenario cold start benchmark
+
+Measures how long a fresh interpreter takes to get a ready scenario registry,
+with its system prompts and keyword indexes, when loading from the scenario
+module (SCENARIO_SOURCE=module) and from a precompiled bundle
+(SCENARIO_SOURCE=bundle). Each run is a new process, as on a serverless cold
+start; the bundle is compiled to a temporary file first.
+
+--scenarios N replaces the bundled scenarios with N synthetic copies of them,
+to see how both sources scale with the size of the collection.
+
+Usage:
+    python -m benchmarks.cold_start --runs 20 --scenarios 200
+"""
+
+import argparse
+import json
+import os
+import pprint
+import statistics
+import subprocess
+import sys
+import tempfile
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Put a synthetic scenario package ahead of the real one, if the benchmark made one
+SETUP = """
+import os, sys
+if os.environ.get("BENCH_SCENARIO_ROOT"):
+    sys.path.insert(0, os.environ["BENCH_SCENARIO_ROOT"])
+"""
+
+# Runs in the child process; prints the load time in milliseconds
+PROBE = SETUP + """
+import time
+started = time.perf_counter()
+import scenario_registry
+registry = scenario_registry.get_registry()
+elapsed = time.perf_counter() - started
+import json, sys
+sys.__stdout__.write(json.dumps({"ms": elapsed * 1000, "version": registry.version}) + "\\n")
+"""
+
+COMPILE = SETUP + """
+import sys
+from scenario_bundle import compile_bundle
+compile_bundle(sys.argv[1])
+"""
+
+def write_synthetic_scenarios(root: str, count: int) -> str:
+    """
+    Write a data.scenarios package with count copies of the bundled scenarios
+
+    Returns:
+        The scenarios directory inside root
+    """
+    sys.path.insert(0, os.path.dirname(API_DIR))
+    from data.scenarios.scenarios import scenarios
+
+    templates = list(scenarios.values())
+    synthetic = {}
+    for index in range(count):
+        scenario = dict(templates[index % len(templates)])
+        scenario["id"] = f"{scenario['id']}_{index}"
+        synthetic[f"scenario_{index}"] = scenario
+
+    scenarios_dir = os.path.join(root, "data", "scenarios")
+    os.makedirs(scenarios_dir)
+    for package in (os.path.join(root, "data"), scenarios_dir):
+        open(os.path.join(package, "__init__.py"), "w").close()
+    with open(os.path.join(scenarios_dir, "scenarios.py"), "w", encoding="utf-8") as f:
+        f.write(f"scenarios = {pprint.pformat(synthetic)}\n")
+    return scenarios_dir
+
+def run_child(script: str, env: dict, *args: str) -> str:
+    result = subprocess.run(
+        [sys.executable, "-c", script, *args], cwd=API_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return result.stdout
+
+def run_probe(source: str, env: dict) -> dict:
+    output = run_child(PROBE, dict(env, SCENARIO_SOURCE=source))
+    if source == "bundle" and "Loaded scenario bundle" not in output:
+        raise SystemExit(f"Bundle did not load, the registry fell back to the scenario module:\n{output}")
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--scenarios", type=int, default=0, help="Synthetic scenario count (0 = bundled scenarios)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        bundle_path = os.path.join(temp_dir, "scenarios.bundle")
+        env = dict(os.environ, SCENARIO_BUNDLE_PATH=bundle_path)
+        if args.scenarios:
+            env["BENCH_SCENARIO_ROOT"] = temp_dir
+            env["SCENARIOS_DIR"] = write_synthetic_scenarios(temp_dir, args.scenarios)
+        run_child(COMPILE, env, bundle_path)
+
+        timings = {"module": [], "bundle": []}
+        versions = {}
+        # Interleave the runs so both sources see the same machine conditions
+        for _ in range(args.runs):
+            for source in timings:
+                probe = run_probe(source, env)
+                timings[source].append(probe["ms"])
+                versions[source] = probe["version"]
+
+    if versions["module"] != versions["bundle"]:
+        raise SystemExit(f"Bundle and module scenarios differ: {versions}")
+
+    count = args.scenarios or "bundled"
+    print(f"Scenario registry ready in a new process ({count} scenarios), {args.runs} runs, version {versions['module']}")
+    for source, samples in timings.items():
+        print(f"  {source:<7} median {statistics.median(samples):7.2f} ms   min {min(samples):7.2f} ms")
+    module_ms = statistics.median(timings["module"])
+    bundle_ms = statistics.median(timings["bundle"])
+    print(f"  saving per cold start: {module_ms - bundle_ms:.2f} ms ({module_ms / bundle_ms:.1f}x)")
+
+if __name__ == "__main__":
+    main()
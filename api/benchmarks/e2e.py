@@ -0,0 +1,279 @@
+"""
+End-to-end API benchmark
+
+Drives the FastAPI app in-process over httpx's ASGI transport, with the
+in-process mock LLM (mock_llm.py) as the model, and measures throughput and
+latency percentiles per endpoint:
+    scenarios       GET  /api/scenarios
+    scenarios_info  GET  /api/scenarios/info
+    scenario        GET  /api/scenarios/{scenario_id}
+    start_chat      POST /api/start_chat
+    chat            POST /api/chat
+    chat_stream     POST /api/chat/stream (time to first frame and total)
+    evaluate        POST /api/evaluate
+
+Each chat, chat_stream and evaluate request gets its own session, prepared
+beforehand with --history messages, so every request sees the same history
+length. The mock answers instantly by default, so the numbers are the API's own
+cost; pass --ttft-ms and --tokens-per-second to include model pacing.
+
+httpx's ASGI transport only returns a response once the app has finished it,
+so the time to the first streamed frame is recorded inside the app, by an ASGI
+wrapper that notes when each request's first body bytes are sent.
+
+Results can be written as JSON and compared with an earlier run:
+    python -m benchmarks.e2e --output before.json
+    python -m benchmarks.e2e --baseline before.json
+
+Usage:
+    python -m benchmarks.e2e --concurrency 20 --requests 500 --history 20
+"""
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ.setdefault("CHAT_SESSION_SWEEPER", "0")
+
+import httpx
+
+# The app logs with print; keep stdout for the results
+with contextlib.redirect_stdout(sys.stderr):
+    import chat_state
+    from app import app
+    from benchmarks.stats import percentiles
+    from mock_llm import MockAsyncOpenAI, MockLLM
+    from openai_provider import OpenAIProvider, get_openai
+    from scenario_registry import get_registry
+
+ENDPOINTS = ("scenarios", "scenarios_info", "scenario", "start_chat", "chat", "chat_stream", "evaluate")
+
+SCENARIO_ID = "difficult_news"
+
+# Header that ties a request to its first-byte time
+BENCHMARK_ID_HEADER = "x-benchmark-id"
+
+USER_MESSAGES = (
+    "I'm worried about what the results mean for my family.",
+    "Can you explain that again? I'm not sure I understand.",
+    "What are my options for treatment from here?",
+    "Thank you for being honest with me, this is a lot to take in."
+)
+
+class FirstByteTimer:
+    """
+    ASGI wrapper recording when the first body bytes of each tagged request are sent
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.first_body: Dict[bytes, float] = {}
+
+    async def __call__(self, scope, receive, send):
+        key = None
+        if scope["type"] == "http":
+            key = dict(scope["headers"]).get(BENCHMARK_ID_HEADER.encode())
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def timed_send(message):
+            if message["type"] == "http.response.body" and message.get("body") and key not in self.first_body:
+                self.first_body[key] = time.perf_counter()
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+def prepare_session(history: int) -> str:
+    """A session of the benchmark scenario with a given number of messages"""
+    scenario_key, scenario = get_registry().resolve(SCENARIO_ID)
+    session_id = chat_state.create_session(scenario_key, scenario)
+    chat_state.add_message(session_id, {"role": "assistant", "content": scenario["initial_prompt"]})
+    for index in range(history - 1):
+        if index % 2 == 0:
+            message = {"role": "user", "content": USER_MESSAGES[index // 2 % len(USER_MESSAGES)]}
+        else:
+            message = {"role": "assistant", "content": "I hear you. Let's take this one step at a time together."}
+        chat_state.add_message(session_id, message)
+    return session_id
+
+def request_factory(endpoint: str, count: int, history: int) -> Callable[[int], Dict[str, Any]]:
+    """
+    Build the requests of one endpoint
+
+    Returns:
+        A function from request index to httpx.request keyword arguments
+    """
+    if endpoint == "scenarios":
+        return lambda index: {"method": "GET", "url": "/api/scenarios"}
+    if endpoint == "scenarios_info":
+        return lambda index: {"method": "GET", "url": "/api/scenarios/info"}
+    if endpoint == "scenario":
+        return lambda index: {"method": "GET", "url": f"/api/scenarios/{SCENARIO_ID}"}
+    if endpoint == "start_chat":
+        return lambda index: {"method": "POST", "url": "/api/start_chat", "json": {"scenario_id": SCENARIO_ID}}
+
+    sessions = [prepare_session(history) for _ in range(count)]
+    message = USER_MESSAGES[0]
+    if endpoint == "chat":
+        return lambda index: {"method": "POST", "url": "/api/chat",
+                              "json": {"session_id": sessions[index], "message": message}}
+    if endpoint == "chat_stream":
+        return lambda index: {"method": "POST", "url": "/api/chat/stream",
+                              "json": {"session_id": sessions[index], "message": message}}
+    if endpoint == "evaluate":
+        return lambda index: {"method": "POST", "url": "/api/evaluate", "json": {"session_id": sessions[index]}}
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+def response_error(endpoint: str, response: httpx.Response) -> Optional[str]:
+    """Why a response counts as failed, or None"""
+    if response.status_code != 200:
+        return f"HTTP {response.status_code}"
+    if endpoint == "chat_stream" and '"done": true' not in response.text:
+        return "stream did not finish"
+    return None
+
+async def run_endpoint(http: httpx.AsyncClient, timer: FirstByteTimer, endpoint: str, args) -> Dict[str, Any]:
+    """Send --requests requests to one endpoint from --concurrency workers"""
+    warmup = request_factory(endpoint, args.warmup, args.history)
+    for index in range(args.warmup):
+        await http.request(**warmup(index))
+
+    build = request_factory(endpoint, args.requests, args.history)
+    indexes = iter(range(args.requests))
+    latencies: List[float] = []
+    first_frames: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = itertools.count()
+
+    async def worker():
+        for index in indexes:
+            key = str(next(counter)).encode()
+            request = build(index)
+            request["headers"] = {BENCHMARK_ID_HEADER: key.decode()}
+            start = time.perf_counter()
+            response = await http.request(**request)
+            latencies.append(time.perf_counter() - start)
+            first = timer.first_body.pop(key, None)
+            if endpoint == "chat_stream" and first is not None:
+                first_frames.append(first - start)
+
+            error = response_error(endpoint, response)
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    wall = time.perf_counter() - wall_start
+
+    result = {
+        "requests": args.requests,
+        "errors": errors,
+        "throughput_rps": args.requests / wall,
+        "latency_ms": percentiles(latencies)
+    }
+    if endpoint == "chat_stream":
+        result["ttft_ms"] = percentiles(first_frames)
+    return result
+
+async def run(args) -> Dict[str, Any]:
+    llm = MockLLM(ttft=args.ttft_ms / 1000, tokens_per_second=args.tokens_per_second,
+                  reply_tokens=(args.reply_tokens, args.reply_tokens), seed=args.seed)
+    provider = OpenAIProvider(async_client=MockAsyncOpenAI(llm))
+    app.dependency_overrides[get_openai] = lambda: provider
+
+    timer = FirstByteTimer(app)
+    transport = httpx.ASGITransport(app=timer, raise_app_exceptions=False)
+    results = {}
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=300) as http:
+            for endpoint in args.endpoints:
+                results[endpoint] = await run_endpoint(http, timer, endpoint, args)
+    finally:
+        app.dependency_overrides.pop(get_openai, None)
+    return results
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def change(current: float, previous: float) -> str:
+    if not previous:
+        return ""
+    return f"({(current - previous) / previous * 100:+.0f}%)"
+
+def print_results(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    args = report["args"]
+    print(f"commit {report['commit'] or 'unknown'}: {args['concurrency']} concurrent, {args['requests']} requests "
+          f"per endpoint, {args['history']} messages of history")
+    if baseline:
+        print(f"compared with commit {baseline.get('commit') or 'unknown'}")
+
+    for endpoint, result in report["results"].items():
+        previous = (baseline or {}).get("results", {}).get(endpoint, {})
+        latency = result["latency_ms"]
+        line = (f"  {endpoint:<15} {result['throughput_rps']:>8.0f} req/s {change(result['throughput_rps'], previous.get('throughput_rps', 0)):>7}"
+                f"  p50 {latency['p50']:7.2f} {change(latency['p50'], previous.get('latency_ms', {}).get('p50', 0)):>7}"
+                f"  p95 {latency['p95']:7.2f}  p99 {latency['p99']:7.2f} ms")
+        if "ttft_ms" in result and result["ttft_ms"]:
+            line += f"  first frame p50 {result['ttft_ms']['p50']:.2f} p95 {result['ttft_ms']['p95']:.2f} ms"
+        if result["errors"]:
+            line += f"  errors {result['errors']}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=500, help="Timed requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=20, help="Untimed requests per endpoint first")
+    parser.add_argument("--history", type=int, default=20, help="Messages in each chat session beforehand")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--ttft-ms", type=float, default=0, help="Mock time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Mock token rate, 0 for no delay")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="Mock reply length")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare with")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        results = asyncio.run(run(args))
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "args": vars(args),
+        "results": results
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(report, baseline)
+
+if __name__ == "__main__":
+    main()
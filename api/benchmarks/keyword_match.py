@@ -0,0 +1,80 @@
+"""
+Keyword matching benchmark
+
+Compares the per-keyword regex loop that generate_basic_feedback used to run
+with the scenario's Aho-Corasick keyword index, on synthetic transcripts and
+keyword sets of increasing size. Both must return the same matches.
+
+Usage:
+    python -m benchmarks.keyword_match --transcript-words 50000 --keywords 500
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keyword_index import KeywordIndex
+
+VOCABULARY = (
+    "i'm dr. the your husband heart stopped we tried everything brain injury oxygen sorry "
+    "difficult news take time next few hours comfort care specialists support options "
+    "surgery radiation side effects recovery questions understand worried family decision"
+).split()
+
+def make_scenario(keyword_count: int, steps: int, rng: random.Random):
+    step_names = [f"Step {i}" for i in range(steps)]
+    keywords = {name: [] for name in step_names}
+    for i in range(keyword_count):
+        phrase = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(1, 4)))
+        keywords[step_names[i % steps]].append(phrase)
+    return {"id": "benchmark", "communication_steps": step_names, "evaluation_keywords": keywords}
+
+def regex_loop(scenario_data, text):
+    evaluation_keywords = scenario_data["evaluation_keywords"]
+    results = []
+    for step in scenario_data["communication_steps"]:
+        matching_keywords = []
+        for keyword in evaluation_keywords.get(step, []):
+            if re.search(r'\b' + re.escape(keyword.lower()) + r'\b', text):
+                matching_keywords.append(keyword)
+        results.append(matching_keywords)
+    return results
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transcript-words", type=int, default=50000)
+    parser.add_argument("--keywords", type=int, default=500)
+    parser.add_argument("--steps", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'words':>8} {'keywords':>9} {'regex loop':>12} {'automaton':>12} {'speedup':>8}")
+    for scale in (0.1, 0.5, 1.0):
+        words = int(args.transcript_words * scale)
+        keyword_count = max(int(args.keywords * scale), args.steps)
+        scenario = make_scenario(keyword_count, args.steps, rng)
+        text = " ".join(rng.choice(VOCABULARY) for _ in range(words)).lower()
+
+        re.purge()
+        expected, regex_seconds = timed(regex_loop, scenario, text)
+        index = KeywordIndex(scenario)
+        actual, automaton_seconds = timed(index.match, text)
+        if actual != expected:
+            raise AssertionError("Automaton matches differ from the regex loop")
+
+        print(f"{words:>8} {keyword_count:>9} {regex_seconds * 1000:>10.1f}ms "
+              f"{automaton_seconds * 1000:>10.1f}ms {regex_seconds / automaton_seconds:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
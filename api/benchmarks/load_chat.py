@@ -0,0 +1,98 @@
+"""
+Concurrent /api/chat load test
+
+Fires N non-streaming chat requests at once against a stub completion client
+with a fixed upstream latency. If the endpoint awaits the upstream call the
+total time stays close to a single request; if it blocks the event loop the
+requests serialize and the total grows to N times the latency.
+
+Usage:
+    python -m benchmarks.load_chat --concurrency 20 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+import httpx
+
+from app import app
+from openai_provider import OpenAIProvider, get_openai
+
+class StubResponse:
+    class Choice:
+        class Message:
+            content = "Stub reply"
+
+        def __init__(self):
+            self.message = self.Message()
+
+    def __init__(self):
+        self.choices = [self.Choice()]
+
+class StubAsyncClient:
+    """Async completion client that answers after a fixed delay"""
+
+    class Completions:
+        def __init__(self, latency):
+            self.latency = latency
+
+        async def create(self, **kwargs):
+            await asyncio.sleep(self.latency)
+            return StubResponse()
+
+    class Chat:
+        def __init__(self, completions):
+            self.completions = completions
+
+    def __init__(self, latency):
+        self.chat = self.Chat(self.Completions(latency))
+
+async def run(concurrency: int, latency: float) -> float:
+    stub = OpenAIProvider(async_client=StubAsyncClient(latency))
+    app.dependency_overrides[get_openai] = lambda: stub
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        sessions = []
+        for _ in range(concurrency):
+            response = await http.post("/api/start_chat", json={"scenario_id": "difficult_news"})
+            sessions.append(response.json()["session_id"])
+
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            http.post("/api/chat", json={"session_id": session_id, "message": "Hello"})
+            for session_id in sessions
+        ])
+        elapsed = time.perf_counter() - start
+
+    failures = [r for r in responses if r.status_code != 200]
+    if failures:
+        raise RuntimeError(f"{len(failures)} requests failed: {failures[0].text}")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5, help="Simulated upstream latency in seconds")
+    args = parser.parse_args()
+
+    elapsed = asyncio.run(run(args.concurrency, args.latency))
+    serialized = args.concurrency * args.latency
+    print(f"{args.concurrency} concurrent chats at {args.latency:.2f}s upstream latency")
+    print(f"  total time:        {elapsed:.2f}s")
+    print(f"  if serialized:     {serialized:.2f}s")
+    print(f"  overlap factor:    {serialized / elapsed:.1f}x")
+
+    # Concurrent requests should finish in roughly one upstream round trip
+    if elapsed > args.latency * 2:
+        print("FAIL: chats are serializing on the event loop")
+        sys.exit(1)
+    print("OK: chats run concurrently")
+
+if __name__ == "__main__":
+    main()
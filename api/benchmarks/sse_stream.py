@@ -0,0 +1,198 @@
+"""
+SSE streaming benchmark
+
+Starts the API under uvicorn with a stub upstream that streams one word per
+chunk, opens many concurrent /api/chat/stream requests and reports the frames
+received per second and the server CPU time per stream for:
+    legacy     the previous loop: json.dumps, += and asyncio.sleep(0) per chunk
+    writer     SSEWriter sending every delta as its own frame
+    coalesced  SSEWriter coalescing by time and size
+
+The server runs in its own process, so its CPU time (read from /proc, Linux
+only) includes the socket writes each frame costs. Every mode must deliver the
+same text.
+
+Usage:
+    python -m benchmarks.sse_stream --streams 100 --tokens 300 --chunk-interval 0.002
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+import httpx
+
+import chat_state
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = ("I ", "understand ", "this ", "is ", "very ", "hard ", "to ", "hear, ", "and ", "I'm ", "here. ")
+
+# Runs in the server process
+SERVER = """
+import os
+import uvicorn
+import chat_route
+from app import app
+from openai_provider import OpenAIProvider, get_openai
+from benchmarks.sse_stream import StubStreamingClient, legacy_stream
+
+provider = OpenAIProvider(async_client=StubStreamingClient(
+    int(os.environ["BENCH_TOKENS"]), float(os.environ["BENCH_CHUNK_INTERVAL"])
+))
+app.dependency_overrides[get_openai] = lambda: provider
+if os.environ["BENCH_MODE"] == "legacy":
+    chat_route.stream_openai_response = legacy_stream
+uvicorn.run(app, host="127.0.0.1", port=int(os.environ["BENCH_PORT"]), log_level="warning")
+"""
+
+def make_chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+class StubStreamingClient:
+    """Completion client that streams a fixed number of single-word chunks"""
+
+    def __init__(self, tokens: int, interval: float):
+        self.tokens = tokens
+        self.interval = interval
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, **kwargs):
+        async def stream():
+            for index in range(self.tokens):
+                if self.interval:
+                    await asyncio.sleep(self.interval)
+                yield make_chunk(WORDS[index % len(WORDS)])
+        return stream()
+
+async def legacy_stream(session_id, messages, model, openai, **kwargs):
+    """The per-chunk loop stream_openai_response used before SSEWriter; later options (cache_key, cohort) are ignored"""
+    response = await openai.async_client.chat.completions.create(model=model, messages=messages, stream=True)
+    complete_response = ""
+    async for chunk in response:
+        if chunk.choices[0].delta.content:
+            content = chunk.choices[0].delta.content
+            complete_response += content
+            yield f"data: {json.dumps({'content': content})}\n\n"
+            await asyncio.sleep(0)
+    chat_state.add_message(session_id, {"role": "assistant", "content": complete_response})
+    yield f"data: {json.dumps({'content': '', 'done': True})}\n\n"
+
+def process_cpu_seconds(pid: int) -> float:
+    """User plus system CPU time of a process"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def read_stream(http: httpx.AsyncClient, session_id: str) -> tuple:
+    frames = 0
+    text = []
+    buffer = ""
+    async with http.stream("POST", "/api/chat/stream", json={"session_id": session_id, "message": "Hello"}) as response:
+        async for data in response.aiter_text():
+            buffer += data
+            *events, buffer = buffer.split("\n\n")
+            for event in events:
+                payload = json.loads(event[event.index("data: ") + len("data: "):])
+                if "error" in payload:
+                    raise RuntimeError(payload["error"])
+                if payload.get("content"):
+                    frames += 1
+                    text.append(payload["content"])
+    return frames, "".join(text)
+
+async def drive(port: int, pid: int, streams: int) -> dict:
+    limits = httpx.Limits(max_connections=streams)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as http:
+        for _ in range(100):
+            try:
+                await http.get("/")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+
+        sessions = []
+        for _ in range(streams):
+            response = await http.post("/api/start_chat", json={"scenario_id": "difficult_news"})
+            sessions.append(response.json()["session_id"])
+
+        cpu_start = process_cpu_seconds(pid)
+        wall_start = time.perf_counter()
+        results = await asyncio.gather(*[read_stream(http, session_id) for session_id in sessions])
+        wall = time.perf_counter() - wall_start
+        cpu = process_cpu_seconds(pid) - cpu_start
+
+    frames = sum(count for count, _ in results)
+    return {
+        "frames": frames,
+        "frames_per_second": frames / wall,
+        "server_cpu_ms_per_stream": cpu / streams * 1000,
+        "wall_seconds": wall,
+        "texts": {text for _, text in results}
+    }
+
+def run_mode(mode: str, args) -> dict:
+    port = free_port()
+    env = dict(
+        os.environ,
+        BENCH_MODE=mode,
+        BENCH_PORT=str(port),
+        BENCH_TOKENS=str(args.tokens),
+        BENCH_CHUNK_INTERVAL=str(args.chunk_interval),
+        CHAT_SESSION_SWEEPER="0",
+        # Measure framing only, without streams waiting for admission
+        LLM_MAX_CONCURRENCY="0",
+        SSE_COALESCE_MS=str(args.coalesce_ms if mode == "coalesced" else 0),
+        SSE_COALESCE_BYTES=str(args.coalesce_bytes if mode == "coalesced" else 0)
+    )
+    server = subprocess.Popen([sys.executable, "-c", SERVER], cwd=API_DIR, env=env, stdout=subprocess.DEVNULL)
+    try:
+        result = asyncio.run(drive(port, server.pid, args.streams))
+    finally:
+        server.terminate()
+        server.wait()
+    result["mode"] = mode
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=100)
+    parser.add_argument("--tokens", type=int, default=300, help="Chunks per stream")
+    parser.add_argument("--chunk-interval", type=float, default=0.002, help="Seconds between upstream chunks")
+    parser.add_argument("--coalesce-ms", type=float, default=20)
+    parser.add_argument("--coalesce-bytes", type=int, default=64)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = [run_mode(mode, args) for mode in ("legacy", "writer", "coalesced")]
+
+    texts = set().union(*(result.pop("texts") for result in results))
+    if len(texts) != 1:
+        raise SystemExit("Modes delivered different text")
+
+    if args.json:
+        print(json.dumps({"args": vars(args), "results": results}, indent=2))
+        return
+
+    print(f"{args.streams} streams x {args.tokens} chunks, {args.chunk_interval * 1000:.1f} ms between chunks, "
+          f"coalescing {args.coalesce_ms:g} ms / {args.coalesce_bytes} chars")
+    for result in results:
+        print(f"  {result['mode']:<10} {result['frames']:>8} frames  {result['frames_per_second']:>9.0f} frames/s  "
+              f"{result['server_cpu_ms_per_stream']:>7.2f} ms server CPU/stream  {result['wall_seconds']:.2f}s")
+
+if __name__ == "__main__":
+    main()
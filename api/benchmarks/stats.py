@@ -0,0 +1,27 @@
+"""
+Summary statistics shared by the benchmarks
+"""
+
+import statistics
+from typing import Dict, List
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """
+    Mean, p50, p95, p99 and max of durations in seconds, in milliseconds
+
+    Percentiles use the nearest-rank method, so they are always observed values.
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def rank(q):
+        return values[min(max(int(q * len(values) + 0.5) - 1, 0), len(values) - 1)] * 1000
+
+    return {
+        "mean": statistics.fmean(values) * 1000,
+        "p50": rank(0.50),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "max": values[-1] * 1000
+    }
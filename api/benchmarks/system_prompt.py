@@ -0,0 +1,54 @@
+"""
+System prompt microbenchmark
+
+Compares building the system prompt on every request with looking up the
+prompt compiled per scenario and step when scenarios load.
+
+Usage:
+    python -m benchmarks.system_prompt --iterations 100000
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from data.scenarios.scenarios import scenarios
+from system_prompts import construct_system_prompt, compile_system_prompts, get_system_prompt, resolve_step
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    compile_system_prompts(scenarios)
+    requests = [
+        (key, data, step_index)
+        for key, data in scenarios.items()
+        for step_index in range(len(data["communication_steps"]))
+    ]
+
+    def rebuild():
+        for key, data, step_index in requests:
+            current_step, current_guidance = resolve_step(data, step_index)
+            construct_system_prompt(data, current_step, current_guidance)
+
+    def cached():
+        for key, data, step_index in requests:
+            get_system_prompt(key, data, step_index)
+
+    rounds = max(args.iterations // len(requests), 1)
+    total = rounds * len(requests)
+    rebuild_us = min(timeit.repeat(rebuild, number=rounds, repeat=3)) / total * 1e6
+    cached_us = min(timeit.repeat(cached, number=rounds, repeat=3)) / total * 1e6
+
+    print(f"{total} prompt lookups across {len(requests)} (scenario, step) pairs")
+    print(f"  rebuild per request: {rebuild_us:.3f} us")
+    print(f"  precompiled lookup:  {cached_us:.3f} us")
+    print(f"  saving per request:  {rebuild_us - cached_us:.3f} us ({rebuild_us / cached_us:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+WebSocket vs SSE turn latency benchmark
+
+Starts the API under uvicorn with a stub upstream, then holds several
+conversations at once and times every turn of each over:
+    sse        POST /api/chat/stream per turn, on a kept-alive HTTP connection
+    websocket  one /api/chat/ws/{session_id} connection per conversation
+
+For each turn it records the time from sending the message to the first delta
+(time to first token as the client sees it) and to the end of the reply, and
+reports percentiles plus the server CPU time per turn (read from /proc, Linux
+only). The WebSocket turns also carry the evaluation message the endpoint sends
+after every user message. Requires the websockets package.
+
+Usage:
+    python -m benchmarks.ws_latency --conversations 20 --turns 20 --tokens 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import websockets
+
+from benchmarks.sse_stream import API_DIR, free_port, process_cpu_seconds
+from benchmarks.stats import percentiles
+
+# Runs in the server process
+SERVER = """
+import os
+import uvicorn
+from app import app
+from openai_provider import OpenAIProvider, get_openai
+from benchmarks.sse_stream import StubStreamingClient
+
+provider = OpenAIProvider(async_client=StubStreamingClient(
+    int(os.environ["BENCH_TOKENS"]), float(os.environ["BENCH_CHUNK_INTERVAL"])
+))
+app.dependency_overrides[get_openai] = lambda: provider
+uvicorn.run(app, host="127.0.0.1", port=int(os.environ["BENCH_PORT"]), log_level="warning")
+"""
+
+async def sse_conversation(http: httpx.AsyncClient, session_id: str, turns: int) -> list:
+    timings = []
+    for turn in range(turns):
+        first = None
+        buffer = ""
+        start = time.perf_counter()
+        body = {"session_id": session_id, "message": f"Message {turn}"}
+        async with http.stream("POST", "/api/chat/stream", json=body) as response:
+            async for data in response.aiter_text():
+                if first is None and '"content": ""' not in data:
+                    first = time.perf_counter()
+                buffer += data
+        if '"done": true' not in buffer:
+            raise RuntimeError(f"SSE turn did not finish: {buffer[-200:]}")
+        timings.append((first - start, time.perf_counter() - start))
+    return timings
+
+async def ws_conversation(port: int, session_id: str, turns: int) -> list:
+    timings = []
+    async with websockets.connect(f"ws://127.0.0.1:{port}/api/chat/ws/{session_id}") as ws:
+        for turn in range(turns):
+            first = None
+            turn_id = f"t{turn}"
+            start = time.perf_counter()
+            await ws.send(json.dumps({"type": "message", "turn_id": turn_id, "message": f"Message {turn}"}))
+            while True:
+                message = json.loads(await ws.recv())
+                if message["type"] == "delta" and first is None:
+                    first = time.perf_counter()
+                elif message["type"] == "error":
+                    raise RuntimeError(message["error"])
+                elif message["type"] == "done" and message["turn_id"] == turn_id:
+                    break
+            timings.append((first - start, time.perf_counter() - start))
+    return timings
+
+async def drive(port: int, pid: int, args) -> list:
+    limits = httpx.Limits(max_connections=args.conversations)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as http:
+        for _ in range(100):
+            try:
+                await http.get("/")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+
+        async def new_sessions():
+            sessions = []
+            for _ in range(args.conversations):
+                response = await http.post("/api/start_chat", json={"scenario_id": "difficult_news"})
+                sessions.append(response.json()["session_id"])
+            return sessions
+
+        transports = {
+            "sse": lambda session_id: sse_conversation(http, session_id, args.turns),
+            "websocket": lambda session_id: ws_conversation(port, session_id, args.turns)
+        }
+        results = []
+        for name, conversation in transports.items():
+            sessions = await new_sessions()
+            cpu_start = process_cpu_seconds(pid)
+            wall_start = time.perf_counter()
+            timings = await asyncio.gather(*[conversation(session_id) for session_id in sessions])
+            wall = time.perf_counter() - wall_start
+            cpu = process_cpu_seconds(pid) - cpu_start
+
+            turns = [timing for conversation_timings in timings for timing in conversation_timings]
+            results.append({
+                "transport": name,
+                "turns": len(turns),
+                "first_delta_ms": percentiles([first for first, _ in turns]),
+                "turn_ms": percentiles([total for _, total in turns]),
+                "server_cpu_ms_per_turn": cpu / len(turns) * 1000,
+                "wall_seconds": wall
+            })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=20, help="Concurrent conversations")
+    parser.add_argument("--turns", type=int, default=20, help="Turns per conversation")
+    parser.add_argument("--tokens", type=int, default=50, help="Chunks per reply")
+    parser.add_argument("--chunk-interval", type=float, default=0.001, help="Seconds between upstream chunks")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    port = free_port()
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "sk-benchmark"),
+        BENCH_PORT=str(port),
+        BENCH_TOKENS=str(args.tokens),
+        BENCH_CHUNK_INTERVAL=str(args.chunk_interval),
+        CHAT_SESSION_SWEEPER="0"
+    )
+    server = subprocess.Popen([sys.executable, "-c", SERVER], cwd=API_DIR, env=env, stdout=subprocess.DEVNULL)
+    try:
+        results = asyncio.run(drive(port, server.pid, args))
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.json:
+        print(json.dumps({"args": vars(args), "results": results}, indent=2))
+        return
+
+    print(f"{args.conversations} conversations x {args.turns} turns, {args.tokens} chunks per reply, "
+          f"{args.chunk_interval * 1000:.1f} ms between chunks")
+    for result in results:
+        first, total = result["first_delta_ms"], result["turn_ms"]
+        print(f"  {result['transport']:<10} first delta p50 {first['p50']:6.2f} p95 {first['p95']:6.2f} ms   "
+              f"turn p50 {total['p50']:6.2f} p95 {total['p95']:6.2f} ms   "
+              f"{result['server_cpu_ms_per_turn']:.2f} ms server CPU/turn")
+
+if __name__ == "__main__":
+    main()
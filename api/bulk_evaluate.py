@@ -0,0 +1,89 @@
+"""
+Bulk Evaluation CLI
+
+Scores exported chat transcripts offline with the same keyword scoring as
+/api/evaluate, spreading the work over a process pool.
+
+Input is JSONL with one transcript per line, in the format returned by
+/api/chat/history/{session_id}:
+    {"session_id": "...", "messages": [...], "scenario": {...}}
+Instead of the full "scenario" object a line may give a "scenario_id", which is
+looked up among the bundled scenarios by key or ID.
+
+Output is NDJSON with one evaluation per line, in input order.
+
+Usage:
+    python bulk_evaluate.py transcripts.jsonl -o results.jsonl --workers 8
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from evaluate_route import generate_basic_feedback
+from scenario_registry import get_registry
+
+def score_line(line: str) -> Optional[Tuple[str, bool]]:
+    """
+    Score one JSONL transcript
+
+    Returns:
+        The NDJSON result line and whether the transcript was scored, or None
+        for blank input lines
+    """
+    if not line.strip():
+        return None
+
+    try:
+        transcript = json.loads(line)
+        scenario_data = transcript.get("scenario") or get_registry().get(transcript.get("scenario_id") or "")
+        if scenario_data is None:
+            raise ValueError(f"Unknown scenario: {transcript.get('scenario_id')}")
+
+        evaluation_results = generate_basic_feedback(scenario_data, transcript["messages"])
+        result = {
+            "session_id": transcript.get("session_id"),
+            "scenario_id": transcript.get("scenario_id") or scenario_data.get("id"),
+            **evaluation_results
+        }
+    except Exception as e:
+        return json.dumps({"error": str(e), "line": line[:200]}), False
+
+    return json.dumps(result), True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of transcripts, or - for stdin")
+    parser.add_argument("-o", "--output", help="NDJSON output file (defaults to stdout)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--chunksize", type=int, default=64, help="Transcripts sent to a worker at a time")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    sink = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+
+    scored = 0
+    failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=get_registry) as pool:
+            for result in pool.map(score_line, source, chunksize=args.chunksize):
+                if result is None:
+                    continue
+                output, ok = result
+                sink.write(output + "\n")
+                scored += 1
+                if not ok:
+                    failed += 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+
+    print(f"Scored {scored} transcripts ({failed} failed)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Chat Context Window
+
+Builds the message list sent to the model for each turn within a per-model token
+budget. The most recent turns are kept verbatim; older turns are folded into a
+single summary message that is cached in the session and only regenerated when
+the window slides past more history.
+
+Token counts use tiktoken when it is installed and fall back to a character
+estimate otherwise. Counts are memoized by message content, so a turn only counts
+the messages that are new since the previous turn.
+"""
+
+import logging
+import os
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Callable, Awaitable
+
+import async_timeout
+
+import admission
+import chat_state
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Prompt token budget per model, leaving room for the 1000-token completion
+MODEL_CONTEXT_BUDGETS = {
+    "gpt-4o": 12000,
+    "gpt-4o-mini": 12000,
+    "gpt-4-turbo": 12000,
+    "gpt-4": 6000,
+    "gpt-3.5-turbo": 3000
+}
+DEFAULT_CONTEXT_BUDGET = int(os.getenv("CHAT_CONTEXT_BUDGET", "8000"))
+
+# When the window slides, recent turns are trimmed to this share of the budget so
+# the summary is regenerated every few turns rather than on every turn
+WINDOW_REFILL_RATIO = float(os.getenv("CHAT_CONTEXT_REFILL_RATIO", "0.75"))
+
+# Tokens reserved for the summary message itself
+SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKENS", "400"))
+SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+
+# Fixed per-message overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+Summarizer = Callable[[Optional[str], List[Dict[str, Any]]], Awaitable[str]]
+
+logger = logging.getLogger(__name__)
+
+_encodings: Dict[str, Any] = {}
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """
+    Count the tokens in a piece of text for a model
+
+    Args:
+        text: The text to count
+        model: The model whose tokenizer should be used
+
+    Returns:
+        Number of tokens
+    """
+    if tiktoken is None:
+        # Roughly four characters per token for English text
+        return len(text) // 4 + 1
+
+    encoding = _encodings.get(model)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        _encodings[model] = encoding
+    return len(encoding.encode(text))
+
+@lru_cache(maxsize=int(os.getenv("CHAT_TOKEN_CACHE_SIZE", "16384")))
+def prompt_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Token count of a prompt or message, memoized because both repeat on every turn"""
+    return count_tokens(text, model) + MESSAGE_OVERHEAD_TOKENS
+
+def message_tokens(message: Dict[str, Any], model: str = "gpt-4o") -> int:
+    """
+    Token count of a message
+
+    Counts are memoized by content rather than stored on the message, so they do
+    not leak into the session history that is persisted and returned to clients.
+
+    Args:
+        message: The message object with 'content'
+        model: The model whose tokenizer should be used
+
+    Returns:
+        Number of tokens including the per-message overhead
+    """
+    return prompt_tokens(message["content"], model)
+
+def get_context_budget(model: str) -> int:
+    """Prompt token budget for a model"""
+    return MODEL_CONTEXT_BUDGETS.get(model, DEFAULT_CONTEXT_BUDGET)
+
+def find_window_start(messages: List[Dict[str, Any]], budget: int, model: str, current_start: int = 0) -> int:
+    """
+    Find the index of the oldest message that is kept verbatim
+
+    The window only ever moves forward. It stays put while the messages from
+    current_start onward fit the budget; once they do not, it slides until the
+    kept messages use at most WINDOW_REFILL_RATIO of the budget. The newest
+    message is always kept.
+
+    Args:
+        messages: The full conversation history
+        budget: Tokens available for verbatim messages
+        model: The model whose tokenizer should be used
+        current_start: Window start used on the previous turn
+
+    Returns:
+        Index of the first message to keep
+    """
+    used = 0
+    refill_limit = int(budget * WINDOW_REFILL_RATIO)
+    refill_start = None
+
+    for index in range(len(messages) - 1, current_start - 1, -1):
+        used += message_tokens(messages[index], model)
+        if used > budget:
+            # Slide forward to the refill point, but never past the newest message
+            return refill_start if refill_start is not None else len(messages) - 1
+        if used <= refill_limit:
+            refill_start = index
+
+    return current_start
+
+def format_transcript(messages: List[Dict[str, Any]]) -> str:
+    """Render messages as a plain transcript for summarization"""
+    speakers = {"user": "Clinician", "assistant": "Patient/Family"}
+    return "\n".join(f"{speakers.get(m['role'], m['role'])}: {m['content']}" for m in messages)
+
+def extractive_summary(previous_summary: Optional[str], messages: List[Dict[str, Any]],
+                       max_chars: int = SUMMARY_TOKEN_BUDGET * 4) -> str:
+    """
+    Cheap summary used when the summarization model is unavailable
+
+    Keeps the previous summary followed by the start of each folded message,
+    truncated to roughly the summary token budget.
+    """
+    parts = [previous_summary] if previous_summary else []
+    parts.extend(f"{m['role']}: {m['content'][:200]}" for m in messages)
+    summary = "\n".join(parts)
+    return summary[-max_chars:]
+
+def make_llm_summarizer(async_client, session_id: str, cohort: Optional[str] = None, timeout: float = 30.0,
+                        model: str = SUMMARY_MODEL) -> Summarizer:
+    """
+    Create a summarizer that folds messages into the running summary with a model call
+
+    The call waits for admission like a chat completion (see admission.py) and
+    retries 429 and 5xx responses. If it is shed, build_context falls back to an
+    extractive summary.
+
+    Args:
+        async_client: The shared AsyncOpenAI client
+        session_id: The session being summarized, for its admission cap
+        cohort: The cohort the session counts against for admission, if any
+        timeout: Seconds allowed for each summarization request
+        model: Model used for summarization
+
+    Returns:
+        Async callable taking the previous summary and the newly folded messages
+    """
+    async def summarize(previous_summary: Optional[str], messages: List[Dict[str, Any]]) -> str:
+        prompt = "Summarize the earlier part of this medical communication training conversation. "
+        prompt += "Keep facts disclosed, emotions expressed, questions asked and commitments made. "
+        prompt += f"Stay under {SUMMARY_TOKEN_BUDGET} tokens.\n\n"
+        if previous_summary:
+            prompt += f"Summary so far:\n{previous_summary}\n\n"
+        prompt += f"New conversation to fold in:\n{format_transcript(messages)}"
+
+        async def complete():
+            async with async_timeout.timeout(timeout):
+                return await async_client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=SUMMARY_TOKEN_BUDGET
+                )
+
+        completion_tokens = None
+        ticket = admission.controller.request(session_id, len(prompt) // 4 + SUMMARY_TOKEN_BUDGET, cohort)
+        try:
+            async for _ in ticket.wait():
+                pass
+            response = await admission.call_with_retries(complete, model)
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                completion_tokens = usage.completion_tokens
+        finally:
+            ticket.release(completion_tokens)
+        return response.choices[0].message.content
+
+    return summarize
+
+async def build_context(session_id: str, session: Dict[str, Any], system_prompt: str, model: str,
+                        summarizer: Optional[Summarizer] = None, step_prompt: str = "") -> List[Dict[str, str]]:
+    """
+    Build the provider message list for the next turn within the model's token budget
+
+    Args:
+        session_id: The session ID
+        session: The session data, including the message just added by the user
+        system_prompt: Stable prompt prefix from get_system_prompt
+        model: The model that will receive the messages
+        summarizer: Folds old messages into the summary; falls back to an extractive summary
+        step_prompt: Guidance for the current step, sent after the history so the prefix stays cacheable
+
+    Returns:
+        Messages ready to send: the system prompt, an optional summary, the recent turns and the step guidance
+    """
+    messages = session["messages"]
+    summary = session.get("history_summary") or {"upto": 0, "content": None}
+
+    budget = get_context_budget(model) - prompt_tokens(system_prompt, model)
+    if step_prompt:
+        budget -= prompt_tokens(step_prompt, model)
+    budget -= SUMMARY_TOKEN_BUDGET
+    start = find_window_start(messages, max(budget, 0), model, summary["upto"])
+
+    # Regenerate the summary only when the window has slid past more history
+    if start > summary["upto"]:
+        folded = messages[summary["upto"]:start]
+        try:
+            if summarizer is None:
+                raise RuntimeError("No summarizer configured")
+            content = await summarizer(summary["content"], folded)
+        except Exception as e:
+            logger.warning("Falling back to extractive summary for session %s: %s", session_id, e)
+            content = extractive_summary(summary["content"], folded)
+
+        summary = {"upto": start, "content": content}
+        chat_state.update_session(session_id, {"history_summary": summary})
+
+    context = [{"role": "system", "content": system_prompt}]
+    if summary["content"]:
+        context.append({
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{summary['content']}"
+        })
+    context.extend(chat_state.get_provider_messages(session)[start:])
+    if step_prompt:
+        context.append({"role": "system", "content": step_prompt})
+    return context
@@ -1,62 +1,40 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
 from pydantic import BaseModel
 import os
 import sys
 from typing import Dict, List, Any, Optional
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+import anyio
 import json
+import logging
 import time
-from openai import OpenAI, AsyncOpenAI
 import asyncio
 import async_timeout
-from dotenv import load_dotenv
-
-# Add the project root to the Python path
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-# Import the scenarios and chat state manager
-try:
-    from data.scenarios.scenarios import scenarios
-    print(f"Scenarios imported successfully in chat_route: {list(scenarios.keys())}")
-except Exception as e:
-    print(f"Error importing scenarios in chat_route: {str(e)}")
-    # Fallback to direct JSON file loading
-    import json
-    try:
-        with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'scenarios', 'scenarios.json')) as f:
-            scenarios = json.load(f)
-        print(f"Loaded scenarios from JSON in chat_route: {list(scenarios.keys())}")
-    except Exception as e2:
-        print(f"Error loading scenarios JSON in chat_route: {str(e2)}")
-        # Create a dummy scenario for testing
-        scenarios = {
-            "difficult_news": {
-                "id": "scenario_01_test",
-                "title": "Test Scenario",
-                "description": "Test scenario for debugging",
-                "ai_role": "Test role",
-                "initial_prompt": "This is a test prompt",
-                "communication_steps": ["Step 1", "Step 2", "Step 3"]
-            }
-        }
-        print("Using dummy test scenario in chat_route")
+from contextlib import aclosing
 
+import admission
 import chat_state
+import metrics
+import response_cache
+import tracing
+from scenario_registry import get_registry
+# construct_system_prompt is re-exported for callers that import it from this module
+from system_prompts import construct_system_prompt, get_system_prompt
+from chat_context import build_context, make_llm_summarizer
+from openai_provider import OpenAIProvider, get_openai
+from stream_replay import start_stream, get_stream, ReplayUnavailable
+from sse import SSEWriter, iter_deltas, write_stream, json_event, DONE_EVENT, COALESCE_INTERVAL, COALESCE_BYTES
 
-# Initialize OpenAI clients directly
-# Load environment variables
-load_dotenv()
+router = APIRouter()
 
-# Get API key from environment variables
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY environment variable is not set")
+logger = logging.getLogger(__name__)
 
-# Initialize OpenAI clients
-client = OpenAI(api_key=api_key)
-async_client = AsyncOpenAI(api_key=api_key)
+# Completion length limit of chat replies
+MAX_TOKENS = 1000
 
-router = APIRouter()
+# Field set on an assistant message that was cut off because the client went away
+TRUNCATED_FIELD = "truncated"
 
 # Request and response models
 class StartChatRequest(BaseModel):
@@ -81,25 +59,13 @@ class ChatStreamRequest(BaseModel):
 @router.post("/api/start_chat", response_model=StartChatResponse, tags=["chat"])
 async def start_chat(request: StartChatRequest):
     """Initialize a new chat session with the selected scenario"""
-    # Find the scenario by ID
-    target_scenario = None
-    scenario_key = None
-    
-    # First check if scenario_id matches a direct key
-    if request.scenario_id in scenarios:
-        target_scenario = scenarios[request.scenario_id]
-        scenario_key = request.scenario_id
-    else:
-        # Otherwise search by the ID field
-        for key, scenario in scenarios.items():
-            if scenario["id"] == request.scenario_id:
-                target_scenario = scenario
-                scenario_key = key
-                break
-    
-    if not target_scenario:
+    # Find the scenario by key, or by its ID field
+    entry = get_registry().resolve(request.scenario_id)
+    if not entry:
         raise HTTPException(status_code=404, detail="Scenario not found")
     
+    scenario_key, target_scenario = entry
+    
     # Create a new chat session
     session_id = chat_state.create_session(scenario_key, target_scenario)
     
@@ -120,185 +86,392 @@ async def start_chat(request: StartChatRequest):
         "communication_steps": target_scenario["communication_steps"]
     }
 
-def construct_system_prompt(scenario_data, current_step=None, current_guidance=""):
-    """
-    Construct a detailed system prompt based on the scenario data
-    """
-    ai_role = scenario_data["ai_role"]
-    description = scenario_data["description"]
-    
-    system_prompt = f"""You are a medical AI assistant simulating a {ai_role} in the following scenario:
-
-{description}
-
-Your role is to provide realistic and empathetic responses that demonstrate effective medical communication techniques.
-Focus on clear explanations, emotional support, and shared decision-making when appropriate.
-Maintain a professional, compassionate tone throughout the conversation.
-Respond to the patient's concerns directly and do not change the subject.
-"""
-
-    # Add current step information if available
-    if current_step:
-        system_prompt += f"""
-Current communication step: {current_step}
-
-Step guidance: {current_guidance}
-
-Please focus on this communication step in your next response.
-"""
-    
-    # Add communication steps as guidelines if available
-    if "communication_steps" in scenario_data and scenario_data["communication_steps"]:
-        system_prompt += "\n\nThe overall communication steps for this scenario are:\n"
-        for i, step in enumerate(scenario_data["communication_steps"], 1):
-            system_prompt += f"{i}. {step}\n"
-            
-    return system_prompt
-
 @router.post("/api/chat", tags=["chat"])
-async def chat(message: ChatMessage):
+async def chat(message: ChatMessage, openai: OpenAIProvider = Depends(get_openai),
+               cohort: Optional[str] = Header(None, alias=admission.COHORT_HEADER)):
     """Send a message to the chat and get a response"""
-    session = chat_state.get_session(message.session_id)
+    with tracing.span("chat.session_lookup"):
+        session = chat_state.get_session(message.session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Chat session not found")
     
-    # Add the user message to the session
-    chat_state.add_message(
-        message.session_id,
-        {
-            "role": "user",
-            "content": message.message
-        }
-    )
+    with tracing.span("chat.persist_user_message"):
+        # Add the user message to the session
+        chat_state.add_message(
+            message.session_id,
+            {
+                "role": "user",
+                "content": message.message
+            }
+        )
+        
+        # Re-read the session so backends that return snapshots include the new message
+        session = chat_state.get_session(message.session_id)
     
     # Get the scenario data
     scenario_data = session["scenario_data"]
     
-    # Construct the system prompt
-    system_prompt = construct_system_prompt(scenario_data)
-    
-    # Prepare the full message history for the API call
-    messages = [{"role": "system", "content": system_prompt}]
+    # Look up the precompiled system prompt
+    with tracing.span("chat.system_prompt"):
+        system_prompt, _ = get_system_prompt(session["scenario_id"], scenario_data)
     
-    # Add the conversation history
-    for msg in session["messages"]:
-        messages.append({"role": msg["role"], "content": msg["content"]})
+    # Fit the conversation history into the model's token budget
+    with tracing.span("chat.history", messages=len(session["messages"])):
+        messages = await build_context(
+            message.session_id,
+            session,
+            system_prompt,
+            "gpt-4o",
+            make_llm_summarizer(openai.async_client, message.session_id, cohort, openai.request_timeout)
+        )
     
+    ticket = None
+    completion_tokens = None
     try:
-        # Send the request to OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            max_tokens=1000
-        )
+        # Wait for a turn upstream; the finally below leaves the queue if the request is cancelled while waiting
+        ticket = admission.controller.request(message.session_id, estimate_tokens(messages), cohort)
+        with tracing.span("llm.queue"):
+            async for _ in ticket.wait():
+                pass
+        
+        async def complete():
+            async with async_timeout.timeout(openai.request_timeout):
+                return await openai.async_client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=messages,
+                    max_tokens=MAX_TOKENS
+                )
+        
+        # Send the request to OpenAI API without blocking the event loop
+        with tracing.span("llm.completion", model="gpt-4o"):
+            response = await admission.call_with_retries(complete, "gpt-4o")
         
         # Extract the response
         ai_response = response.choices[0].message.content
+        metrics.LLM_REQUESTS.labels("gpt-4o", "ok").inc()
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            completion_tokens = usage.completion_tokens
+            metrics.record_tokens("gpt-4o", usage.prompt_tokens, usage.completion_tokens)
         
         # Add the AI's response to the session
-        chat_state.add_message(
-            message.session_id,
-            {
-                "role": "assistant",
-                "content": ai_response
-            }
-        )
+        with tracing.span("chat.persist"):
+            chat_state.add_message(
+                message.session_id,
+                {
+                    "role": "assistant",
+                    "content": ai_response
+                }
+            )
         
         return {
             "response": ai_response
         }
+    except admission.AdmissionRejected as e:
+        metrics.LLM_REQUESTS.labels("gpt-4o", "rejected").inc()
+        raise HTTPException(
+            status_code=429 if e.reason == "rate_limited" else 503,
+            detail=str(e),
+            headers={"Retry-After": str(max(int(e.retry_after), 1))}
+        )
     except Exception as e:
+        metrics.LLM_REQUESTS.labels("gpt-4o", "error").inc()
         raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+    finally:
+        if ticket is not None:
+            ticket.release(completion_tokens)
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    """Tokens a completion counts against the rate limit: the prompt, at four characters per token, plus max_tokens"""
+    return sum(len(message["content"]) for message in messages) // 4 + MAX_TOKENS
+
+def record_stream_metrics(model: str, messages: List[Dict[str, str]], writer: SSEWriter, started: float) -> None:
+    """
+    Record time to first token, token rate and token counts of a streamed completion
+    
+    Streamed responses carry no usage, so each delta counts as one completion
+    token and the prompt is estimated at four characters per token.
+    """
+    if not metrics.METRICS_ENABLED:
+        return
+    
+    if writer.first_delta_at is not None:
+        metrics.LLM_TTFT.labels(model).observe(writer.first_delta_at - started)
+        generating = time.monotonic() - writer.first_delta_at
+        if writer.deltas > 1 and generating > 0:
+            metrics.LLM_TOKEN_RATE.labels(model).observe((writer.deltas - 1) / generating)
+    
+    prompt_characters = sum(len(message["content"]) for message in messages)
+    metrics.record_tokens(model, prompt_characters // 4, writer.deltas)
+
+def record_stream_spans(writer: SSEWriter, connected: float) -> None:
+    """Record the wait for the first token and the rest of the generation as spans"""
+    if tracing.current_span() is None or writer.first_delta_at is None:
+        return
+    
+    last_token = time.monotonic()
+    tracing.record_span("llm.first_token", connected, writer.first_delta_at)
+    tracing.record_span("llm.generate", writer.first_delta_at, last_token, deltas=writer.deltas, frames=writer.frames)
 
-async def stream_openai_response(session_id, messages, model):
-    """Stream the response from OpenAI API"""
+async def stream_completion(session_id, messages, model, openai: OpenAIProvider, writer: SSEWriter,
+                            cache_key: Optional[response_cache.CacheKey] = None, cohort: Optional[str] = None):
+    """
+    Stream a response from OpenAI API as the frames built by writer
+    
+    The complete response is stored in the session history. If the stream is
+    cancelled or closed mid-way, because no client is connected any more, the
+    upstream request is closed so the model stops generating, and the text
+    received so far is stored as an assistant message marked as truncated.
+    Upstream errors are raised to the caller.
+    
+    With a cache key, a cached reply to the same turn is replayed instead of
+    calling the model, and a complete reply from the model is cached.
+    
+    The request waits for admission (see admission.py) before it is sent, with
+    a frame from writer.queue_frame each time its position in the queue changes.
+    
+    Args:
+        session_id: The chat session
+        messages: Context for the model, from build_context
+        model: The model to use
+        openai: The OpenAI provider
+        writer: Frames and optionally coalesces the deltas
+        cache_key: The turn's response cache key, from response_cache.cache_key
+        cohort: The cohort the session counts against for admission, if any
+    """
+    response = None
+    ticket = None
+    frames = None
+    finished = False
+    outcome = "cancelled"
+    started = time.monotonic()
+    cached = response_cache.cache.get(cache_key) if cache_key is not None else None
     try:
-        response = await async_client.chat.completions.create(
-            model=model,
-            messages=messages,
-            stream=True,
-            max_tokens=1000
-        )
+        if cached is not None:
+            deltas = response_cache.replay(cached)
+        else:
+            # Wait for a turn upstream, telling the client where it is in the queue
+            ticket = admission.controller.request(session_id, estimate_tokens(messages), cohort)
+            async for position in ticket.wait():
+                yield writer.queue_frame(position)
+            tracing.record_span("llm.queue", started, time.monotonic())
+            started = time.monotonic()
+            
+            async def open_stream():
+                # Bound the time to open the upstream stream; chunk gaps are bounded by the HTTP read timeout
+                async with async_timeout.timeout(openai.request_timeout):
+                    return await openai.async_client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        stream=True,
+                        max_tokens=MAX_TOKENS
+                    )
+            
+            with tracing.span("llm.connect", model=model):
+                response = await admission.call_with_retries(open_stream, model)
+            connected = time.monotonic()
+            deltas = iter_deltas(response)
         
-        # Initialize the complete response to capture for session history
-        complete_response = ""
+        # Stream each chunk, or each batch of coalesced chunks, as it is ready
+        frames = write_stream(deltas, writer)
+        async for frame in frames:
+            yield frame
+        finished = True
+        outcome = "ok"
         
-        # Stream each chunk as it arrives
-        async for chunk in response:
-            if chunk.choices[0].delta.content:
-                content = chunk.choices[0].delta.content
-                complete_response += content
-                yield f"data: {json.dumps({'content': content})}\n\n"
-                await asyncio.sleep(0)
+        complete_response = writer.text
+        if cached is None:
+            record_stream_metrics(model, messages, writer, started)
+            record_stream_spans(writer, connected)
+            if cache_key is not None:
+                response_cache.cache.put(cache_key, complete_response)
+        else:
+            tracing.record_span("cache.replay", started, time.monotonic(), characters=len(cached))
         
         # Store the complete response in the session history
         if complete_response:
-            chat_state.add_message(
-                session_id,
-                {
-                    "role": "assistant", 
-                    "content": complete_response
-                }
-            )
+            with tracing.span("chat.persist", characters=len(complete_response)):
+                chat_state.add_message(
+                    session_id,
+                    {
+                        "role": "assistant", 
+                        "content": complete_response
+                    }
+                )
+    except admission.AdmissionRejected:
+        finished = True
+        outcome = "rejected"
+        raise
+    except Exception:
+        finished = True
+        outcome = "error"
+        raise
+    finally:
+        if cached is None:
+            metrics.LLM_REQUESTS.labels(model, outcome).inc()
+        close = getattr(response, "close", None) or getattr(response, "aclose", None)
+        # Shielded, because the request's cancel scope may already be cancelled
+        with anyio.CancelScope(shield=True):
+            if frames is not None:
+                await frames.aclose()
+            if close is not None:
+                try:
+                    await close()
+                except Exception as e:
+                    logger.warning("Error closing upstream stream for session %s: %s", session_id, e)
+        
+        if ticket is not None:
+            ticket.release(writer.deltas)
+        
+        if not finished:
+            if response is not None:
+                record_stream_metrics(model, messages, writer, started)
+            partial_response = writer.text
+            # Counted as a cancelled completion in LLM_REQUESTS above
+            logger.info("Stream for session %s stopped after %d characters", session_id, len(partial_response))
+            if partial_response:
+                chat_state.add_message(
+                    session_id,
+                    {
+                        "role": "assistant",
+                        "content": partial_response,
+                        TRUNCATED_FIELD: True
+                    }
+                )
+
+async def stream_openai_response(session_id, messages, model, openai: OpenAIProvider,
+                                 coalesce_interval: float = COALESCE_INTERVAL, coalesce_bytes: int = COALESCE_BYTES,
+                                 cache_key: Optional[response_cache.CacheKey] = None, cohort: Optional[str] = None):
+    """
+    Stream the response from OpenAI API as SSE frames, ending with a done or an error event
+    
+    See stream_completion for how the response is stored and how a stream that
+    is closed early is handled.
+    """
+    writer = SSEWriter(coalesce_interval, coalesce_bytes)
+    try:
+        # Closing this generator closes the completion, which stores the partial reply
+        async with aclosing(stream_completion(session_id, messages, model, openai, writer, cache_key,
+                                                   cohort)) as frames:
+            async for frame in frames:
+                yield frame
             
         # Send an event to signal the end of the stream
-        yield f"data: {json.dumps({'content': '', 'done': True})}\n\n"
+        yield DONE_EVENT
     except Exception as e:
-        error_msg = f"Error: {str(e)}"
-        yield f"data: {json.dumps({'error': error_msg})}\n\n"
+        yield json_event(admission.error_details(e))
 
-@router.post("/api/chat/stream", tags=["chat"])
-async def stream_chat(request: ChatStreamRequest):
-    """Send a message to the chat and get a streaming response"""
-    session = chat_state.get_session(request.session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="Chat session not found")
-    
-    # Update the current step in the session
-    chat_state.update_step(request.session_id, request.current_step)
+def subscription_response(stream, position: int = 0) -> StreamingResponse:
+    """
+    Stream a response's events to one client
     
-    # Add the user message to the session
-    chat_state.add_message(
-        request.session_id,
-        {
-            "role": "user",
-            "content": request.message
-        }
+    Closing the subscription when the client disconnects lets the stream cancel
+    the generation once no client has come back within the grace period.
+    """
+    subscription = stream.subscribe(position)
+    return StreamingResponse(
+        subscription,
+        media_type="text/event-stream",
+        background=BackgroundTask(subscription.aclose)
     )
+
+def resume_stream(session_id: str, last_event_id: Optional[str]) -> StreamingResponse:
+    """Replay the events after last_event_id and follow the session's current stream"""
+    stream = get_stream(session_id)
+    if stream is None:
+        raise HTTPException(status_code=409, detail="No resumable stream for this session; reload the chat history")
+    try:
+        position = stream.position_after(last_event_id)
+    except ReplayUnavailable as e:
+        raise HTTPException(status_code=409, detail=f"{str(e)}; reload the chat history")
+    return subscription_response(stream, position)
+
+async def prepare_turn(session_id: str, message: str, current_step: int, model: str,
+                       openai: OpenAIProvider, cohort: Optional[str] = None) -> List[Dict[str, str]]:
+    """
+    Record a user message and build the model context for the reply
+    
+    Args:
+        session_id: The chat session
+        message: The user's message
+        current_step: Index of the communication step the user is on
+        model: The model that will generate the reply
+        openai: The OpenAI provider, for summarizing long histories
+        cohort: The cohort the session counts against for admission, if any
+    
+    Returns:
+        Messages for the completion request
+    """
+    # Update the current step in the session
+    with tracing.span("chat.persist_user_message"):
+        chat_state.update_step(session_id, current_step)
+        
+        # Add the user message to the session
+        chat_state.add_message(
+            session_id,
+            {
+                "role": "user",
+                "content": message
+            }
+        )
+        
+        # Re-read the session so backends that return snapshots include the new message
+        session = chat_state.get_session(session_id)
     
     # Get the scenario data
     scenario_data = session["scenario_data"]
     
-    # Get the current communication step
-    current_step_index = request.current_step
-    communication_steps = scenario_data.get("communication_steps", [])
-    current_step = communication_steps[current_step_index] if current_step_index < len(communication_steps) else None
-    
-    # Get the guidance cue for the current step
-    guidance_cues = scenario_data.get("guidance_cues", {})
-    current_guidance = guidance_cues.get(current_step, "") if current_step else ""
+    # Look up the precompiled system prompt and the guidance for the current step
+    with tracing.span("chat.system_prompt", step=current_step):
+        system_prompt, step_prompt = get_system_prompt(session["scenario_id"], scenario_data, current_step)
     
-    # Construct the system prompt with current step information
-    system_prompt = construct_system_prompt(scenario_data, current_step, current_guidance)
+    # Fit the conversation history, ending with the new user message, into the model's token budget
+    with tracing.span("chat.history", messages=len(session["messages"])):
+        messages = await build_context(
+            session_id,
+            session,
+            system_prompt,
+            model,
+            make_llm_summarizer(openai.async_client, session_id, cohort, openai.request_timeout),
+            step_prompt
+        )
     
-    # Prepare the full message history for the API call
-    messages = [{"role": "system", "content": system_prompt}]
+    return messages
+
+@router.post("/api/chat/stream", tags=["chat"])
+async def stream_chat(request: ChatStreamRequest, openai: OpenAIProvider = Depends(get_openai),
+                      last_event_id: Optional[str] = Header(None),
+                      cohort: Optional[str] = Header(None, alias=admission.COHORT_HEADER)):
+    """Send a message to the chat and get a streaming response"""
+    with tracing.span("chat.session_lookup"):
+        session = chat_state.get_session(request.session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Chat session not found")
     
-    # Add the conversation history
-    for msg in session["messages"]:
-        # Skip the last message which we just added
-        if msg["role"] == "user" and msg["content"] == request.message:
-            continue
-        messages.append({"role": msg["role"], "content": msg["content"]})
+    # A retried request that carries Last-Event-ID resumes the response already being generated
+    if last_event_id:
+        return resume_stream(request.session_id, last_event_id)
     
-    # Add the new user message at the end
-    messages.append({"role": "user", "content": request.message})
+    messages = await prepare_turn(request.session_id, request.message, request.current_step, request.model, openai,
+                                  cohort)
+    cache_key = response_cache.cache_key(session["scenario_id"], request.current_step, request.model, messages)
     
-    # Return a streaming response
-    return StreamingResponse(
-        stream_openai_response(request.session_id, messages, request.model),
-        media_type="text/event-stream"
+    # Generate in the background so the response survives a dropped connection
+    stream = start_stream(
+        request.session_id,
+        stream_openai_response(request.session_id, messages, request.model, openai, cache_key=cache_key,
+                               cohort=cohort)
     )
+    return subscription_response(stream)
+
+@router.get("/api/chat/stream/{session_id}", tags=["chat"])
+async def resume_chat_stream(session_id: str, last_event_id: Optional[str] = Header(None),
+                             last_event_id_param: Optional[str] = Query(None, alias="last_event_id")):
+    """Reconnect to the session's current streaming response, replaying the events after Last-Event-ID"""
+    if not chat_state.get_session(session_id):
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    
+    return resume_stream(session_id, last_event_id or last_event_id_param)
 
 @router.get("/api/chat/history/{session_id}", tags=["chat"])
 async def get_chat_history(session_id: str):
@@ -311,4 +484,14 @@ async def get_chat_history(session_id: str):
         "session_id": session_id,
         "messages": session["messages"],
         "scenario": session["scenario_data"]
-    } 
\ No newline at end of file
+    }
+
+@router.get("/api/chat/sessions/stats", tags=["chat"])
+async def get_session_stats():
+    """Get memory and eviction statistics for the session store"""
+    return chat_state.get_store_stats()
+
+@router.get("/api/chat/cache/stats", tags=["chat"])
+async def get_response_cache_stats():
+    """Get the size, evictions and per-scenario hit rates of the response cache"""
+    return response_cache.cache.stats()
@@ -0,0 +1,242 @@
+"""
+WebSocket Chat Transport
+
+One persistent connection per chat session that carries every turn, instead of
+a POST and a new SSE response per message. Messages are JSON objects with a
+"type" field.
+
+Client to server:
+    {"type": "message", "turn_id": "t1", "message": "...", "current_step": 0, "model": "gpt-4o"}
+    {"type": "step", "current_step": 1, "completed": true}
+    {"type": "cancel", "turn_id": "t1"}
+    {"type": "evaluate"}
+    {"type": "ping"}
+
+Server to client:
+    {"type": "queued", "turn_id": "t1", "position": 3}       (while waiting for the model, see admission.py)
+    {"type": "delta", "turn_id": "t1", "content": "..."}
+    {"type": "done", "turn_id": "t1"}
+    {"type": "cancelled", "turn_id": "t1"}
+    {"type": "error", "turn_id": "t1", "error": "..."}     (turn_id is absent for protocol errors; errors
+                                                           the client can retry add code and retry_after)
+    {"type": "step", "current_step": 1, "completed_steps": [0, 1]}
+    {"type": "evaluation", ...}                            (the /api/evaluate response, after every user message)
+    {"type": "pong"}
+
+Turns are multiplexed by turn_id: step updates, evaluations and cancels are
+handled while a reply streams, and further messages queue behind the current
+turn so the session history stays in order. A message without current_step
+keeps the step last set with a step message. Deltas are framed and optionally
+coalesced by the same writer as the SSE endpoint (SSE_COALESCE_MS and
+SSE_COALESCE_BYTES). Outgoing messages go through a bounded queue with a single
+sender, so a slow client pauses the upstream read as it does with SSE.
+
+If the session expires or is evicted while the socket is open, messages, step
+updates and evaluations are answered with an error "Chat session not found".
+Binary frames are answered with an error and otherwise ignored.
+
+When the client disconnects, running turns are cancelled, which closes the
+upstream request and stores the partial reply (see stream_completion).
+
+Browsers cannot set headers on a WebSocket, so the cohort used for admission
+control is taken from the X-Cohort header or the cohort query parameter.
+"""
+
+import asyncio
+import json
+import os
+from contextlib import aclosing
+from json.encoder import encode_basestring_ascii
+from typing import Any, Dict, Optional
+
+import anyio
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
+
+import admission
+import chat_state
+import metrics
+import response_cache
+from chat_route import prepare_turn, stream_completion
+from evaluate_route import evaluate_session
+from openai_provider import OpenAIProvider, get_openai
+from sse import SSEWriter, COALESCE_INTERVAL, COALESCE_BYTES
+
+router = APIRouter()
+
+# Outgoing messages buffered before the turns producing them wait for the client
+WS_SEND_QUEUE = int(os.getenv("CHAT_WS_SEND_QUEUE", "64"))
+
+# Close code for an unknown session (4000-4999 are reserved for applications)
+SESSION_NOT_FOUND = 4404
+
+# Sent when the session expires or is evicted while the socket is open
+SESSION_NOT_FOUND_ERROR = "Chat session not found"
+
+class TurnWriter(SSEWriter):
+    """
+    Frames the deltas of one turn as WebSocket delta messages
+    """
+
+    def __init__(self, turn_id: str, interval: float = COALESCE_INTERVAL, max_bytes: int = COALESCE_BYTES):
+        super().__init__(interval, max_bytes)
+        self.turn_id = turn_id
+        # Same text as json.dumps({"type": "delta", "turn_id": turn_id, "content": content})
+        self._prefix = '{"type": "delta", "turn_id": ' + encode_basestring_ascii(turn_id) + ', "content": '
+
+    def frame(self, content: str) -> str:
+        return self._prefix + encode_basestring_ascii(content) + '}'
+
+    def queue_frame(self, position: int) -> str:
+        return json.dumps({"type": "queued", "turn_id": self.turn_id, "position": position})
+
+class ChatConnection:
+    """
+    The state of one chat WebSocket: its running turns and its outgoing queue
+    """
+
+    def __init__(self, websocket: WebSocket, session_id: str, openai: OpenAIProvider, cohort: Optional[str] = None):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.openai = openai
+        self.cohort = cohort
+        self.turns: Dict[str, asyncio.Task] = {}
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE)
+        self._turn_lock = asyncio.Lock()
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        await self._outbox.put(json.dumps(message))
+
+    async def _send_loop(self) -> None:
+        while True:
+            text = await self._outbox.get()
+            await self.websocket.send_text(text)
+
+    async def run(self) -> None:
+        """Handle client messages until the client disconnects"""
+        sender = asyncio.ensure_future(self._send_loop())
+        try:
+            while not sender.done():
+                try:
+                    message = await self.websocket.receive()
+                except WebSocketDisconnect:
+                    break
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("text") is None:
+                    await self.send({"type": "error", "error": "Messages must be sent as text frames"})
+                    continue
+                await self.handle(message["text"])
+        finally:
+            turns = list(self.turns.values())
+            for task in turns:
+                task.cancel()
+            sender.cancel()
+            # Let the cancelled turns store their partial replies before the connection is gone
+            with anyio.CancelScope(shield=True):
+                await asyncio.gather(sender, *turns, return_exceptions=True)
+
+    async def handle(self, text: str) -> None:
+        """Dispatch one client message"""
+        try:
+            data = json.loads(text)
+            kind = data["type"]
+        except (ValueError, TypeError, KeyError):
+            await self.send({"type": "error", "error": "Messages must be JSON objects with a type"})
+            return
+
+        try:
+            await self.dispatch(kind, data)
+        except (ValueError, TypeError) as e:
+            await self.send({"type": "error", "error": f"Invalid {kind} message: {str(e)}"})
+
+    async def dispatch(self, kind: str, data: Dict[str, Any]) -> None:
+        if kind == "message":
+            turn_id = data.get("turn_id")
+            if not isinstance(turn_id, str) or not turn_id or turn_id in self.turns:
+                await self.send({"type": "error", "error": "A message needs a turn_id that is not in use"})
+                return
+            if not isinstance(data.get("message"), str):
+                await self.send({"type": "error", "turn_id": turn_id, "error": "A message needs a message text"})
+                return
+            current_step = data.get("current_step")
+            task = asyncio.ensure_future(self.run_turn(
+                turn_id, data["message"], None if current_step is None else int(current_step),
+                data.get("model", "gpt-4o")
+            ))
+            self.turns[turn_id] = task
+            task.add_done_callback(lambda _task: self.turns.pop(turn_id, None))
+
+        elif kind == "cancel":
+            task = self.turns.get(data.get("turn_id"))
+            if task is not None:
+                task.cancel()
+                await self.send({"type": "cancelled", "turn_id": data["turn_id"]})
+
+        elif kind == "step":
+            chat_state.update_step(self.session_id, int(data.get("current_step", 0)), bool(data.get("completed")))
+            session = chat_state.get_session(self.session_id)
+            if session is None:
+                await self.send({"type": "error", "error": SESSION_NOT_FOUND_ERROR})
+                return
+            await self.send({
+                "type": "step",
+                "current_step": session["current_step"],
+                "completed_steps": session["completed_steps"]
+            })
+
+        elif kind == "evaluate":
+            await self.send_evaluation()
+
+        elif kind == "ping":
+            await self.send({"type": "pong"})
+
+        else:
+            await self.send({"type": "error", "error": f"Unknown message type: {kind}"})
+
+    async def send_evaluation(self) -> None:
+        session = chat_state.get_session(self.session_id)
+        if session is None:
+            await self.send({"type": "error", "error": SESSION_NOT_FOUND_ERROR})
+            return
+        await self.send({"type": "evaluation", **evaluate_session(self.session_id, session)})
+
+    async def run_turn(self, turn_id: str, message: str, current_step: Optional[int], model: str) -> None:
+        """Record a user message and stream the reply to it"""
+        try:
+            # One turn at a time, so each reply sees the messages before it
+            async with self._turn_lock:
+                session = chat_state.get_session(self.session_id)
+                if session is None:
+                    await self.send({"type": "error", "turn_id": turn_id, "error": SESSION_NOT_FOUND_ERROR})
+                    return
+                if current_step is None:
+                    current_step = session["current_step"]
+                messages = await prepare_turn(self.session_id, message, current_step, model, self.openai,
+                                              self.cohort)
+                cache_key = response_cache.cache_key(session["scenario_id"], current_step, model, messages)
+                # The evaluation only depends on the user's messages, so it is final before the reply starts
+                await self.send_evaluation()
+
+                writer = TurnWriter(turn_id)
+                async with aclosing(stream_completion(self.session_id, messages, model, self.openai, writer,
+                                                   cache_key, self.cohort)) as frames:
+                    async for frame in frames:
+                        await self._outbox.put(frame)
+                await self.send({"type": "done", "turn_id": turn_id})
+        except Exception as e:
+            await self.send({"type": "error", "turn_id": turn_id, **admission.error_details(e)})
+
+@router.websocket("/api/chat/ws/{session_id}")
+async def chat_socket(websocket: WebSocket, session_id: str, openai: OpenAIProvider = Depends(get_openai)):
+    """Chat over one WebSocket: user messages, streamed replies, step updates and evaluations"""
+    if not chat_state.get_session(session_id):
+        await websocket.close(code=SESSION_NOT_FOUND)
+        return
+
+    await websocket.accept()
+    metrics.WEBSOCKET_CONNECTIONS.inc()
+    try:
+        cohort = websocket.headers.get(admission.COHORT_HEADER) or websocket.query_params.get("cohort")
+        await ChatConnection(websocket, session_id, openai, cohort).run()
+    finally:
+        metrics.WEBSOCKET_CONNECTIONS.dec()
@@ -1,16 +1,45 @@
 """
 Chat State Manager
 
-Simple in-memory storage for managing chat sessions.
-In a production environment, this would typically use a proper database.
+Storage for managing chat sessions.
+Sessions are held in a pluggable backend (see session_store.py). The default
+in-memory store expires idle sessions and evicts the least recently used ones,
+so memory stays flat under sustained load; the SQLite backend lets several
+worker processes share the same sessions.
 """
 
+import threading
 import uuid
+from collections import OrderedDict
 from datetime import datetime
 from typing import Dict, Any, Optional, List
 
-# In-memory store for chat sessions
-chat_sessions = {}
+from session_store import SessionBackend, create_store
+from keyword_index import KeywordIndex, get_keyword_index
+
+# Session backend, selected by CHAT_SESSION_BACKEND
+store: SessionBackend = create_store()
+
+# session_id -> provider-ready message array (see get_provider_messages), in access order
+_provider_messages: "OrderedDict[str, List[Dict[str, str]]]" = OrderedDict()
+_provider_messages_lock = threading.Lock()
+
+def configure_store(backend: SessionBackend) -> SessionBackend:
+    """
+    Replace the session backend
+    
+    Args:
+        backend: The backend that should hold sessions from now on
+        
+    Returns:
+        The previous backend, which the caller is responsible for closing
+    """
+    global store
+    previous = store
+    store = backend
+    with _provider_messages_lock:
+        _provider_messages.clear()
+    return previous
 
 def create_session(scenario_id: str, scenario_data: Dict[str, Any]) -> str:
     """
@@ -25,7 +54,7 @@ def create_session(scenario_id: str, scenario_data: Dict[str, Any]) -> str:
     """
     session_id = str(uuid.uuid4())
     
-    chat_sessions[session_id] = {
+    store.put(session_id, {
         "session_id": session_id,
         "scenario_id": scenario_id,
         "created_at": datetime.now().isoformat(),
@@ -33,8 +62,9 @@ def create_session(scenario_id: str, scenario_data: Dict[str, Any]) -> str:
         "messages": [],
         "current_step": 0,
         "completed_steps": [],
+        "evaluation_state": new_evaluation_state(get_keyword_index(scenario_data)),
         "active": True
-    }
+    })
     
     return session_id
 
@@ -48,7 +78,7 @@ def get_session(session_id: str) -> Optional[Dict[str, Any]]:
     Returns:
         The session data or None if not found
     """
-    return chat_sessions.get(session_id)
+    return store.get(session_id)
 
 def add_message(session_id: str, message: Dict[str, Any]) -> bool:
     """
@@ -56,18 +86,123 @@ def add_message(session_id: str, message: Dict[str, Any]) -> bool:
     
     Args:
         session_id: The session ID
-        message: The message object with at least 'role' and 'content'
+        message: The message object with at least 'role' and 'content'.
+            A stable 'id' is assigned if the message does not have one.
         
     Returns:
         True if successful, False if session not found
     """
-    session = get_session(session_id)
-    if not session:
+    message.setdefault("id", str(uuid.uuid4()))
+    if not store.append_message(session_id, message):
         return False
     
-    session["messages"].append(message)
+    # Keep keyword matches current so evaluation never rescans the conversation
+    if message.get("role") == "user":
+        _update_evaluation_state(session_id, message["content"])
+    
     return True
 
+def new_evaluation_state(keyword_index: KeywordIndex) -> Dict[str, Any]:
+    """
+    Create the incremental evaluation state for a session with no user messages
+    
+    Args:
+        keyword_index: The scenario's compiled keyword index
+        
+    Returns:
+        State holding the matched keyword indexes per step and the transcript tail
+    """
+    return {
+        "matched": [[] for _ in keyword_index.steps],
+        "tail": None,
+        "user_messages": 0
+    }
+
+def _update_evaluation_state(session_id: str, content: str) -> None:
+    # Read and write the state in one step, so concurrent appends cannot lose each other's matches
+    store.update(session_id, lambda session: {"evaluation_state": _next_evaluation_state(session, content)})
+
+def _next_evaluation_state(session: Dict[str, Any], content: str) -> Dict[str, Any]:
+    keyword_index = get_keyword_index(session["scenario_data"])
+    state = session.get("evaluation_state")
+    
+    if state is None:
+        # Sessions stored before incremental evaluation existed are scanned once in full
+        state = new_evaluation_state(keyword_index)
+        previous = [msg["content"] for msg in session["messages"][:-1] if msg["role"] == "user"]
+        if previous:
+            found, tail = keyword_index.find_appended(None, " ".join(previous).lower())
+            for step_index, keyword_position in found:
+                state["matched"][step_index].append(keyword_position)
+            state["tail"] = tail
+            state["user_messages"] = len(previous)
+    
+    # Only the new message (and the end of the transcript before it) is scanned
+    found, tail = keyword_index.find_appended(state["tail"], content.lower())
+    matched = [list(step_matched) for step_matched in state["matched"]]
+    for step_index, keyword_position in found:
+        if keyword_position not in matched[step_index]:
+            matched[step_index].append(keyword_position)
+    
+    return {
+        "matched": matched,
+        "tail": tail,
+        "user_messages": state["user_messages"] + 1
+    }
+
+def get_step_matches(session: Dict[str, Any]) -> Optional[List[List[str]]]:
+    """
+    Get the keywords matched so far for each communication step
+    
+    Args:
+        session: The session data
+        
+    Returns:
+        For each step, the matched keywords in scenario order, or None if the
+        session has no incremental evaluation state
+    """
+    state = session.get("evaluation_state")
+    if state is None:
+        return None
+    
+    keyword_index = get_keyword_index(session["scenario_data"])
+    return [
+        [keywords[position] for position in sorted(step_matched)]
+        for keywords, step_matched in zip(keyword_index.step_keywords, state["matched"])
+    ]
+
+def get_provider_messages(session: Dict[str, Any]) -> List[Dict[str, str]]:
+    """
+    Get the session history in the format expected by the chat completions API
+    
+    The array is kept in a per-process cache beside the store and extended with
+    only the messages added since the last call, so assembling a request never
+    rescans the history. Its indexes line up with session["messages"]. The cache
+    holds as many sessions as the store, least recently used first out.
+    
+    Args:
+        session: The session data
+        
+    Returns:
+        List of {'role', 'content'} dicts, one per message
+    """
+    session_id = session["session_id"]
+    messages = session["messages"]
+    with _provider_messages_lock:
+        provider_messages = _provider_messages.get(session_id)
+        if provider_messages is None or len(provider_messages) > len(messages):
+            provider_messages = []
+        _provider_messages[session_id] = provider_messages
+        _provider_messages.move_to_end(session_id)
+        limit = getattr(store, "max_sessions", 0)
+        while limit and len(_provider_messages) > limit:
+            _provider_messages.popitem(last=False)
+        
+        for msg in messages[len(provider_messages):]:
+            provider_messages.append({"role": msg["role"], "content": msg["content"]})
+        
+        return provider_messages
+
 def update_step(session_id: str, step_index: int, completed: bool = False) -> bool:
     """
     Update the current step in a chat session
@@ -84,12 +219,25 @@ def update_step(session_id: str, step_index: int, completed: bool = False) -> bo
     if not session:
         return False
     
-    session["current_step"] = step_index
+    fields = {"current_step": step_index}
     
     if completed and step_index not in session["completed_steps"]:
-        session["completed_steps"].append(step_index)
+        fields["completed_steps"] = session["completed_steps"] + [step_index]
     
-    return True
+    return store.update_fields(session_id, fields)
+
+def update_session(session_id: str, fields: Dict[str, Any]) -> bool:
+    """
+    Update top-level fields of a chat session other than its messages
+    
+    Args:
+        session_id: The session ID
+        fields: Field names and their new values
+        
+    Returns:
+        True if successful, False if session not found
+    """
+    return store.update_fields(session_id, fields)
 
 def get_active_sessions() -> List[Dict[str, Any]]:
     """
@@ -98,7 +246,48 @@ def get_active_sessions() -> List[Dict[str, Any]]:
     Returns:
         List of active sessions
     """
-    return [session for session in chat_sessions.values() if session.get("active", True)]
+    return [session for session in store.values() if session.get("active", True)]
+
+def _local_naive(value: datetime) -> datetime:
+    # Session timestamps are naive local time, so convert aware datetimes before comparing
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+
+def find_sessions(scenario_id: Optional[str] = None, created_after: Optional[datetime] = None,
+                  created_before: Optional[datetime] = None) -> List[str]:
+    """
+    Find the IDs of sessions matching a scenario and creation date range
+    
+    Only the session records are read, so matching does not reset the sessions'
+    idle TTL or load their message histories. Blocks on the SQLite backend, so
+    call it from a worker thread in async code.
+    
+    Args:
+        scenario_id: Scenario key or scenario ID to match, or None for any scenario
+        created_after: Only include sessions created at or after this time
+        created_before: Only include sessions created before this time
+        
+    Returns:
+        Matching session IDs, oldest first
+    """
+    matches = []
+    for session_id, created in store.scan(scenario_id or None):
+        created_at = datetime.fromisoformat(created)
+        if created_after and created_at < _local_naive(created_after):
+            continue
+        if created_before and created_at >= _local_naive(created_before):
+            continue
+        matches.append((created_at, session_id))
+    
+    return [session_id for _, session_id in sorted(matches)]
+
+def count_active_sessions() -> int:
+    """
+    Count active chat sessions without scanning the store
+    
+    Returns:
+        Number of active sessions
+    """
+    return store.active_count()
 
 def close_session(session_id: str) -> bool:
     """
@@ -110,9 +299,43 @@ def close_session(session_id: str) -> bool:
     Returns:
         True if successful, False if session not found
     """
-    session = get_session(session_id)
-    if not session:
-        return False
+    return store.set_active(session_id, False)
+
+def delete_session(session_id: str) -> bool:
+    """
+    Remove a chat session and free its memory
+    
+    Args:
+        session_id: The session ID to delete
+        
+    Returns:
+        True if successful, False if session not found
+    """
+    with _provider_messages_lock:
+        _provider_messages.pop(session_id, None)
+    return store.delete(session_id)
+
+def get_store_stats() -> Dict[str, Any]:
+    """
+    Get memory and eviction statistics for the session store
     
-    session["active"] = False
-    return True 
\ No newline at end of file
+    Returns:
+        Dictionary of store statistics
+    """
+    return store.stats()
+
+def start_sweeper(interval: Optional[float] = None) -> None:
+    """
+    Start the background thread that removes expired sessions
+    
+    Args:
+        interval: Seconds between sweeps, defaults to CHAT_SESSION_SWEEP_SECONDS
+    """
+    if interval is None:
+        store.start_sweeper()
+    else:
+        store.start_sweeper(interval)
+
+def stop_sweeper() -> None:
+    """Stop the background session sweeper"""
+    store.stop_sweeper() 
\ No newline at end of file
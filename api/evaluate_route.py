@@ -1,10 +1,15 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import re
-from typing import List, Dict, Any
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterator
+import json
 
 # Import chat state to access conversation history
 import chat_state
+import metrics
+from keyword_index import KeywordIndex, get_keyword_index
 
 router = APIRouter()
 
@@ -12,6 +17,13 @@ class EvaluationRequest(BaseModel):
     """Request model for evaluation endpoint"""
     session_id: str
 
+class BatchEvaluationRequest(BaseModel):
+    """Request model for batch evaluation; session_ids takes precedence over the filters"""
+    session_ids: Optional[List[str]] = None
+    scenario_id: Optional[str] = None
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+
 class StepEvaluation(BaseModel):
     """Evaluation result for a single communication step"""
     step_name: str
@@ -42,25 +54,29 @@ def generate_basic_feedback(scenario_data: Dict[str, Any], conversation_history:
     user_messages = [msg["content"] for msg in conversation_history if msg["role"] == "user"]
     all_user_text = " ".join(user_messages).lower()
     
-    steps = scenario_data.get("communication_steps", [])
-    evaluation_keywords = scenario_data.get("evaluation_keywords", {})
+    # Find every step's whole-word keyword matches in a single pass
+    keyword_index = get_keyword_index(scenario_data)
+    return score_step_matches(keyword_index, keyword_index.match(all_user_text))
+
+def score_step_matches(keyword_index: KeywordIndex, step_matches: List[List[str]]) -> Dict[str, Any]:
+    """
+    Score each communication step from its matched keywords and build the feedback text
+    
+    Args:
+        keyword_index: The scenario's compiled keyword index
+        step_matches: For each step, the keywords found in the user's messages
+    
+    Returns:
+        Dictionary with evaluation results
+    """
+    steps = keyword_index.steps
     
     # Results for each step
     steps_evaluation = []
     total_score = 0.0
     
     # Evaluate each communication step
-    for step in steps:
-        # Get keywords for the current step
-        step_keywords = evaluation_keywords.get(step, [])
-        
-        # Check if any of the keywords are in the user messages
-        matching_keywords = []
-        for keyword in step_keywords:
-            # Use regex to search for the whole word or phrase
-            if re.search(r'\b' + re.escape(keyword.lower()) + r'\b', all_user_text):
-                matching_keywords.append(keyword)
-        
+    for step, step_keywords, matching_keywords in zip(steps, keyword_index.step_keywords, step_matches):
         # Calculate step score based on number of matching keywords
         keywords_found = len(matching_keywords) > 0
         step_score = len(matching_keywords) / len(step_keywords) if step_keywords else 0.0
@@ -124,28 +140,81 @@ def generate_basic_feedback(scenario_data: Dict[str, Any], conversation_history:
         "feedback": feedback_text
     }
 
-@router.post("/api/evaluate", response_model=EvaluationResponse, tags=["evaluation"])
-async def evaluate_conversation(request: EvaluationRequest):
-    """
-    Evaluate a conversation based on scenario communication steps and keywords
+def evaluate_session(session_id: str, session: Dict[str, Any]) -> Dict[str, Any]:
     """
-    # Get the session
-    session = chat_state.get_session(request.session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="Chat session not found")
+    Evaluate a stored chat session
     
+    Args:
+        session_id: The session ID
+        session: The session data
+    
+    Returns:
+        Evaluation response for the session
+    """
     # Get the scenario data and conversation history
     scenario_data = session["scenario_data"]
     conversation_history = session["messages"]
     
-    # Generate feedback
-    evaluation_results = generate_basic_feedback(scenario_data, conversation_history)
+    with metrics.EVALUATION_DURATION.time():
+        # Read the keyword matches kept up to date as messages arrive, or rescan if there are none
+        step_matches = chat_state.get_step_matches(session)
+        if step_matches is None:
+            evaluation_results = generate_basic_feedback(scenario_data, conversation_history)
+        else:
+            evaluation_results = score_step_matches(get_keyword_index(scenario_data), step_matches)
     
-    # Return the evaluation response
     return {
-        "session_id": request.session_id,
+        "session_id": session_id,
         "scenario_id": session["scenario_id"],
         "steps_evaluation": evaluation_results["steps_evaluation"],
         "overall_score": evaluation_results["overall_score"],
         "feedback": evaluation_results["feedback"]
-    } 
\ No newline at end of file
+    }
+
+@router.post("/api/evaluate", response_model=EvaluationResponse, tags=["evaluation"])
+async def evaluate_conversation(request: EvaluationRequest):
+    """
+    Evaluate a conversation based on scenario communication steps and keywords
+    """
+    # Get the session
+    session = chat_state.get_session(request.session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    
+    return evaluate_session(request.session_id, session)
+
+def iter_batch_evaluations(session_ids: List[str]) -> Iterator[bytes]:
+    """Yield one NDJSON line per session, in the order requested"""
+    for session_id in session_ids:
+        session = chat_state.get_session(session_id)
+        if not session:
+            result = {"session_id": session_id, "error": "Chat session not found"}
+        else:
+            result = evaluate_session(session_id, session)
+        yield (json.dumps(result) + "\n").encode("utf-8")
+
+@router.post("/api/evaluate/batch", tags=["evaluation"])
+async def evaluate_batch(request: BatchEvaluationRequest):
+    """
+    Evaluate many conversations at once, streaming one JSON result per line (NDJSON)
+    
+    Sessions are selected by explicit IDs, or by scenario and creation date.
+    At least one of these is required, so a bare request cannot score every session.
+    """
+    if request.session_ids is not None:
+        session_ids = request.session_ids
+    elif request.scenario_id or request.created_after or request.created_before:
+        session_ids = await run_in_threadpool(
+            chat_state.find_sessions,
+            scenario_id=request.scenario_id,
+            created_after=request.created_after,
+            created_before=request.created_before
+        )
+    else:
+        raise HTTPException(
+            status_code=400,
+            detail="Pass session_ids, or at least one of scenario_id, created_after and created_before"
+        )
+    
+    # A sync generator is iterated in the threadpool, keeping scoring off the event loop
+    return StreamingResponse(iter_batch_evaluations(session_ids), media_type="application/x-ndjson")
@@ -0,0 +1,137 @@
+"""
+HTTP Caching
+
+Pre-serialized JSON responses for data that only changes when it is redeployed
+or reloaded, such as the scenario endpoints. Each payload is encoded once, in
+identity, gzip and (when the brotli package is installed) brotli form, and is
+served with a strong ETag and Cache-Control. Requests whose If-None-Match
+matches get an empty 304, so a page load that already has the data costs no
+JSON or compression work at all.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Seconds clients and proxies may reuse a response before revalidating it
+CACHE_MAX_AGE = int(os.getenv("SCENARIO_CACHE_MAX_AGE", "60"))
+
+# Smaller bodies are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+class EncodedResponse:
+    """
+    One JSON payload serialized and compressed ahead of time
+    """
+
+    def __init__(self, content: Any, version: str, max_age: int = CACHE_MAX_AGE):
+        """
+        Args:
+            content: JSON-serializable payload
+            version: Version of the data the payload comes from, e.g. the scenario registry version
+            max_age: Cache-Control max-age in seconds
+        """
+        # Same encoding as FastAPI's JSONResponse
+        body = json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+        tag = f"{version}-{hashlib.sha256(body).hexdigest()[:16]}"
+
+        # content-coding -> (body, strong ETag); each encoding is its own representation
+        self.encodings: Dict[str, Tuple[bytes, str]] = {"identity": (body, f'"{tag}"')}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.encodings["gzip"] = (compressed, f'"{tag}-gzip"')
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.encodings["br"] = (compressed, f'"{tag}-br"')
+
+        self.etags = {etag for _, etag in self.encodings.values()}
+        self.cache_control = f"public, max-age={max_age}"
+
+    def choose_encoding(self, accept_encoding: str) -> str:
+        """
+        Pick the smallest available encoding the client accepts
+
+        Args:
+            accept_encoding: The Accept-Encoding request header
+
+        Returns:
+            "br", "gzip" or "identity"
+        """
+        accepted = set()
+        for item in accept_encoding.split(","):
+            coding, _, params = item.strip().partition(";")
+            quality = params.strip()
+            if quality.startswith("q=") and quality[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+                continue
+            accepted.add(coding.strip().lower())
+
+        for coding in ("br", "gzip"):
+            if coding in self.encodings and (coding in accepted or "*" in accepted):
+                return coding
+        return "identity"
+
+    def matches(self, if_none_match: str) -> bool:
+        """Whether an If-None-Match header names any representation of this payload"""
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison, as If-None-Match requires
+        return any(tag.strip().removeprefix("W/") in self.etags for tag in if_none_match.split(","))
+
+    def respond(self, request: Request) -> Response:
+        """
+        Build the response for a request, honouring If-None-Match and Accept-Encoding
+        """
+        coding = self.choose_encoding(request.headers.get("accept-encoding", ""))
+        body, etag = self.encodings[coding]
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+
+        if self.matches(request.headers.get("if-none-match", "")):
+            return Response(status_code=304, headers=headers)
+
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+class ResponseCache:
+    """
+    EncodedResponse per payload object, discarded whenever the data version changes
+
+    Payloads are keyed by object identity: they are the shared, frozen objects of
+    the current version, so their ids stay valid until the version changes.
+    """
+
+    def __init__(self):
+        self._version: Optional[str] = None
+        self._responses: Dict[int, Tuple[Any, EncodedResponse]] = {}
+
+    def get(self, content: Any, version: str) -> EncodedResponse:
+        """
+        The encoded form of a payload, encoding it on first use
+
+        Args:
+            content: The payload object
+            version: Version of the data the payload belongs to
+        """
+        if version != self._version:
+            # Replace rather than clear, so a concurrent reader never sees a half-reset cache
+            self._responses = {}
+            self._version = version
+
+        entry = self._responses.get(id(content))
+        if entry is None or entry[0] is not content:
+            # Keep a reference to the payload so its id cannot be reused while cached
+            entry = (content, EncodedResponse(content, version))
+            self._responses[id(content)] = entry
+        return entry[1]
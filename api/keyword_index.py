@@ -0,0 +1,238 @@
+"""
+Keyword Index
+
+Aho-Corasick automaton over every evaluation keyword of a scenario. The
+automaton is built once per scenario and finds the matches for all steps in a
+single linear pass over the transcript, instead of compiling and running one
+regular expression per keyword.
+
+Matches follow the same whole-word rule as the previous r'\\b' + keyword + r'\\b'
+search: the characters on either side of the match must differ in "wordness"
+from the first and last characters of the keyword.
+"""
+
+from collections import deque
+from typing import Dict, List, Any, Tuple, Set, Optional
+
+def is_word_char(char: str) -> bool:
+    """Whether a character counts as a word character for \\b boundaries"""
+    return char.isalnum() or char == "_"
+
+def at_boundary(text: str, position: int) -> bool:
+    """Whether a \\b word boundary falls between text[position - 1] and text[position]"""
+    before = position > 0 and is_word_char(text[position - 1])
+    after = position < len(text) and is_word_char(text[position])
+    return before != after
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton mapping lowercase patterns to arbitrary payloads
+    """
+
+    def __init__(self, patterns: List[Tuple[str, Any]]):
+        """
+        Args:
+            patterns: (pattern, payload) pairs; patterns are matched case-insensitively
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # For each state, the (pattern length, payload) pairs that end there
+        self._output: List[List[Tuple[int, Any]]] = [[]]
+
+        for pattern, payload in patterns:
+            pattern = pattern.lower()
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append((len(pattern), payload))
+
+        self._build_failure_links()
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                # Inherit the matches of the longest proper suffix
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    @property
+    def state_count(self) -> int:
+        return len(self._goto)
+
+    def iter_matches(self, text: str):
+        """
+        Yield (start, end, payload) for every occurrence of a pattern in lowercase text
+
+        Args:
+            text: Lowercase text to scan
+
+        Yields:
+            Start and end offsets of the match in text, and its payload
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                end = position + 1
+                for length, payload in output[state]:
+                    yield end - length, end, payload
+
+class KeywordIndex:
+    """
+    Evaluation keywords of one scenario compiled into a single automaton
+    """
+
+    def __init__(self, scenario_data: Dict[str, Any]):
+        """
+        Args:
+            scenario_data: The scenario data including steps and evaluation keywords
+        """
+        self.steps: List[str] = list(scenario_data.get("communication_steps", []))
+        evaluation_keywords = scenario_data.get("evaluation_keywords", {})
+        self.step_keywords: List[List[str]] = [list(evaluation_keywords.get(step, [])) for step in self.steps]
+        self.max_keyword_length = max(
+            (len(keyword) for keywords in self.step_keywords for keyword in keywords), default=0
+        )
+        self.automaton = KeywordAutomaton([
+            (keyword, (step_index, keyword_index))
+            for step_index, keywords in enumerate(self.step_keywords)
+            for keyword_index, keyword in enumerate(keywords)
+        ])
+
+    def find(self, text: str, min_end: int = 0) -> Set[Tuple[int, int]]:
+        """
+        Find every keyword that occurs as a whole word or phrase in text
+
+        Args:
+            text: Lowercase text to scan
+            min_end: Ignore matches that end at or before this offset
+
+        Returns:
+            Set of (step_index, keyword_index) pairs that matched
+        """
+        found = set()
+        for start, end, key in self.automaton.iter_matches(text):
+            if end > min_end and key not in found and at_boundary(text, start) and at_boundary(text, end):
+                found.add(key)
+        return found
+
+    def find_appended(self, tail: Optional[str], text: str) -> Tuple[Set[Tuple[int, int]], str]:
+        """
+        Find the keywords completed by appending text to a transcript
+
+        Transcripts are user messages joined with a space. Only the end of the
+        transcript so far is needed: keywords that cross into the new text start
+        within the last max_keyword_length characters, and one more character is
+        kept so the word boundary before them can still be checked.
+
+        Args:
+            tail: Last characters of the lowercase transcript so far, or None if it is empty
+            text: Lowercase text being appended
+
+        Returns:
+            The (step_index, keyword_index) pairs whose match ends in the new text,
+            and the tail to pass with the next message
+        """
+        if tail is None:
+            combined, min_end = text, 0
+        else:
+            combined = tail + " " + text
+            # Matches ending inside the old tail were already counted, and may start at a cut-off word
+            min_end = len(tail)
+
+        found = self.find(combined, min_end)
+        return found, combined[-(self.max_keyword_length + 1):]
+
+    def matching_keywords(self, found: Set[Tuple[int, int]]) -> List[List[str]]:
+        """
+        Group matched keywords per step, in the order they are listed in the scenario
+        """
+        return [
+            [keyword for keyword_index, keyword in enumerate(keywords) if (step_index, keyword_index) in found]
+            for step_index, keywords in enumerate(self.step_keywords)
+        ]
+
+    def match(self, text: str) -> List[List[str]]:
+        """
+        Match text against every step's keywords in one pass
+
+        Args:
+            text: Lowercase text to scan
+
+        Returns:
+            For each step, the keywords found in text
+        """
+        return self.matching_keywords(self.find(text))
+
+def keyword_signature(scenario_data: Dict[str, Any]) -> Tuple:
+    """The parts of a scenario a keyword index is built from, in comparable form"""
+    steps = tuple(scenario_data.get("communication_steps", []))
+    evaluation_keywords = scenario_data.get("evaluation_keywords", {})
+    return steps, tuple(tuple(evaluation_keywords.get(step, [])) for step in steps)
+
+# (scenario ID, keyword signature) -> compiled index
+_indexes: Dict[Tuple[Any, Tuple], KeywordIndex] = {}
+
+def build_keyword_indexes(scenarios: Dict[str, Dict[str, Any]]) -> int:
+    """
+    Compile the keyword index of every scenario, replacing the previous indexes
+
+    Call this whenever the scenario collection is loaded or changes.
+
+    Returns:
+        Number of indexes built
+    """
+    global _indexes
+    _indexes = {
+        (scenario["id"], keyword_signature(scenario)): KeywordIndex(scenario)
+        for scenario in scenarios.values()
+    }
+    return len(_indexes)
+
+def get_keyword_index(scenario_data: Dict[str, Any]) -> KeywordIndex:
+    """
+    Get the compiled keyword index for a scenario, building it on first use
+
+    Sessions keep the scenario data they started with, which may be an older
+    version of a reloaded scenario, so indexes are cached per scenario ID and
+    per set of steps and keywords.
+    """
+    key = (scenario_data.get("id"), keyword_signature(scenario_data))
+    index = _indexes.get(key)
+    if index is None:
+        index = _indexes[key] = KeywordIndex(scenario_data)
+    return index
+
+def invalidate_keyword_indexes() -> None:
+    """Drop every compiled index so they are rebuilt from current scenario data"""
+    global _indexes
+    _indexes = {}
+
+def export_keyword_indexes() -> Dict[Tuple[Any, Tuple], KeywordIndex]:
+    """The current compiled indexes, for writing into a scenario bundle"""
+    return _indexes
+
+def install_keyword_indexes(indexes: Dict[Tuple[Any, Tuple], KeywordIndex]) -> None:
+    """Replace the compiled indexes with indexes built ahead of time"""
+    global _indexes
+    _indexes = dict(indexes)
@@ -0,0 +1,320 @@
+"""
+Metrics
+
+Counters, gauges and histograms in the Prometheus text exposition format,
+served at /metrics. There is no dependency on prometheus_client; the metrics
+here are plain Python objects whose updates are single attribute increments
+without locks, cheap enough for per-token hot paths. They are updated from the
+event loop thread; an update racing with another thread can be lost, which is
+acceptable for monitoring.
+
+Values that already exist elsewhere, such as the session store size and
+eviction counts, are read when /metrics is scraped instead of being tracked on
+every change.
+
+Set METRICS_ENABLED=0 to switch metrics off: every metric is then a no-op
+object, the request timing middleware is not installed and /metrics is not
+served.
+"""
+
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# Latency buckets in seconds, from sub-millisecond API work to long completions
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_RATE_BUCKETS = (5, 10, 20, 30, 40, 50, 75, 100, 150, 200, 400)
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    """
+    Base class of a metric family with optional labels
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "Metric"] = {}
+
+    def labels(self, *values: str) -> "Metric":
+        """The child metric for a combination of label values"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._new_child()
+            self._children[values] = child
+        return child
+
+    def _new_child(self) -> "Metric":
+        return type(self)(self.name, self.documentation)
+
+    def _series(self) -> Iterable[Tuple[Tuple[str, ...], "Metric"]]:
+        if self.labelnames:
+            return list(self._children.items())
+        return [((), self)]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+class Counter(Metric):
+    """A value that only goes up"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+                for values, child in self._series()]
+
+class Gauge(Counter):
+    """A value that goes up and down"""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+class Histogram(Metric):
+    """Counts observations in buckets, with their sum and count"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # One slot per bucket plus the +Inf overflow; made cumulative when rendered
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def time(self) -> "_Timer":
+        """Context manager observing the duration of its block"""
+        return _Timer(self)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, child in self._series():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+class CallbackMetric(Metric):
+    """A gauge or counter whose value is read from a function when scraped"""
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float], kind: str = "gauge"):
+        super().__init__(name, documentation)
+        self.read = read
+        self.kind = kind
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.read())}"]
+
+class _NullMetric:
+    """Stands in for every metric when metrics are disabled"""
+
+    def labels(self, *values):
+        return self
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def dec(self, amount: float = 1) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+    def time(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NULL = _NullMetric()
+
+# Registered metrics, in the order they are rendered
+_registry: List[Metric] = []
+
+def _register(metric: Metric):
+    if not METRICS_ENABLED:
+        return _NULL
+    _registry.append(metric)
+    return metric
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return _register(Counter(name, documentation, labelnames))
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return _register(Gauge(name, documentation, labelnames))
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+def callback(name: str, documentation: str, read: Callable[[], float], kind: str = "gauge") -> Optional[Metric]:
+    """
+    Register a metric read from a function at scrape time
+
+    Args:
+        read: Returns the current value; called on every scrape
+        kind: "gauge" or "counter"
+    """
+    return _register(CallbackMetric(name, documentation, read, kind))
+
+def render() -> str:
+    """All registered metrics in the Prometheus text format"""
+    lines = []
+    for metric in _registry:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            print(f"Error collecting metric {metric.name}: {str(e)}")
+    return "\n".join(lines) + "\n"
+
+# HTTP
+REQUEST_DURATION = histogram(
+    "medcomm_http_request_duration_seconds",
+    "Time from receiving a request to finishing its response, by route template",
+    ("method", "route", "status")
+)
+
+# Upstream LLM
+LLM_REQUESTS = counter("medcomm_llm_requests_total", "Completion requests by model and outcome", ("model", "outcome"))
+LLM_RETRIES = counter("medcomm_llm_retries_total", "Upstream requests retried, by model and status code", ("model", "status"))
+LLM_TTFT = histogram("medcomm_llm_time_to_first_token_seconds", "Time from sending a streamed completion to its first token", ("model",))
+LLM_TOKEN_RATE = histogram(
+    "medcomm_llm_tokens_per_second", "Streamed completion tokens per second after the first token", ("model",),
+    buckets=TOKEN_RATE_BUCKETS
+)
+LLM_COALESCED_REQUESTS = counter(
+    "medcomm_llm_coalesced_requests_total",
+    "Completion requests that joined an identical in-flight request instead of calling the model",
+    ("model",)
+)
+LLM_TOKENS = counter(
+    "medcomm_llm_tokens_total",
+    "Prompt and completion tokens by model; estimated for streamed completions",
+    ("model", "kind")
+)
+
+# Admission control
+ADMISSION_QUEUE = gauge("medcomm_admission_queue_length", "Completion requests waiting to be sent upstream")
+ADMISSION_WAIT = histogram("medcomm_admission_wait_seconds", "Time completion requests waited to be sent upstream")
+ADMISSION_REJECTED = counter(
+    "medcomm_admission_rejected_total",
+    "Completion requests shed before being sent upstream, by reason",
+    ("reason",)
+)
+
+# Chat
+WEBSOCKET_CONNECTIONS = gauge("medcomm_chat_websocket_connections", "Open chat WebSocket connections")
+RESPONSE_CACHE_LOOKUPS = counter(
+    "medcomm_response_cache_lookups_total",
+    "Response cache lookups by scenario and result (exact, near, miss)",
+    ("scenario", "result")
+)
+
+# Evaluation
+EVALUATION_DURATION = histogram("medcomm_evaluation_duration_seconds", "Time to evaluate one session")
+
+def record_tokens(model: str, prompt: int, completion: int) -> None:
+    """Count the tokens of one completion"""
+    LLM_TOKENS.labels(model, "prompt").inc(prompt)
+    LLM_TOKENS.labels(model, "completion").inc(completion)
+
+class RequestTimingMiddleware:
+    """
+    ASGI middleware observing REQUEST_DURATION for every HTTP request
+
+    Requests are labelled with the route template (e.g. /api/scenarios/{scenario_id})
+    rather than the path, so the number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_DURATION.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status)
+            ).observe(time.perf_counter() - start)
@@ -0,0 +1,33 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+from typing import Any, Dict
+
+import admission
+import chat_state
+import metrics
+from stream_replay import active_stream_count
+
+router = APIRouter()
+
+# Session store statistics, read once per scrape and shared by the metrics below
+_store_stats: Dict[str, Any] = {}
+
+def _store_stat(key: str):
+    return lambda: _store_stats.get(key, 0)
+
+metrics.callback("medcomm_sessions", "Sessions in the session store", _store_stat("sessions"))
+metrics.callback("medcomm_active_sessions", "Sessions not yet closed", _store_stat("active_sessions"))
+metrics.callback("medcomm_sessions_evicted_lru_total", "Sessions evicted because the store was full",
+                 _store_stat("evicted_lru"), kind="counter")
+metrics.callback("medcomm_sessions_evicted_ttl_total", "Sessions expired after being idle",
+                 _store_stat("evicted_ttl"), kind="counter")
+metrics.callback("medcomm_active_streams", "Streamed chat responses still generating", active_stream_count)
+metrics.callback("medcomm_llm_running", "Completion requests admitted and not yet finished",
+                 lambda: admission.controller.running)
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus metrics in the text exposition format"""
+    _store_stats.clear()
+    _store_stats.update(chat_state.get_store_stats())
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,323 @@
+"""
+Mock LLM
+
+A deterministic stand-in for the OpenAI chat completions API, so the chat
+endpoints can be load-tested and benchmarked offline without a key. Replies are
+generated from a seed and the request's messages, so the same conversation
+gets the same replies on every run. They are paced by a time to first token and
+a token rate, and errors can be injected at a given rate.
+
+It is available in two forms:
+    An OpenAI-compatible HTTP server (POST /v1/chat/completions, GET /v1/models),
+    streaming and non-streaming:
+        python mock_llm.py --port 8100 --ttft-ms 300 --tokens-per-second 40
+        OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=mock python app.py
+    An in-process client with the same interface as AsyncOpenAI, used instead of
+    the real client when OPENAI_MOCK=1 (see OpenAIProvider.from_env). It skips
+    the HTTP hop, so it measures the API alone.
+
+Settings, read from the environment by MockLLM.from_env:
+    MOCK_LLM_TTFT_MS            Milliseconds before the first token (default 200)
+    MOCK_LLM_TOKENS_PER_SECOND  Token rate after the first token, 0 for no delay (default 50)
+    MOCK_LLM_REPLY_TOKENS       Reply length range in tokens, "min,max" (default "20,80")
+    MOCK_LLM_ERROR_RATE         Fraction of requests answered with a 500 (default 0)
+    MOCK_LLM_RATE_LIMIT_RATE    Fraction of requests answered with a 429 (default 0)
+    MOCK_LLM_STREAM_ERROR_RATE  Fraction of streams that fail midway (default 0)
+    MOCK_LLM_SEED               Seed for replies and injected errors (default 0)
+
+Injected errors are drawn from their own seeded sequence, one draw per request,
+so a retried request can succeed and a run with the same requests in the same
+order fails the same ones.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+import openai
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+# Words replies are made of, so they read roughly like the real thing
+VOCABULARY = (
+    "I", "understand", "this", "is", "very", "hard", "to", "hear", "and", "I'm", "here", "for", "you",
+    "we", "can", "talk", "about", "what", "it", "means", "the", "results", "show", "that", "your",
+    "options", "treatment", "would", "like", "questions", "take", "time", "feel", "worried", "okay",
+    "together", "next", "steps", "family", "doctor", "support", "plan", "know", "sorry", "news"
+)
+
+class MockLLM:
+    """
+    Generates seeded replies and decides which requests fail
+    """
+
+    def __init__(self, ttft: float = 0.2, tokens_per_second: float = 50, reply_tokens: Tuple[int, int] = (20, 80),
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, stream_error_rate: float = 0.0,
+                 seed: int = 0):
+        """
+        Args:
+            ttft: Seconds before the first token
+            tokens_per_second: Token rate after the first token, 0 to send them without delay
+            reply_tokens: Minimum and maximum reply length in tokens
+            error_rate: Fraction of requests that fail with a server error
+            rate_limit_rate: Fraction of requests that fail with a rate limit error
+            stream_error_rate: Fraction of streamed replies that fail after some tokens
+            seed: Seed for replies and injected errors
+        """
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.stream_error_rate = stream_error_rate
+        self.seed = seed
+        self._faults = random.Random(seed)
+        self.requests = 0
+
+    @classmethod
+    def from_env(cls) -> "MockLLM":
+        """Build a mock configured from MOCK_LLM_* environment variables"""
+        low, _, high = os.getenv("MOCK_LLM_REPLY_TOKENS", "20,80").partition(",")
+        return cls(
+            ttft=float(os.getenv("MOCK_LLM_TTFT_MS", "200")) / 1000,
+            tokens_per_second=float(os.getenv("MOCK_LLM_TOKENS_PER_SECOND", "50")),
+            reply_tokens=(int(low), int(high or low)),
+            error_rate=float(os.getenv("MOCK_LLM_ERROR_RATE", "0")),
+            rate_limit_rate=float(os.getenv("MOCK_LLM_RATE_LIMIT_RATE", "0")),
+            stream_error_rate=float(os.getenv("MOCK_LLM_STREAM_ERROR_RATE", "0")),
+            seed=int(os.getenv("MOCK_LLM_SEED", "0"))
+        )
+
+    def reply(self, messages: List[Dict[str, Any]], max_tokens: Optional[int] = None) -> List[str]:
+        """
+        The reply to a conversation, as tokens
+
+        Depends only on the seed and the messages, not on the order of requests.
+        """
+        digest = hashlib.sha256(json.dumps([self.seed, messages], sort_keys=True).encode("utf-8")).digest()
+        rng = random.Random(digest)
+        length = rng.randint(*self.reply_tokens)
+        if max_tokens:
+            length = min(length, max_tokens)
+        return [rng.choice(VOCABULARY) + ("." if (index + 1) % 12 == 0 else "") + " " for index in range(length)]
+
+    def fault(self, stream: bool) -> Tuple[Optional[str], Optional[float]]:
+        """
+        Draw the injected failure for the next request
+
+        Returns:
+            ("server_error" or "rate_limit" or None, fraction of a stream to send before failing or None)
+        """
+        self.requests += 1
+        draw = self._faults.random()
+        stream_draw = self._faults.random()
+        cut = self._faults.random()
+        if draw < self.error_rate:
+            return "server_error", None
+        if draw < self.error_rate + self.rate_limit_rate:
+            return "rate_limit", None
+        if stream and stream_draw < self.stream_error_rate:
+            return None, cut
+        return None, None
+
+    async def pace(self, tokens: List[str], fail_after: Optional[int] = None) -> AsyncIterator[str]:
+        """
+        Yield tokens at the configured time to first token and rate
+
+        Delays are scheduled from the start of the request, so they do not drift
+        with event loop latency.
+        """
+        start = time.monotonic()
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        for index, token in enumerate(tokens):
+            if index == fail_after:
+                return
+            delay = start + self.ttft + index * interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield token
+
+    async def complete(self, tokens: List[str]) -> None:
+        """Wait as long as generating the whole reply would take"""
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        await asyncio.sleep(self.ttft + max(len(tokens) - 1, 0) * interval)
+
+def completion_id() -> str:
+    return f"chatcmpl-mock{uuid.uuid4().hex[:20]}"
+
+def completion_body(model: str, tokens: List[str], prompt_tokens: int) -> Dict[str, Any]:
+    """A chat.completion response body"""
+    return {
+        "id": completion_id(),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "".join(tokens)},
+            "logprobs": None,
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens)
+        }
+    }
+
+def chunk_body(chunk_id: str, created: int, model: str, content: Optional[str],
+               finish_reason: Optional[str] = None) -> Dict[str, Any]:
+    """A chat.completion.chunk body"""
+    delta = {} if content is None else {"content": content}
+    return {
+        "id": chunk_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish_reason}]
+    }
+
+def prompt_token_count(messages: List[Dict[str, Any]]) -> int:
+    """Rough prompt size, about four characters per token"""
+    return sum(len(str(message.get("content") or "")) for message in messages) // 4
+
+ERRORS = {
+    "server_error": (500, "The server had an error while processing your request."),
+    "rate_limit": (429, "Rate limit reached for requests.")
+}
+
+def create_app(llm: Optional[MockLLM] = None) -> FastAPI:
+    """
+    An OpenAI-compatible chat completions server backed by a MockLLM
+
+    Args:
+        llm: The mock to serve; built from the environment by default
+    """
+    llm = llm or MockLLM.from_env()
+    mock_app = FastAPI(title="Mock LLM")
+    mock_app.state.llm = llm
+
+    @mock_app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "gpt-4o", "object": "model", "created": 0, "owned_by": "mock"}]}
+
+    @mock_app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "gpt-4o")
+        messages = body.get("messages", [])
+        stream = bool(body.get("stream"))
+        tokens = llm.reply(messages, body.get("max_tokens"))
+
+        error, cut = llm.fault(stream)
+        if error:
+            status, message = ERRORS[error]
+            return JSONResponse(
+                status_code=status,
+                content={"error": {"message": message, "type": error, "param": None, "code": None}}
+            )
+
+        if not stream:
+            await llm.complete(tokens)
+            return completion_body(model, tokens, prompt_token_count(messages))
+
+        fail_after = None if cut is None else int(len(tokens) * cut)
+
+        async def events():
+            chunk_id = completion_id()
+            created = int(time.time())
+            async for token in llm.pace(tokens, fail_after):
+                yield f"data: {json.dumps(chunk_body(chunk_id, created, model, token))}\n\n"
+            if fail_after is not None:
+                error = {"message": "The model stopped generating unexpectedly.", "type": "server_error"}
+                yield f"data: {json.dumps({'error': error})}\n\n"
+                return
+            yield f"data: {json.dumps(chunk_body(chunk_id, created, model, None, 'stop'))}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return mock_app
+
+class MockCompletions:
+    """chat.completions of MockAsyncOpenAI"""
+
+    def __init__(self, llm: MockLLM):
+        self.llm = llm
+
+    async def create(self, *, model: str, messages: List[Dict[str, Any]], stream: bool = False,
+                     max_tokens: Optional[int] = None, **kwargs):
+        tokens = self.llm.reply(messages, max_tokens)
+        request = httpx.Request("POST", "http://mock-llm/v1/chat/completions")
+
+        error, cut = self.llm.fault(stream)
+        if error:
+            status, message = ERRORS[error]
+            error_class = openai.RateLimitError if error == "rate_limit" else openai.InternalServerError
+            raise error_class(message, response=httpx.Response(status, request=request), body=None)
+
+        if not stream:
+            await self.llm.complete(tokens)
+            return ChatCompletion(**completion_body(model, tokens, prompt_token_count(messages)))
+
+        fail_after = None if cut is None else int(len(tokens) * cut)
+
+        async def chunks():
+            chunk_id = completion_id()
+            created = int(time.time())
+            async for token in self.llm.pace(tokens, fail_after):
+                yield ChatCompletionChunk(**chunk_body(chunk_id, created, model, token))
+            if fail_after is not None:
+                raise openai.APIError("An error occurred during streaming", request=request, body=None)
+            yield ChatCompletionChunk(**chunk_body(chunk_id, created, model, None, "stop"))
+
+        return chunks()
+
+class MockAsyncOpenAI:
+    """
+    In-process replacement for AsyncOpenAI's chat completions
+
+    Returns the same response types as the real client, without the HTTP round trip.
+    """
+
+    def __init__(self, llm: Optional[MockLLM] = None):
+        self.llm = llm or MockLLM.from_env()
+        self.chat = SimpleNamespace(completions=MockCompletions(self.llm))
+
+def main():
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the mock OpenAI-compatible server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--ttft-ms", type=float, help="Milliseconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float)
+    parser.add_argument("--reply-tokens", help='Reply length range, "min,max"')
+    parser.add_argument("--error-rate", type=float)
+    parser.add_argument("--rate-limit-rate", type=float)
+    parser.add_argument("--stream-error-rate", type=float)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    # Command line options override the environment
+    for option, variable in (("ttft_ms", "MOCK_LLM_TTFT_MS"), ("tokens_per_second", "MOCK_LLM_TOKENS_PER_SECOND"),
+                             ("reply_tokens", "MOCK_LLM_REPLY_TOKENS"), ("error_rate", "MOCK_LLM_ERROR_RATE"),
+                             ("rate_limit_rate", "MOCK_LLM_RATE_LIMIT_RATE"),
+                             ("stream_error_rate", "MOCK_LLM_STREAM_ERROR_RATE"), ("seed", "MOCK_LLM_SEED")):
+        value = getattr(args, option)
+        if value is not None:
+            os.environ[variable] = str(value)
+
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
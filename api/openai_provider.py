@@ -0,0 +1,151 @@
+"""
+OpenAI Client Provider
+
+One shared AsyncOpenAI client per application, created in the FastAPI lifespan
+hook and handed to routers through dependency injection. All requests reuse a
+single pooled httpx connection (HTTP/2 when the h2 package is installed), and
+the pool is closed cleanly on shutdown.
+
+Pool and timeout settings are read from the environment:
+    OPENAI_BASE_URL             Point the client at a local stub server
+    OPENAI_MAX_CONNECTIONS      Maximum open connections (default 100)
+    OPENAI_MAX_KEEPALIVE        Idle connections kept alive (default 20)
+    OPENAI_KEEPALIVE_EXPIRY     Seconds an idle connection is kept (default 30)
+    OPENAI_CONNECT_TIMEOUT      Connect timeout in seconds (default 5)
+    OPENAI_REQUEST_TIMEOUT      Per-request timeout in seconds (default 60)
+    OPENAI_MAX_RETRIES          Retries made by the SDK itself (default 0; chat completions are
+                                retried with backoff by admission.py)
+    OPENAI_HTTP2                Set to 0 to force HTTP/1.1
+    OPENAI_MOCK                 Set to 1 to use the in-process mock LLM (see mock_llm.py)
+    OPENAI_SINGLE_FLIGHT        Set to 1 to coalesce identical in-flight requests (default off, see single_flight.py)
+"""
+
+import importlib.util
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import FastAPI
+from starlette.requests import HTTPConnection
+from openai import AsyncOpenAI
+
+from single_flight import SingleFlightAsyncOpenAI
+
+# Load environment variables from .env file
+load_dotenv()
+
+def http2_available() -> bool:
+    """Whether httpx can negotiate HTTP/2 (requires the h2 package)"""
+    return importlib.util.find_spec("h2") is not None
+
+class OpenAIProvider:
+    """
+    Owns the shared AsyncOpenAI client and its connection pool
+    """
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 max_connections: int = 100, max_keepalive: int = 20, keepalive_expiry: float = 30.0,
+                 connect_timeout: float = 5.0, request_timeout: float = 60.0, http2: Optional[bool] = None,
+                 async_client: Optional[AsyncOpenAI] = None, single_flight: bool = False, max_retries: int = 0):
+        """
+        Args:
+            api_key: OpenAI API key
+            base_url: Alternative API base URL, e.g. a local stub server
+            max_connections: Maximum number of open connections in the pool
+            max_keepalive: Maximum number of idle connections kept alive
+            keepalive_expiry: Seconds an idle connection stays in the pool
+            connect_timeout: Seconds allowed to establish a connection
+            request_timeout: Seconds allowed for a single upstream request
+            http2: Force HTTP/2 on or off; defaults to on when h2 is installed
+            async_client: Use an existing client instead of building one (for tests and mocks)
+            single_flight: Let identical in-flight completion requests share one upstream call
+            max_retries: Retries made by the SDK; off by default because callers retry with admission.call_with_retries
+        """
+        self.request_timeout = request_timeout
+        self._http_client: Optional[httpx.AsyncClient] = None
+
+        if async_client is not None:
+            self.async_client = SingleFlightAsyncOpenAI(async_client) if single_flight else async_client
+            return
+
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY environment variable is not set")
+
+        self._http_client = httpx.AsyncClient(
+            http2=http2_available() if http2 is None else http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry
+            ),
+            timeout=httpx.Timeout(request_timeout, connect=connect_timeout)
+        )
+        self.async_client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self._http_client,
+                                        max_retries=max_retries)
+        if single_flight:
+            self.async_client = SingleFlightAsyncOpenAI(self.async_client)
+
+    @classmethod
+    def from_env(cls) -> "OpenAIProvider":
+        """Build a provider configured from environment variables"""
+        request_timeout = float(os.getenv("OPENAI_REQUEST_TIMEOUT", "60"))
+        single_flight = os.getenv("OPENAI_SINGLE_FLIGHT", "0") == "1"
+        if os.getenv("OPENAI_MOCK", "0") == "1":
+            from mock_llm import MockAsyncOpenAI
+            return cls(async_client=MockAsyncOpenAI(), request_timeout=request_timeout, single_flight=single_flight)
+
+        return cls(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+            max_keepalive=int(os.getenv("OPENAI_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30")),
+            connect_timeout=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")),
+            request_timeout=request_timeout,
+            http2=None if os.getenv("OPENAI_HTTP2", "1") != "0" else False,
+            single_flight=single_flight,
+            max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "0"))
+        )
+
+    async def aclose(self) -> None:
+        """Close the connection pool"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+# Provider used when the app was not started through the lifespan hook (e.g. serverless)
+_fallback_provider: Optional[OpenAIProvider] = None
+
+@asynccontextmanager
+async def openai_lifespan(app: FastAPI, provider: Optional[OpenAIProvider] = None):
+    """
+    Create the shared provider on startup and close it on shutdown
+
+    Args:
+        app: The FastAPI application; the provider is stored on app.state.openai
+        provider: Use this provider instead of building one from the environment
+    """
+    app.state.openai = provider or OpenAIProvider.from_env()
+    try:
+        yield app.state.openai
+    finally:
+        await app.state.openai.aclose()
+
+def get_openai(connection: HTTPConnection) -> OpenAIProvider:
+    """
+    FastAPI dependency returning the application's OpenAI provider
+
+    Takes the connection rather than the request so WebSocket routes can use it too.
+
+    Override it with app.dependency_overrides to swap in a stub.
+    """
+    provider = getattr(connection.app.state, "openai", None)
+    if provider is not None:
+        return provider
+
+    global _fallback_provider
+    if _fallback_provider is None:
+        _fallback_provider = OpenAIProvider.from_env()
+    return _fallback_provider
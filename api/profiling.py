@@ -0,0 +1,152 @@
+"""
+Sampling Profiler
+
+Profiles individual requests on demand. A request sent with the header
+"X-Profile: 1" is sampled while it runs: a background thread records the stack
+of the event loop thread every PROFILE_INTERVAL_MS milliseconds. If the request
+takes longer than PROFILE_SLOW_MS, the stacks are written to PROFILE_DIR in the
+folded format that flamegraph.pl, speedscope and inferno read directly:
+    <trace id>.folded    one "frame;frame;frame count" line per distinct stack
+
+Samples show what the event loop was doing, so they include other requests that
+ran at the same time; each stack starts with the name of the task that was
+running, which separates them. Time spent waiting on the network shows up
+under the selector's select call.
+
+Settings:
+    PROFILING_ENABLED     Set to 1 to honour the X-Profile header (default off)
+    PROFILE_SLOW_MS       Only write profiles of requests slower than this (default 500)
+    PROFILE_INTERVAL_MS   Sampling interval (default 5)
+    PROFILE_DIR           Where profiles are written (default /tmp/medcomm-profiles)
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "500"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/medcomm-profiles")
+
+PROFILE_HEADER = b"x-profile"
+
+class RequestProfile:
+    """
+    The samples collected while one request ran
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.monotonic()
+        self.stacks: Counter = Counter()
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread while any request profile is open
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._profiles: List[RequestProfile] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._target_id: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._code_names: Dict[object, str] = {}
+
+    def open(self, name: str) -> RequestProfile:
+        """Start sampling for a request; call from the event loop thread"""
+        profile = RequestProfile(name)
+        with self._lock:
+            self._profiles.append(profile)
+            if self._thread is None:
+                self._target_id = threading.get_ident()
+                self._loop = asyncio.get_running_loop()
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        return profile
+
+    def close(self, profile: RequestProfile) -> None:
+        """Stop sampling for a request"""
+        with self._lock:
+            self._profiles.remove(profile)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                profiles = list(self._profiles)
+
+            stack = self._sample()
+            if stack:
+                for profile in profiles:
+                    profile.stacks[stack] += 1
+
+    def _sample(self) -> Optional[str]:
+        frame = sys._current_frames().get(self._target_id)
+        if frame is None:
+            return None
+
+        frames = []
+        while frame is not None:
+            frames.append(self._frame_name(frame.f_code))
+            frame = frame.f_back
+        frames.reverse()
+
+        # Name the running task so concurrent requests can be told apart
+        task = asyncio.tasks._current_tasks.get(self._loop)
+        frames.insert(0, f"task:{task.get_coro().__qualname__}" if task is not None else "task:none")
+        return ";".join(frames)
+
+    def _frame_name(self, code) -> str:
+        name = self._code_names.get(code)
+        if name is None:
+            name = f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._code_names[code] = name
+        return name
+
+profiler = SamplingProfiler()
+
+def start_request(headers: Dict[bytes, bytes], name: str) -> Optional[RequestProfile]:
+    """
+    Start profiling a request if profiling is enabled and the request asks for it
+
+    Args:
+        headers: The request headers, lower-cased
+        name: Names the profile file, e.g. the trace id
+    """
+    if not PROFILING_ENABLED or headers.get(PROFILE_HEADER) not in (b"1", b"true"):
+        return None
+    return profiler.open(name)
+
+def finish_request(profile: RequestProfile) -> Optional[str]:
+    """
+    Stop profiling a request and write its stacks if it was slow
+
+    Returns:
+        The path of the profile, or None if the request was fast enough
+    """
+    profiler.close(profile)
+    elapsed_ms = (time.monotonic() - profile.started) * 1000
+    if elapsed_ms < PROFILE_SLOW_MS or not profile.stacks:
+        return None
+
+    path = os.path.join(PROFILE_DIR, f"{profile.name}.folded")
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in profile.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+    except OSError as e:
+        print(f"Error writing profile {path}: {str(e)}")
+        return None
+    print(f"Profile of {elapsed_ms:.0f} ms request written to {path}")
+    return path
@@ -0,0 +1,306 @@
+"""
+Response Cache
+
+Reuses model replies for turns that have been seen before. Trainees often open a
+scenario with nearly the same message ("Hi, I'm Dr. X, I've been caring for
+your husband"), and each one would otherwise cost a full completion.
+
+A turn is keyed on its scenario, step, model and normalized history: the system
+messages (the scenario and step prompts) verbatim, and the conversation with
+case, punctuation and whitespace folded. Two lookup modes are available:
+    exact   The normalized history must match
+    near    Everything but the last user message must match, and the last
+            message must be at least RESPONSE_CACHE_SIMILARITY similar to a
+            cached one, by cosine similarity of hashed character-trigram and
+            word vectors. The vectors are computed locally with no model or
+            extra dependency.
+
+Only short conversations are cached (RESPONSE_CACHE_MAX_MESSAGES), since later
+turns rarely repeat, and only complete replies are stored. Entries expire after
+RESPONSE_CACHE_TTL_SECONDS and the least recently used entry is evicted once
+RESPONSE_CACHE_MAX_ENTRIES is reached. The cache is kept per worker process.
+
+Settings:
+    RESPONSE_CACHE_ENABLED                   Set to 1 to cache replies (default off)
+    RESPONSE_CACHE_MODE                      exact or near (default exact)
+    RESPONSE_CACHE_SIMILARITY                Near-match threshold between 0 and 1 (default 0.9)
+    RESPONSE_CACHE_MAX_ENTRIES               Default 1000
+    RESPONSE_CACHE_TTL_SECONDS               Default 86400
+    RESPONSE_CACHE_MAX_MESSAGES              Longest conversation that is cached, not counting
+                                             system messages (default 2: the opening prompt and
+                                             the first user message)
+    RESPONSE_CACHE_REPLAY_TOKENS_PER_SECOND  Pace of replayed replies, 0 for no delay (default 0)
+"""
+
+import asyncio
+import hashlib
+import math
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional
+
+import metrics
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+DEFAULT_MODE = os.getenv("RESPONSE_CACHE_MODE", "exact")
+DEFAULT_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.9"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+DEFAULT_TTL = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+DEFAULT_MAX_MESSAGES = int(os.getenv("RESPONSE_CACHE_MAX_MESSAGES", "2"))
+REPLAY_TOKENS_PER_SECOND = float(os.getenv("RESPONSE_CACHE_REPLAY_TOKENS_PER_SECOND", "0"))
+
+MODES = ("exact", "near")
+
+# Dimensions of the hashed n-gram vectors
+EMBEDDING_BUCKETS = 1 << 16
+
+_APOSTROPHES = re.compile(r"['\u2019]")
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_WORD_PIECES = re.compile(r"\s*\S+|\s+$")
+
+def normalize(text: str) -> str:
+    """Fold case, punctuation and whitespace"""
+    return " ".join(_PUNCTUATION.sub(" ", _APOSTROPHES.sub("", text.lower())).split())
+
+def embed(text: str) -> Dict[int, float]:
+    """
+    A unit vector of hashed character trigrams and words of normalized text
+
+    Trigrams make the similarity tolerant of small wording and spelling
+    differences, words weight the overall vocabulary.
+    """
+    counts: Dict[int, float] = {}
+    words = text.split()
+    padded = f" {text} "
+    features = [padded[i:i + 3] for i in range(len(padded) - 2)] + [f"w:{word}" for word in words]
+    for feature in features:
+        bucket = zlib.crc32(feature.encode()) % EMBEDDING_BUCKETS
+        counts[bucket] = counts.get(bucket, 0.0) + 1.0
+    norm = math.sqrt(sum(value * value for value in counts.values())) or 1.0
+    return {bucket: value / norm for bucket, value in counts.items()}
+
+def similarity(a: Dict[int, float], b: Dict[int, float]) -> float:
+    """Cosine similarity of two vectors from embed"""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(bucket, 0.0) for bucket, value in a.items())
+
+class CacheKey(NamedTuple):
+    """Identifies a turn; built by ResponseCache.key"""
+    scenario_id: str
+    step: int
+    model: str
+    # Hash of the scenario, step, model and every message but the last user message
+    context: str
+    # The last user message, normalized
+    message: str
+
+    @property
+    def exact(self) -> str:
+        return f"{self.context}:{hashlib.sha256(self.message.encode()).hexdigest()}"
+
+class CacheEntry:
+    """A cached reply"""
+
+    __slots__ = ("key", "text", "embedding", "created", "hits")
+
+    def __init__(self, key: CacheKey, text: str, embedding: Optional[Dict[int, float]]):
+        self.key = key
+        self.text = text
+        self.embedding = embedding
+        self.created = time.monotonic()
+        self.hits = 0
+
+class ResponseCache:
+    """
+    Bounded LRU cache of replies, each kept for at most the TTL after it was stored
+
+    Entries are kept in access order in one OrderedDict, and grouped by context
+    for near matching, so a near lookup only compares messages that follow the
+    same history.
+    """
+
+    def __init__(self, mode: str = DEFAULT_MODE, threshold: float = DEFAULT_SIMILARITY,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL,
+                 max_messages: int = DEFAULT_MAX_MESSAGES):
+        if mode not in MODES:
+            raise ValueError(f"Unknown response cache mode: {mode}, expected one of {', '.join(MODES)}")
+        self.mode = mode
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._by_context: Dict[str, Dict[str, CacheEntry]] = {}
+        self._scenarios: Dict[str, Dict[str, int]] = {}
+        self.evicted_lru = 0
+        self.evicted_ttl = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, scenario_id: str, step: int, model: str, messages: List[Dict[str, str]]) -> Optional[CacheKey]:
+        """
+        The cache key of a turn, or None if the turn is not cacheable
+
+        Args:
+            scenario_id: The session's scenario
+            step: The communication step the user is on
+            model: The model that would generate the reply
+            messages: Context for the model, from build_context
+        """
+        conversation = [index for index, message in enumerate(messages) if message["role"] != "system"]
+        if not conversation or len(conversation) > self.max_messages or messages[conversation[-1]]["role"] != "user":
+            return None
+        last = conversation[-1]
+
+        # The step prompt follows the user message, so hash everything around it
+        context = hashlib.sha256()
+        for part in (scenario_id, str(step), model):
+            context.update(part.encode() + b"\0")
+        for index, message in enumerate(messages):
+            if index == last:
+                context.update(b"user\0?\0")
+                continue
+            content = message["content"] if message["role"] == "system" else normalize(message["content"])
+            context.update(f"{message['role']}\0{content}\0".encode())
+        return CacheKey(scenario_id, step, model, context.hexdigest(), normalize(messages[last]["content"]))
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        """
+        Look up the reply to a turn
+
+        Returns:
+            The cached reply, or None on a miss
+        """
+        entry = self._find(key)
+        if entry is None:
+            self._count(key.scenario_id, "misses")
+            metrics.RESPONSE_CACHE_LOOKUPS.labels(key.scenario_id, "miss").inc()
+            return None
+
+        result = "exact" if entry.key.message == key.message else "near"
+        entry.hits += 1
+        self._entries.move_to_end(entry.key.exact)
+        self._count(key.scenario_id, f"{result}_hits")
+        metrics.RESPONSE_CACHE_LOOKUPS.labels(key.scenario_id, result).inc()
+        return entry.text
+
+    def _find(self, key: CacheKey) -> Optional[CacheEntry]:
+        entry = self._entries.get(key.exact)
+        if entry is not None:
+            return entry if self._fresh(entry) else None
+        if self.mode != "near":
+            return None
+
+        candidates = self._by_context.get(key.context)
+        if not candidates:
+            return None
+        vector = embed(key.message)
+        best, best_score = None, self.threshold
+        for candidate in list(candidates.values()):
+            if not self._fresh(candidate):
+                continue
+            score = similarity(vector, candidate.embedding)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def _fresh(self, entry: CacheEntry) -> bool:
+        """Whether an entry is within its TTL; expired entries are removed"""
+        if time.monotonic() - entry.created < self.ttl:
+            return True
+        self._remove(entry)
+        self.evicted_ttl += 1
+        return False
+
+    def put(self, key: CacheKey, text: str) -> None:
+        """Store the complete reply to a turn"""
+        if not text:
+            return
+        existing = self._entries.get(key.exact)
+        if existing is not None:
+            self._remove(existing)
+
+        entry = CacheEntry(key, text, embed(key.message) if self.mode == "near" else None)
+        self._entries[key.exact] = entry
+        self._by_context.setdefault(key.context, {})[key.exact] = entry
+        self._count(key.scenario_id, "stored")
+
+        while len(self._entries) > self.max_entries:
+            _, oldest = next(iter(self._entries.items()))
+            self._remove(oldest)
+            self.evicted_lru += 1
+
+    def _remove(self, entry: CacheEntry) -> None:
+        exact = entry.key.exact
+        self._entries.pop(exact, None)
+        group = self._by_context.get(entry.key.context)
+        if group is not None:
+            group.pop(exact, None)
+            if not group:
+                del self._by_context[entry.key.context]
+
+    def _count(self, scenario_id: str, field: str) -> None:
+        counts = self._scenarios.setdefault(scenario_id, {"exact_hits": 0, "near_hits": 0, "misses": 0, "stored": 0})
+        counts[field] += 1
+
+    def clear(self) -> None:
+        """Drop every entry and reset the statistics"""
+        self._entries.clear()
+        self._by_context.clear()
+        self._scenarios.clear()
+        self.evicted_lru = 0
+        self.evicted_ttl = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache size, evictions and hit rates per scenario"""
+        scenarios = {}
+        for scenario_id, counts in sorted(self._scenarios.items()):
+            hits = counts["exact_hits"] + counts["near_hits"]
+            lookups = hits + counts["misses"]
+            scenarios[scenario_id] = {
+                **counts,
+                "lookups": lookups,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+            }
+        return {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "mode": self.mode,
+            "threshold": self.threshold,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "evicted_lru": self.evicted_lru,
+            "evicted_ttl": self.evicted_ttl,
+            "scenarios": scenarios
+        }
+
+cache = ResponseCache()
+
+def cache_key(scenario_id: str, step: int, model: str, messages: List[Dict[str, str]]) -> Optional[CacheKey]:
+    """The cache key of a turn, or None if caching is off or the turn is not cacheable"""
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    return cache.key(scenario_id, step, model, messages)
+
+async def replay(text: str, tokens_per_second: float = REPLAY_TOKENS_PER_SECOND) -> AsyncIterator[str]:
+    """
+    Yield a cached reply as word-sized deltas, like a streamed completion
+
+    Args:
+        text: The reply
+        tokens_per_second: Pace of the deltas; with 0 they follow each other
+            without delay, yielding to the event loop in between
+    """
+    interval = 1 / tokens_per_second if tokens_per_second > 0 else 0
+    start = time.monotonic()
+    for index, piece in enumerate(_WORD_PIECES.findall(text)):
+        if interval:
+            # Schedule from the start so sleep overshoot does not accumulate
+            await asyncio.sleep(max(start + index * interval - time.monotonic(), 0))
+        else:
+            await asyncio.sleep(0)
+        yield piece
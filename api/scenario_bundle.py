@@ -0,0 +1,157 @@
+"""
+Scenario Bundle
+
+Compiles the scenario registry, the system prompts and the keyword indexes into
+one binary file, so a cold start (e.g. a new serverless instance) can restore
+them with a single unpickle of a memory-mapped file instead of importing the
+scenario module, freezing the data and rebuilding the prompts and automata.
+
+File layout:
+    header   magic, format version, payload length and SHA-256 of the payload
+    payload  pickle of {"registry", "prompts", "keyword_indexes", "sources"}
+
+"sources" records the SHA-256 of scenarios.py and scenarios.json at build time.
+A bundle whose checksum does not match, or that was built from different source
+files, is rejected and the caller falls back to loading the scenarios directly.
+
+Build the bundle during deployment and set SCENARIO_SOURCE=bundle:
+    python scenario_bundle.py [-o path]
+"""
+
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import time
+from typing import Dict, Any, Optional
+
+from scenario_registry import (
+    ScenarioRegistry, load_scenarios, set_registry, SCENARIOS_DIR, SCENARIO_BUNDLE_PATH
+)
+from system_prompts import export_system_prompts, install_system_prompts
+from keyword_index import export_keyword_indexes, install_keyword_indexes
+
+BUNDLE_MAGIC = b"MCSB"
+BUNDLE_FORMAT_VERSION = 2
+
+# magic, format version, payload length, payload SHA-256
+_HEADER = struct.Struct("<4sHQ32s")
+
+# Files the bundled scenarios are compiled from
+SOURCE_FILES = ("scenarios.py", "scenarios.json")
+
+class BundleError(Exception):
+    """The bundle is missing, corrupt, from another format version or out of date"""
+
+def source_digests(scenarios_dir: str = SCENARIOS_DIR) -> Dict[str, Optional[str]]:
+    """SHA-256 of each scenario source file, None for files that do not exist"""
+    digests = {}
+    for name in SOURCE_FILES:
+        try:
+            with open(os.path.join(scenarios_dir, name), "rb") as f:
+                digests[name] = hashlib.sha256(f.read()).hexdigest()
+        except FileNotFoundError:
+            digests[name] = None
+    return digests
+
+def compile_bundle(path: str = SCENARIO_BUNDLE_PATH, registry: Optional[ScenarioRegistry] = None) -> ScenarioRegistry:
+    """
+    Compile the scenarios and everything derived from them into a bundle file
+
+    Args:
+        path: Where to write the bundle; it is replaced atomically
+        registry: Registry to bundle, built from the scenario sources if omitted
+
+    Returns:
+        The bundled registry
+    """
+    if registry is None:
+        registry = ScenarioRegistry(load_scenarios())
+    # Installing compiles the prompts and keyword indexes for this registry
+    set_registry(registry)
+
+    payload = pickle.dumps({
+        "registry": registry,
+        "prompts": export_system_prompts(),
+        "keyword_indexes": export_keyword_indexes(),
+        "sources": source_digests()
+    }, protocol=pickle.HIGHEST_PROTOCOL)
+    header = _HEADER.pack(BUNDLE_MAGIC, BUNDLE_FORMAT_VERSION, len(payload), hashlib.sha256(payload).digest())
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(header)
+        f.write(payload)
+    os.replace(temp_path, path)
+    return registry
+
+def load_bundle(path: str = SCENARIO_BUNDLE_PATH, check_sources: bool = True) -> Dict[str, Any]:
+    """
+    Read and verify a bundle file
+
+    Args:
+        path: The bundle file
+        check_sources: Reject the bundle if the scenario source files changed since it was built
+
+    Returns:
+        The bundle contents
+
+    Raises:
+        BundleError: If the bundle cannot be used
+    """
+    try:
+        f = open(path, "rb")
+    except OSError as e:
+        raise BundleError(f"cannot open bundle: {str(e)}")
+
+    with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if len(mapped) < _HEADER.size:
+            raise BundleError("bundle is truncated")
+        magic, format_version, length, digest = _HEADER.unpack_from(mapped)
+        if magic != BUNDLE_MAGIC:
+            raise BundleError("not a scenario bundle")
+        if format_version != BUNDLE_FORMAT_VERSION:
+            raise BundleError(f"unsupported bundle format {format_version}")
+
+        with memoryview(mapped)[_HEADER.size:] as payload:
+            if len(payload) != length:
+                raise BundleError("bundle is truncated")
+            if hashlib.sha256(payload).digest() != digest:
+                raise BundleError("bundle checksum mismatch")
+            bundle = pickle.loads(payload)
+
+    if check_sources and bundle["sources"] != source_digests():
+        raise BundleError("scenario sources changed since the bundle was built")
+    return bundle
+
+def install_bundle(path: str = SCENARIO_BUNDLE_PATH, check_sources: bool = True) -> ScenarioRegistry:
+    """
+    Install the registry, prompts and keyword indexes from a bundle
+
+    Returns:
+        The installed registry
+    """
+    bundle = load_bundle(path, check_sources)
+    install_system_prompts(bundle["prompts"])
+    install_keyword_indexes(bundle["keyword_indexes"])
+    registry = set_registry(bundle["registry"], compile_derived=False)
+    print(f"Loaded scenario bundle {path} (version {registry.version})")
+    return registry
+
+def main():
+    # Imported here so loading a bundle at startup does not pay for it
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile the scenarios into a bundle for fast cold starts")
+    parser.add_argument("-o", "--output", default=SCENARIO_BUNDLE_PATH, help="Bundle file to write")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    registry = compile_bundle(args.output)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"Wrote {args.output}: {len(registry)} scenarios, version {registry.version}, "
+          f"{os.path.getsize(args.output)} bytes in {elapsed_ms:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Scenario Directory Loader
+
+Serves scenarios from a directory holding one JSON file per scenario, such as
+data/scenarios/scenario_01_cardiac_arrest.json. The file name (without .json)
+is the scenario key and must match the scenario's "id".
+
+Scanning the directory only stats the files; a scenario body is read and
+validated the first time it is used. A watcher thread polls file modification
+times and, when anything changes, builds a new registry and swaps it in with a
+single assignment. Requests that already hold the previous registry keep a
+consistent snapshot, and unchanged files are not re-read.
+
+Enable it with SCENARIO_SOURCE=directory. SCENARIOS_DIR selects the directory and
+SCENARIO_RELOAD_SECONDS the polling interval (0 disables hot reload).
+"""
+
+import json
+import os
+import threading
+import hashlib
+from typing import Dict, Any, Optional, Tuple
+
+from scenario_registry import ScenarioRegistry, FrozenDict, freeze, set_registry, SCENARIOS_DIR
+from system_prompts import invalidate_system_prompts
+from keyword_index import invalidate_keyword_indexes
+
+DEFAULT_RELOAD_INTERVAL = float(os.getenv("SCENARIO_RELOAD_SECONDS", "2"))
+
+# Files in the scenario directory that are not individual scenarios
+IGNORED_FILES = {"scenarios.json"}
+
+REQUIRED_FIELDS = ("id", "title", "description", "ai_role", "initial_prompt", "communication_steps")
+
+def validate_scenario(key: str, scenario: Any) -> None:
+    """
+    Check that a scenario file has the fields and types the API relies on
+
+    Args:
+        key: The scenario key taken from the file name
+        scenario: The parsed file contents
+
+    Raises:
+        ValueError: If the scenario is invalid
+    """
+    if not isinstance(scenario, dict):
+        raise ValueError("scenario must be a JSON object")
+
+    missing = [field for field in REQUIRED_FIELDS if field not in scenario]
+    if missing:
+        raise ValueError(f"missing fields: {', '.join(missing)}")
+
+    for field in REQUIRED_FIELDS[:-1]:
+        if not isinstance(scenario[field], str):
+            raise ValueError(f"'{field}' must be a string")
+
+    if scenario["id"] != key:
+        raise ValueError(f"id '{scenario['id']}' does not match file name '{key}'")
+
+    steps = scenario["communication_steps"]
+    if not isinstance(steps, list) or not all(isinstance(step, str) for step in steps):
+        raise ValueError("'communication_steps' must be a list of strings")
+
+    if not isinstance(scenario.get("guidance_cues", {}), dict):
+        raise ValueError("'guidance_cues' must be an object")
+
+    keywords = scenario.get("evaluation_keywords", {})
+    if not isinstance(keywords, dict) or not all(isinstance(words, list) for words in keywords.values()):
+        raise ValueError("'evaluation_keywords' must map step names to lists")
+
+class ScenarioFile:
+    """
+    One scenario file, read and validated on first use
+    """
+
+    def __init__(self, key: str, path: str, signature: Tuple[int, int]):
+        self.key = key
+        self.path = path
+        # (mtime_ns, size) when the directory was scanned
+        self.signature = signature
+        self._data: Optional[Dict[str, Any]] = None
+        self._error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """
+        The frozen scenario data, or None if the file is invalid
+        """
+        if self._data is None and self._error is None:
+            with self._lock:
+                if self._data is None and self._error is None:
+                    try:
+                        with open(self.path, encoding="utf-8") as f:
+                            scenario = json.load(f)
+                        validate_scenario(self.key, scenario)
+                        self._data = freeze(scenario)
+                    except Exception as e:
+                        self._error = str(e)
+                        print(f"Invalid scenario file {self.path}: {self._error}")
+        return self._data
+
+class DirectoryScenarioRegistry(ScenarioRegistry):
+    """
+    Scenario registry backed by a directory scan, loading scenario bodies lazily
+
+    Lookups by key or ID only read the requested file. The full collection and
+    the /api/scenarios/info responses are built the first time they are needed.
+    """
+
+    def __init__(self, files: Dict[str, ScenarioFile]):
+        """
+        Args:
+            files: Scenario files keyed by scenario key
+        """
+        self._files = files
+        self._snapshot: Optional[ScenarioRegistry] = None
+        self._lock = threading.Lock()
+
+        fingerprint = json.dumps(sorted((key, file.signature) for key, file in files.items()))
+        self.version = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def files(self) -> Dict[str, ScenarioFile]:
+        return self._files
+
+    @property
+    def scenarios(self) -> Dict[str, Dict[str, Any]]:
+        return self._full().scenarios
+
+    @property
+    def info_response(self) -> Dict[str, Any]:
+        return self._full().info_response
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __contains__(self, scenario_ref: str) -> bool:
+        return self.resolve(scenario_ref) is not None
+
+    def resolve(self, scenario_ref: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Find a scenario by key or ID (they are the same for directory scenarios)
+        """
+        scenario_file = self._files.get(scenario_ref)
+        if scenario_file is None:
+            return None
+        scenario = scenario_file.load()
+        return (scenario_file.key, scenario) if scenario is not None else None
+
+    def info(self, scenario_ref: Optional[str] = None) -> Dict[str, Any]:
+        return self._full().info(scenario_ref)
+
+    def compile_derived(self) -> None:
+        """Drop derived data so prompts and keyword indexes are rebuilt lazily from the new files"""
+        invalidate_system_prompts()
+        invalidate_keyword_indexes()
+
+    def _full(self) -> ScenarioRegistry:
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    loaded = {key: file.load() for key, file in sorted(self._files.items())}
+                    self._snapshot = ScenarioRegistry(
+                        FrozenDict((key, data) for key, data in loaded.items() if data is not None)
+                    )
+        return self._snapshot
+
+class ScenarioDirectory:
+    """
+    Scans a scenario directory, builds registries and watches for changes
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Directory holding one JSON file per scenario
+        """
+        self.path = path
+        self._files: Dict[str, ScenarioFile] = {}
+        self._watcher: Optional[threading.Thread] = None
+        self._stop_watcher = threading.Event()
+
+    def scan(self) -> Dict[str, Tuple[str, Tuple[int, int]]]:
+        """
+        List the scenario files without reading them
+
+        Returns:
+            Scenario key -> (path, (mtime_ns, size))
+        """
+        found = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith(".json") or entry.name in IGNORED_FILES:
+                    continue
+                stat = entry.stat()
+                found[entry.name[:-len(".json")]] = (entry.path, (stat.st_mtime_ns, stat.st_size))
+        return found
+
+    def build_registry(self, scan: Optional[Dict[str, Tuple[str, Tuple[int, int]]]] = None) -> DirectoryScenarioRegistry:
+        """
+        Build a registry from the directory, reusing already loaded files that have not changed
+        """
+        if scan is None:
+            scan = self.scan()
+
+        files = {}
+        for key, (path, signature) in scan.items():
+            existing = self._files.get(key)
+            if existing is not None and existing.path == path and existing.signature == signature:
+                files[key] = existing
+            else:
+                files[key] = ScenarioFile(key, path, signature)
+
+        self._files = files
+        return DirectoryScenarioRegistry(files)
+
+    def reload_if_changed(self) -> bool:
+        """
+        Swap in a new registry if any scenario file was added, removed or modified
+
+        Returns:
+            True if the registry was replaced
+        """
+        scan = self.scan()
+        current = {key: (file.path, file.signature) for key, file in self._files.items()}
+        if scan == current:
+            return False
+
+        set_registry(self.build_registry(scan))
+        print(f"Reloaded scenarios from {self.path}: {sorted(scan)}")
+        return True
+
+    def start_watcher(self, interval: float = DEFAULT_RELOAD_INTERVAL) -> None:
+        """Start a daemon thread that polls the directory for changes"""
+        if interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+
+        self._stop_watcher.clear()
+
+        def run():
+            while not self._stop_watcher.wait(interval):
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    print(f"Error reloading scenarios: {str(e)}")
+
+        self._watcher = threading.Thread(target=run, name="scenario-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self) -> None:
+        """Stop the watcher thread if it is running"""
+        self._stop_watcher.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+_directory: Optional[ScenarioDirectory] = None
+
+def get_directory() -> ScenarioDirectory:
+    """The shared ScenarioDirectory for SCENARIOS_DIR"""
+    global _directory
+    if _directory is None:
+        _directory = ScenarioDirectory(SCENARIOS_DIR)
+    return _directory
@@ -0,0 +1,212 @@
+"""
+Scenario Registry
+
+Loads the scenario collection once and indexes it for constant-time lookups by
+scenario key or scenario ID. Scenario data is deep-frozen so it can be shared by
+every session and request without copying, and the responses of the listing
+endpoints are built once when the registry is created.
+
+Replacing the registry with set_registry() also recompiles the system prompts and
+keyword indexes derived from the scenarios.
+
+Set SCENARIO_SOURCE=directory to load one scenario per JSON file from
+SCENARIOS_DIR instead, with hot reload (see scenario_loader.py), or
+SCENARIO_SOURCE=bundle to load the registry, prompts and keyword indexes from a
+precompiled bundle (see scenario_bundle.py).
+"""
+
+import hashlib
+import json
+import os
+import sys
+from typing import Dict, Any, Optional, Tuple
+
+from system_prompts import compile_system_prompts
+from keyword_index import build_keyword_indexes
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCENARIOS_DIR = os.getenv("SCENARIOS_DIR", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'scenarios'
+))
+SCENARIOS_JSON_PATH = os.path.join(SCENARIOS_DIR, 'scenarios.json')
+SCENARIO_BUNDLE_PATH = os.getenv("SCENARIO_BUNDLE_PATH", os.path.join(SCENARIOS_DIR, 'scenarios.bundle'))
+SCENARIO_SOURCE = os.getenv("SCENARIO_SOURCE", "module")
+
+class FrozenDict(dict):
+    """
+    Read-only dict
+
+    Still a dict, so it serializes with json and FastAPI like the original
+    scenario data, but any attempt to modify it raises TypeError.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Scenario data is read-only")
+
+    __setitem__ = __delitem__ = _readonly
+    update = pop = popitem = clear = setdefault = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+def freeze(value: Any) -> Any:
+    """Recursively convert dicts to FrozenDict and lists to tuples"""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def load_scenarios() -> Dict[str, Dict[str, Any]]:
+    """
+    Load the scenario collection from the Python module, falling back to the JSON file
+    """
+    # Import the Python scenarios
+    try:
+        from data.scenarios.scenarios import scenarios
+        print(f"Scenarios imported successfully: {list(scenarios.keys())}")
+        return scenarios
+    except Exception as e:
+        print(f"Error importing scenarios: {str(e)}")
+
+    # Fallback to direct JSON file loading
+    try:
+        with open(SCENARIOS_JSON_PATH) as f:
+            scenarios = json.load(f)
+        print(f"Loaded scenarios from JSON: {list(scenarios.keys())}")
+        return scenarios
+    except Exception as e:
+        print(f"Error loading scenarios JSON: {str(e)}")
+
+    # Create a dummy scenario for testing
+    print("Using dummy test scenario")
+    return {
+        "difficult_news": {
+            "id": "scenario_01_test",
+            "title": "Test Scenario",
+            "description": "Test scenario for debugging",
+            "ai_role": "Test role",
+            "initial_prompt": "This is a test prompt",
+            "communication_steps": ["Step 1", "Step 2", "Step 3"]
+        }
+    }
+
+def scenario_info(scenario: Dict[str, Any]) -> Dict[str, Any]:
+    """Summary of a scenario as returned by /api/scenarios/info"""
+    return {
+        "id": scenario["id"],
+        "title": scenario["title"],
+        "description": scenario["description"],
+        "ai_role": scenario["ai_role"],
+        "communication_steps": scenario["communication_steps"],
+        "guidance_cues": scenario.get("guidance_cues", {})
+    }
+
+class ScenarioRegistry:
+    """
+    Immutable, indexed snapshot of the scenario collection
+    """
+
+    def __init__(self, scenarios: Dict[str, Dict[str, Any]]):
+        """
+        Args:
+            scenarios: Scenario data keyed by scenario key
+        """
+        self.scenarios: Dict[str, Dict[str, Any]] = freeze(scenarios)
+
+        # Content hash identifying this version of the collection
+        canonical = json.dumps(self.scenarios, sort_keys=True, separators=(",", ":"))
+        self.version = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+        # key -> (key, scenario) and id -> (key, scenario)
+        self._by_key: Dict[str, Tuple[str, Dict[str, Any]]] = {
+            key: (key, scenario) for key, scenario in self.scenarios.items()
+        }
+        self._by_id: Dict[str, Tuple[str, Dict[str, Any]]] = {
+            scenario["id"]: (key, scenario) for key, scenario in self.scenarios.items()
+        }
+
+        # Precomputed /api/scenarios/info responses: the full list and one per key or ID
+        infos = [freeze(scenario_info(scenario)) for scenario in self.scenarios.values()]
+        self.info_response = FrozenDict(scenarios=tuple(infos))
+        self._info_by_ref: Dict[str, Dict[str, Any]] = {}
+        for (key, scenario), info in zip(self.scenarios.items(), infos):
+            single = FrozenDict(scenarios=(info,))
+            self._info_by_ref[scenario["id"]] = single
+            self._info_by_ref.setdefault(key, single)
+
+    def __len__(self) -> int:
+        return len(self.scenarios)
+
+    def __contains__(self, scenario_ref: str) -> bool:
+        return scenario_ref in self._by_key or scenario_ref in self._by_id
+
+    def resolve(self, scenario_ref: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Find a scenario by key, or by ID if no key matches
+
+        Args:
+            scenario_ref: Scenario key or scenario ID
+
+        Returns:
+            The scenario key and scenario data, or None if not found
+        """
+        return self._by_key.get(scenario_ref) or self._by_id.get(scenario_ref)
+
+    def get(self, scenario_ref: str) -> Optional[Dict[str, Any]]:
+        """Scenario data by key or ID, or None if not found"""
+        entry = self.resolve(scenario_ref)
+        return entry[1] if entry else None
+
+    def info(self, scenario_ref: Optional[str] = None) -> Dict[str, Any]:
+        """
+        The /api/scenarios/info response for one scenario, or for all of them
+        when scenario_ref is empty or unknown
+        """
+        if scenario_ref:
+            return self._info_by_ref.get(scenario_ref, self.info_response)
+        return self.info_response
+
+    def compile_derived(self) -> None:
+        """Rebuild the system prompts and keyword indexes for this registry's scenarios"""
+        compile_system_prompts(self.scenarios)
+        build_keyword_indexes(self.scenarios)
+
+_registry: Optional[ScenarioRegistry] = None
+
+def set_registry(registry: ScenarioRegistry, compile_derived: bool = True) -> ScenarioRegistry:
+    """
+    Install a new scenario registry and rebuild everything derived from it
+
+    Args:
+        registry: The registry to install
+        compile_derived: False when the prompts and keyword indexes were already installed, e.g. from a bundle
+
+    Returns:
+        The registry that was installed
+    """
+    global _registry
+    if compile_derived:
+        registry.compile_derived()
+    # A single assignment, so each request sees either the old or the new snapshot
+    _registry = registry
+    return registry
+
+def get_registry() -> ScenarioRegistry:
+    """
+    The current scenario registry, loading the scenarios on first use
+    """
+    if _registry is None:
+        if SCENARIO_SOURCE == "directory":
+            from scenario_loader import get_directory
+            return set_registry(get_directory().build_registry())
+        if SCENARIO_SOURCE == "bundle":
+            from scenario_bundle import install_bundle
+            try:
+                return install_bundle(SCENARIO_BUNDLE_PATH)
+            except Exception as e:
+                print(f"Error loading scenario bundle {SCENARIO_BUNDLE_PATH}: {str(e)}")
+        return set_registry(ScenarioRegistry(load_scenarios()))
+    return _registry
@@ -0,0 +1,380 @@
+"""
+Session Store
+
+Storage backends for chat sessions. SessionBackend defines the interface used by
+chat_state; SessionStore is the default bounded in-memory backend with idle-TTL
+and LRU eviction. Sessions are kept in access order, so both the least recently
+used session and the longest idle session are always at the front of the store.
+
+Set CHAT_SESSION_BACKEND=sqlite to share sessions between worker processes
+through the on-disk backend in sqlite_session_store.py.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Callable, Tuple
+
+# Defaults can be overridden through environment variables
+DEFAULT_MAX_SESSIONS = int(os.getenv("CHAT_SESSION_MAX", "10000"))
+DEFAULT_IDLE_TTL = float(os.getenv("CHAT_SESSION_TTL_SECONDS", "3600"))
+DEFAULT_SWEEP_INTERVAL = float(os.getenv("CHAT_SESSION_SWEEP_SECONDS", "60"))
+DEFAULT_BACKEND = os.getenv("CHAT_SESSION_BACKEND", "memory")
+DEFAULT_DB_PATH = os.getenv("CHAT_SESSION_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_sessions.db"))
+
+def estimate_message_size(message: Dict[str, Any]) -> int:
+    """
+    Roughly estimate the memory held by a single message
+
+    Args:
+        message: The message object
+
+    Returns:
+        Approximate size in bytes
+    """
+    size = sys.getsizeof(message)
+    for key, value in message.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+    return size
+
+class SessionBackend:
+    """
+    Interface for chat session storage
+
+    Backends own the session records. Callers must go through these methods
+    for every write so that backends which do not hand out live objects
+    (such as the SQLite backend) still persist the change.
+    """
+
+    def __init__(self):
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop_sweeper = threading.Event()
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __contains__(self, session_id: str) -> bool:
+        raise NotImplementedError
+
+    def put(self, session_id: str, session: Dict[str, Any]) -> None:
+        """Insert a new session"""
+        raise NotImplementedError
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return a session, or None if missing or expired"""
+        raise NotImplementedError
+
+    def append_message(self, session_id: str, message: Dict[str, Any]) -> bool:
+        """Append a message to a session's history"""
+        raise NotImplementedError
+
+    def update_fields(self, session_id: str, fields: Dict[str, Any]) -> bool:
+        """Overwrite top-level session fields other than the message history"""
+        raise NotImplementedError
+
+    def update(self, session_id: str, change: Callable[[Dict[str, Any]], Dict[str, Any]]) -> bool:
+        """
+        Read a session and overwrite fields computed from it, atomically
+
+        No other write to the session, from this process or another, can land
+        between the read and the write.
+
+        Args:
+            session_id: The session to change
+            change: Called with the current session; returns the top-level
+                fields to overwrite, other than the message history
+
+        Returns:
+            True if successful, False if the session was not found
+        """
+        raise NotImplementedError
+
+    def set_active(self, session_id: str, active: bool) -> bool:
+        """Change the active flag of a session"""
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> bool:
+        """Remove a session from the store"""
+        raise NotImplementedError
+
+    def values(self) -> List[Dict[str, Any]]:
+        """Snapshot of all stored sessions"""
+        raise NotImplementedError
+
+    def scan(self, scenario_id: Optional[str] = None) -> List[Tuple[str, str]]:
+        """
+        Creation times of unexpired sessions, without marking them as used or loading their messages
+
+        Args:
+            scenario_id: Scenario key or scenario ID to match, or None for every session
+
+        Returns:
+            (session ID, created_at) pairs
+        """
+        raise NotImplementedError
+
+    def active_count(self) -> int:
+        """Number of sessions that are still active"""
+        raise NotImplementedError
+
+    def sweep(self) -> int:
+        """Drop expired sessions and return how many were removed"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size, memory and eviction statistics"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release any resources held by the backend"""
+        self.stop_sweeper()
+
+    def start_sweeper(self, interval: float = DEFAULT_SWEEP_INTERVAL) -> None:
+        """Start a daemon thread that periodically drops expired sessions"""
+        if self.sweeper_running():
+            return
+
+        self._stop_sweeper.clear()
+
+        def run():
+            while not self._stop_sweeper.wait(interval):
+                self.sweep()
+
+        self._sweeper = threading.Thread(target=run, name="session-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self) -> None:
+        """Stop the background sweeper if it is running"""
+        self._stop_sweeper.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+
+    def sweeper_running(self) -> bool:
+        return self._sweeper is not None and self._sweeper.is_alive()
+
+class SessionStore(SessionBackend):
+    """
+    In-memory session store with idle-TTL and max-size LRU eviction
+
+    Every operation is O(1) apart from sweeping, which only touches the
+    sessions that have actually expired.
+    """
+
+    def __init__(self, max_sessions: int = DEFAULT_MAX_SESSIONS, idle_ttl: float = DEFAULT_IDLE_TTL,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            max_sessions: Maximum number of sessions kept before evicting the least recently used one (0 disables the cap)
+            idle_ttl: Seconds a session may stay idle before it expires (0 disables expiry)
+            clock: Monotonic time source, injectable for testing
+        """
+        super().__init__()
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._clock = clock
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+        # Counters kept incrementally so stats are O(1)
+        self._active_count = 0
+        self._approx_bytes = 0
+        self._evicted_lru = 0
+        self._evicted_ttl = 0
+        self._created = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def put(self, session_id: str, session: Dict[str, Any]) -> None:
+        """Insert a new session, evicting old ones if the store is full"""
+        with self._lock:
+            self._sweep_expired()
+            if self.max_sessions:
+                while len(self._sessions) >= self.max_sessions:
+                    self._evict_oldest(reason="lru")
+
+            self._sessions[session_id] = session
+            self._last_access[session_id] = self._clock()
+            size = sum(estimate_message_size(m) for m in session.get("messages", []))
+            self._sizes[session_id] = size
+            self._approx_bytes += size
+            self._created += 1
+            if session.get("active", True):
+                self._active_count += 1
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return a session and mark it as recently used, or None if missing or expired"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+
+            now = self._clock()
+            if self._is_expired(session_id, now):
+                self._remove(session_id, reason="ttl")
+                return None
+
+            self._last_access[session_id] = now
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def append_message(self, session_id: str, message: Dict[str, Any]) -> bool:
+        """Append a message to a session's history"""
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                return False
+
+            session["messages"].append(message)
+            size = estimate_message_size(message)
+            self._sizes[session_id] += size
+            self._approx_bytes += size
+            return True
+
+    def update_fields(self, session_id: str, fields: Dict[str, Any]) -> bool:
+        """Overwrite top-level session fields other than the message history"""
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                return False
+
+            session.update(fields)
+            return True
+
+    def update(self, session_id: str, change: Callable[[Dict[str, Any]], Dict[str, Any]]) -> bool:
+        """Read a session and overwrite fields computed from it, holding the store lock throughout"""
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                return False
+
+            session.update(change(session))
+            return True
+
+    def set_active(self, session_id: str, active: bool) -> bool:
+        """Change the active flag of a session, keeping the active counter in sync"""
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                return False
+
+            was_active = session.get("active", True)
+            session["active"] = active
+            if was_active and not active:
+                self._active_count -= 1
+            elif active and not was_active:
+                self._active_count += 1
+            return True
+
+    def delete(self, session_id: str) -> bool:
+        """Remove a session from the store"""
+        with self._lock:
+            if session_id not in self._sessions:
+                return False
+            self._remove(session_id, reason=None)
+            return True
+
+    def values(self) -> List[Dict[str, Any]]:
+        """Snapshot of all stored sessions"""
+        with self._lock:
+            return list(self._sessions.values())
+
+    def scan(self, scenario_id: Optional[str] = None) -> List[Tuple[str, str]]:
+        """Creation times of unexpired sessions, leaving the access order untouched"""
+        with self._lock:
+            now = self._clock()
+            return [
+                (session_id, session["created_at"])
+                for session_id, session in self._sessions.items()
+                if not self._is_expired(session_id, now)
+                and (scenario_id is None or scenario_id in (session["scenario_id"], session["scenario_data"].get("id")))
+            ]
+
+    def active_count(self) -> int:
+        """Number of sessions that are still active"""
+        return self._active_count
+
+    def sweep(self) -> int:
+        """
+        Drop every session that has been idle longer than the TTL
+
+        Returns:
+            Number of sessions removed
+        """
+        with self._lock:
+            return self._sweep_expired()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size, memory and eviction statistics"""
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "active_sessions": self._active_count,
+                "max_sessions": self.max_sessions,
+                "idle_ttl_seconds": self.idle_ttl,
+                "approx_bytes": self._approx_bytes,
+                "created": self._created,
+                "evicted_lru": self._evicted_lru,
+                "evicted_ttl": self._evicted_ttl,
+                "backend": "memory",
+                "sweeper_running": self.sweeper_running()
+            }
+
+    def _is_expired(self, session_id: str, now: float) -> bool:
+        return bool(self.idle_ttl) and now - self._last_access[session_id] > self.idle_ttl
+
+    def _sweep_expired(self) -> int:
+        if not self.idle_ttl:
+            return 0
+
+        # Sessions are in access order, so expired ones are all at the front
+        now = self._clock()
+        removed = 0
+        while self._sessions:
+            oldest_id = next(iter(self._sessions))
+            if not self._is_expired(oldest_id, now):
+                break
+            self._remove(oldest_id, reason="ttl")
+            removed += 1
+        return removed
+
+    def _evict_oldest(self, reason: str) -> None:
+        oldest_id = next(iter(self._sessions))
+        self._remove(oldest_id, reason=reason)
+
+    def _remove(self, session_id: str, reason: Optional[str]) -> None:
+        session = self._sessions.pop(session_id)
+        del self._last_access[session_id]
+        self._approx_bytes -= self._sizes.pop(session_id)
+        if session.get("active", True):
+            self._active_count -= 1
+
+        if reason == "lru":
+            self._evicted_lru += 1
+        elif reason == "ttl":
+            self._evicted_ttl += 1
+
+def create_store(backend: str = DEFAULT_BACKEND) -> SessionBackend:
+    """
+    Create the session backend selected by name
+
+    Args:
+        backend: "memory" for the in-process store or "sqlite" for the shared on-disk store
+
+    Returns:
+        A new session backend
+    """
+    if backend == "memory":
+        return SessionStore()
+    if backend == "sqlite":
+        from sqlite_session_store import SQLiteSessionStore
+        return SQLiteSessionStore(DEFAULT_DB_PATH)
+    raise ValueError(f"Unknown chat session backend: {backend}")
@@ -0,0 +1,247 @@
+"""
+Single-Flight Completions
+
+Coalesces identical in-flight chat completion requests. Instructor demos and
+grading scripts often send the same request at the same moment; without this,
+each one opens its own upstream stream.
+
+SingleFlightAsyncOpenAI wraps a client's chat.completions.create. Requests are
+identical when all their arguments are (model, messages, max_tokens, stream and
+anything else), compared by a hash of their JSON form. While such a request is
+in flight, an identical one joins it instead of calling the model:
+    stream=True   The upstream stream is read by one pump task into a chunk list
+                  shared by the subscribers, each of which only keeps its
+                  position in it. A subscriber that joins late starts from the
+                  first chunk. A flight therefore holds one copy of the reply
+                  (at most max_tokens chunks) however many subscribers it has
+                  and however far behind they are; the pump does not wait for
+                  slow subscribers. Each subscriber iterates and closes its own
+                  stream; the upstream stream is closed once the last subscriber
+                  has closed, so a reply nobody is reading still stops generating.
+    stream=False  The callers await one shared upstream call, which is cancelled
+                  if every caller is cancelled.
+
+Errors opening the upstream request are raised to every caller, and an error
+mid-stream is raised to every subscriber after the chunks before it. A request
+that finishes leaves the flight table, so coalescing never serves a stale reply
+(see response_cache.py for reusing finished ones). Flights are kept per worker
+process.
+
+Set OPENAI_SINGLE_FLIGHT=0 to call the model for every request.
+"""
+
+import asyncio
+import hashlib
+import json
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Set
+
+import metrics
+
+class _End:
+    """Marks the end of a flight's chunks; carries the error that ended it, if any"""
+
+    __slots__ = ("error",)
+
+    def __init__(self, error: Optional[BaseException] = None):
+        self.error = error
+
+def request_key(kwargs: Dict[str, Any]) -> Optional[str]:
+    """
+    Identify a completion request by its arguments
+
+    Returns:
+        A hash of the arguments, or None if they are not JSON serializable
+        (e.g. per-request timeout objects), in which case the request is not coalesced
+    """
+    try:
+        encoded = json.dumps(kwargs, sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+async def _close_upstream(stream) -> None:
+    close = getattr(stream, "close", None) or getattr(stream, "aclose", None)
+    if close is not None:
+        try:
+            await close()
+        except Exception as e:
+            print(f"Error closing coalesced upstream stream: {str(e)}")
+
+class StreamSubscriber:
+    """
+    One caller's view of a shared completion stream
+
+    Iterates like the stream returned by chat.completions.create(stream=True).
+    """
+
+    def __init__(self, flight: "StreamFlight"):
+        self._flight = flight
+        # Index of the next chunk in the flight's chunk list
+        self._position = 0
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        flight = self._flight
+        while not self._closed:
+            if self._position < len(flight.chunks):
+                self._position += 1
+                return flight.chunks[self._position - 1]
+            if flight.end is not None:
+                self._closed = True
+                if flight.end.error is not None:
+                    raise flight.end.error
+                break
+            await flight.changed.wait()
+        raise StopAsyncIteration
+
+    async def close(self) -> None:
+        """Stop receiving chunks; the upstream stream is closed when its last subscriber closes"""
+        self.unsubscribe()
+
+    aclose = close
+
+    def unsubscribe(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._flight.unsubscribe(self)
+
+class StreamFlight:
+    """
+    A streamed completion shared by every identical request that arrives while it runs
+    """
+
+    def __init__(self, completions: "SingleFlightCompletions", key: str, kwargs: Dict[str, Any]):
+        self._completions = completions
+        self.key = key
+        self.chunks: List[Any] = []
+        self.end: Optional[_End] = None
+        # Set and cleared by the pump each time a chunk or the end arrives
+        self.changed = asyncio.Event()
+        self.subscribers: Set[StreamSubscriber] = set()
+        self.opened = asyncio.get_running_loop().create_future()
+        # Mark a failure as retrieved even if every caller was cancelled before seeing it
+        self.opened.add_done_callback(lambda future: future.cancelled() or future.exception())
+        self.task = asyncio.ensure_future(self._run(kwargs))
+
+    def subscribe(self) -> StreamSubscriber:
+        subscriber = StreamSubscriber(self)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: StreamSubscriber) -> None:
+        self.subscribers.discard(subscriber)
+        if not self.subscribers and not self.task.done():
+            # Nobody is reading any more; stop the upstream generation
+            self._completions._release(self)
+            self.task.cancel()
+
+    async def _run(self, kwargs: Dict[str, Any]) -> None:
+        try:
+            stream = await self._completions._inner.create(**kwargs)
+        except Exception as e:
+            self._completions._release(self)
+            self.opened.set_exception(e)
+            return
+        except BaseException:
+            # Every caller left before the stream opened
+            self._completions._release(self)
+            self.opened.cancel()
+            raise
+        self.opened.set_result(None)
+
+        end = _End()
+        try:
+            async for chunk in stream:
+                self.chunks.append(chunk)
+                self._notify()
+        except Exception as e:
+            end = _End(e)
+        finally:
+            self._completions._release(self)
+            await _close_upstream(stream)
+            self.end = end
+            self._notify()
+
+    def _notify(self) -> None:
+        # Wakes every subscriber waiting now; later waits block until the next notify
+        self.changed.set()
+        self.changed.clear()
+
+class CallFlight:
+    """
+    A non-streamed completion shared by every identical request that arrives while it runs
+    """
+
+    def __init__(self, completions: "SingleFlightCompletions", key: str, kwargs: Dict[str, Any]):
+        self.key = key
+        self.waiters = 0
+        self.task = asyncio.ensure_future(completions._inner.create(**kwargs))
+        self.task.add_done_callback(lambda task: completions._release(self))
+        self.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+class SingleFlightCompletions:
+    """chat.completions of SingleFlightAsyncOpenAI"""
+
+    def __init__(self, inner):
+        self._inner = inner
+        self._flights: Dict[str, Any] = {}
+
+    @property
+    def in_flight(self) -> int:
+        """Upstream requests currently shared"""
+        return len(self._flights)
+
+    def _release(self, flight) -> None:
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    async def create(self, **kwargs):
+        key = request_key(kwargs)
+        if key is None:
+            return await self._inner.create(**kwargs)
+        key = f"{'stream' if kwargs.get('stream') else 'call'}:{key}"
+        flight = self._flights.get(key)
+        if flight is not None:
+            metrics.LLM_COALESCED_REQUESTS.labels(str(kwargs.get("model"))).inc()
+
+        if kwargs.get("stream"):
+            if flight is None:
+                flight = self._flights[key] = StreamFlight(self, key, kwargs)
+            subscriber = flight.subscribe()
+            try:
+                await asyncio.shield(flight.opened)
+            except BaseException:
+                subscriber.unsubscribe()
+                raise
+            return subscriber
+
+        if flight is None:
+            flight = self._flights[key] = CallFlight(self, key, kwargs)
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                self._release(flight)
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+class SingleFlightAsyncOpenAI:
+    """
+    Wraps an AsyncOpenAI-compatible client so identical in-flight completions share one upstream call
+
+    Everything other than chat.completions.create is passed through to the wrapped client.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.chat = SimpleNamespace(completions=SingleFlightCompletions(client.chat.completions))
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
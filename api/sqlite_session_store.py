@@ -0,0 +1,337 @@
+"""
+SQLite Session Store
+
+On-disk session backend that several worker processes can share. The database
+runs in WAL mode so readers never block the single writer, and each message is
+stored as its own row so appending to a conversation is a single INSERT rather
+than a rewrite of the whole session.
+
+Each process keeps a read-through cache of the sessions it has seen, refreshed
+incrementally: only message rows newer than the last one cached are fetched.
+The cache holds at most max_sessions sessions, least recently used first out,
+and every sweep also drops cached sessions that expired or were removed by
+another worker.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple, Callable
+
+from session_store import SessionBackend, DEFAULT_MAX_SESSIONS, DEFAULT_IDLE_TTL
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    scenario_data TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access);
+CREATE INDEX IF NOT EXISTS sessions_active ON sessions (active);
+CREATE TABLE IF NOT EXISTS messages (
+    message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, message_id);
+"""
+
+# Session fields stored in their own column rather than in the meta JSON
+_COLUMN_FIELDS = ("session_id", "scenario_data", "messages", "active")
+
+class SQLiteSessionStore(SessionBackend):
+    """
+    Session backend persisted in a SQLite database in WAL mode
+
+    Idle-TTL and max-size eviction use wall-clock time stored in the database,
+    so every worker process applies the same policy.
+    """
+
+    def __init__(self, path: str, max_sessions: int = DEFAULT_MAX_SESSIONS, idle_ttl: float = DEFAULT_IDLE_TTL):
+        """
+        Args:
+            path: Location of the database file, created if it does not exist
+            max_sessions: Maximum number of sessions kept before evicting the least recently used one (0 disables the cap)
+            idle_ttl: Seconds a session may stay idle before it expires (0 disables expiry)
+        """
+        super().__init__()
+        self.path = path
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+
+        # session_id -> (session, id of the last cached message row), in access order
+        self._cache: "OrderedDict[str, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._evicted_lru = 0
+        self._evicted_ttl = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            return row is not None
+
+    def put(self, session_id: str, session: Dict[str, Any]) -> None:
+        """Insert a new session, evicting old ones if the store is full"""
+        with self._lock:
+            self._sweep_expired()
+            with self._transaction():
+                if self.max_sessions:
+                    count = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+                    overflow = count - self.max_sessions + 1
+                    if overflow > 0:
+                        self._evicted_lru += self._delete_sessions(self._select_ids(
+                            "SELECT session_id FROM sessions ORDER BY last_access LIMIT ?", (overflow,)
+                        ))
+
+                self._conn.execute(
+                    "INSERT INTO sessions (session_id, scenario_data, meta, active, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        session_id,
+                        json.dumps(session["scenario_data"]),
+                        json.dumps(self._meta(session)),
+                        1 if session.get("active", True) else 0,
+                        time.time()
+                    )
+                )
+                for message in session.get("messages", []):
+                    self._insert_message(session_id, message)
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return a session and mark it as recently used, or None if missing or expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT meta, active, last_access FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                self._cache.pop(session_id, None)
+                return None
+
+            meta, active, last_access = row
+            now = time.time()
+            if self.idle_ttl and now - last_access > self.idle_ttl:
+                with self._transaction():
+                    self._delete_sessions([session_id])
+                self._evicted_ttl += 1
+                return None
+
+            self._conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+
+            cached = self._cache.get(session_id)
+            if cached is None:
+                scenario_data = self._conn.execute(
+                    "SELECT scenario_data FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()[0]
+                session = {"session_id": session_id, "scenario_data": json.loads(scenario_data), "messages": []}
+                last_message_id = 0
+            else:
+                session, last_message_id = cached
+
+            # Other workers may have changed the session, so refresh the meta fields and new messages
+            session.update(json.loads(meta))
+            session["active"] = bool(active)
+            for message_id, data in self._conn.execute(
+                "SELECT message_id, data FROM messages WHERE session_id = ? AND message_id > ? ORDER BY message_id",
+                (session_id, last_message_id)
+            ):
+                session["messages"].append(json.loads(data))
+                last_message_id = message_id
+
+            self._cache[session_id] = (session, last_message_id)
+            self._cache.move_to_end(session_id)
+            if self.max_sessions:
+                while len(self._cache) > self.max_sessions:
+                    self._cache.popitem(last=False)
+            return session
+
+    def append_message(self, session_id: str, message: Dict[str, Any]) -> bool:
+        """Append a message to a session's history with a single INSERT"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO messages (session_id, data) "
+                "SELECT ?, ? WHERE EXISTS (SELECT 1 FROM sessions WHERE session_id = ?)",
+                (session_id, json.dumps(message), session_id)
+            )
+            return cursor.rowcount > 0
+
+    def update_fields(self, session_id: str, fields: Dict[str, Any]) -> bool:
+        """Overwrite top-level session fields other than the message history"""
+        with self._lock, self._transaction():
+            row = self._conn.execute("SELECT meta FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return False
+
+            meta = json.loads(row[0])
+            meta.update({key: value for key, value in fields.items() if key not in _COLUMN_FIELDS})
+            self._conn.execute("UPDATE sessions SET meta = ? WHERE session_id = ?", (json.dumps(meta), session_id))
+            if "active" in fields:
+                self._conn.execute(
+                    "UPDATE sessions SET active = ? WHERE session_id = ?", (1 if fields["active"] else 0, session_id)
+                )
+            return True
+
+    def update(self, session_id: str, change: Callable[[Dict[str, Any]], Dict[str, Any]]) -> bool:
+        """Read a session and overwrite fields computed from it in one BEGIN IMMEDIATE transaction"""
+        with self._lock, self._transaction():
+            session = self.get(session_id)
+            if session is None:
+                return False
+
+            fields = change(session)
+            self.update_fields(session_id, fields)
+            session.update({key: value for key, value in fields.items() if key not in _COLUMN_FIELDS})
+            return True
+
+    def set_active(self, session_id: str, active: bool) -> bool:
+        """Change the active flag of a session"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE sessions SET active = ? WHERE session_id = ?", (1 if active else 0, session_id)
+            )
+            return cursor.rowcount > 0
+
+    def delete(self, session_id: str) -> bool:
+        """Remove a session from the store"""
+        with self._lock, self._transaction():
+            if session_id not in self:
+                return False
+            self._delete_sessions([session_id])
+            return True
+
+    def values(self) -> List[Dict[str, Any]]:
+        """Snapshot of all stored sessions"""
+        with self._lock:
+            session_ids = [row[0] for row in self._conn.execute("SELECT session_id FROM sessions")]
+            sessions = (self.get(session_id) for session_id in session_ids)
+            return [session for session in sessions if session is not None]
+
+    def scan(self, scenario_id: Optional[str] = None) -> List[Tuple[str, str]]:
+        """Creation times of unexpired sessions, read from the session rows alone without touching last_access"""
+        sql = "SELECT session_id, json_extract(meta, '$.created_at') FROM sessions WHERE last_access >= ?"
+        params: tuple = (time.time() - self.idle_ttl if self.idle_ttl else 0,)
+        if scenario_id is not None:
+            sql += " AND (json_extract(meta, '$.scenario_id') = ? OR json_extract(scenario_data, '$.id') = ?)"
+            params += (scenario_id, scenario_id)
+        with self._lock:
+            return [(session_id, created_at) for session_id, created_at in self._conn.execute(sql, params)]
+
+    def active_count(self) -> int:
+        """Number of sessions that are still active, answered from the index"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions WHERE active = 1").fetchone()[0]
+
+    def sweep(self) -> int:
+        """
+        Drop every session that has been idle longer than the TTL, and forget
+        cached sessions that no longer exist, whichever worker removed them
+
+        Returns:
+            Number of sessions removed from the database
+        """
+        with self._lock:
+            removed = self._sweep_expired()
+            self._prune_cache()
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size, storage and eviction statistics"""
+        with self._lock:
+            sessions, active = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(active), 0) FROM sessions"
+            ).fetchone()
+            messages = self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            return {
+                "sessions": sessions,
+                "active_sessions": active,
+                "messages": messages,
+                "max_sessions": self.max_sessions,
+                "idle_ttl_seconds": self.idle_ttl,
+                "db_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+                "cached_sessions": len(self._cache),
+                "evicted_lru": self._evicted_lru,
+                "evicted_ttl": self._evicted_ttl,
+                "backend": "sqlite",
+                "sweeper_running": self.sweeper_running()
+            }
+
+    def close(self) -> None:
+        """Stop the sweeper and close the database connection"""
+        super().close()
+        with self._lock:
+            self._conn.close()
+
+    def _sweep_expired(self) -> int:
+        if not self.idle_ttl:
+            return 0
+
+        with self._transaction():
+            removed = self._delete_sessions(self._select_ids(
+                "SELECT session_id FROM sessions WHERE last_access < ?", (time.time() - self.idle_ttl,)
+            ))
+            self._evicted_ttl += removed
+            return removed
+
+    def _prune_cache(self) -> None:
+        cached_ids = list(self._cache)
+        live = set()
+        # Stay below SQLite's limit on bound parameters
+        for start in range(0, len(cached_ids), 500):
+            batch = cached_ids[start:start + 500]
+            live.update(self._select_ids(
+                f"SELECT session_id FROM sessions WHERE session_id IN ({', '.join('?' * len(batch))})", tuple(batch)
+            ))
+        for session_id in cached_ids:
+            if session_id not in live:
+                del self._cache[session_id]
+
+    def _meta(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in session.items() if key not in _COLUMN_FIELDS}
+
+    def _insert_message(self, session_id: str, message: Dict[str, Any]) -> None:
+        self._conn.execute(
+            "INSERT INTO messages (session_id, data) VALUES (?, ?)", (session_id, json.dumps(message))
+        )
+
+    def _select_ids(self, sql: str, params: tuple) -> List[str]:
+        return [row[0] for row in self._conn.execute(sql, params)]
+
+    def _delete_sessions(self, session_ids: List[str]) -> int:
+        for session_id in session_ids:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._cache.pop(session_id, None)
+        return len(session_ids)
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+class _Transaction:
+    """Explicit BEGIN/COMMIT block, reentrant within a single connection"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self._owner = False
+
+    def __enter__(self):
+        if not self._conn.in_transaction:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._owner = True
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._owner:
+            self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
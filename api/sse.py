@@ -0,0 +1,241 @@
+"""
+Server-Sent Events
+
+Framing for the streamed chat responses. Text deltas are framed with the C
+string encoder from the json module instead of a json.dumps call per token,
+and the deltas of a response are collected in a list that is joined once at
+the end.
+
+Deltas can optionally be coalesced so clients get fewer, larger frames: a frame
+is sent once SSE_COALESCE_BYTES characters are pending, or once SSE_COALESCE_MS
+milliseconds have passed since the previous frame. Both default to 0, which
+sends every delta as soon as it arrives. The first delta after a pause is
+always sent immediately, so coalescing does not delay the first token.
+
+While coalescing, the upstream is read ahead of the client by at most
+SSE_MAX_PENDING_BYTES characters; beyond that the upstream is not read until the
+pending text has been sent, so a slow client cannot make a response pile up in
+memory. Without coalescing the upstream is only read as fast as the client
+accepts frames.
+"""
+
+import asyncio
+import json
+import os
+import time
+from json.encoder import encode_basestring_ascii
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import anyio
+import async_timeout
+
+COALESCE_INTERVAL = float(os.getenv("SSE_COALESCE_MS", "0")) / 1000
+COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", "0"))
+MAX_PENDING_BYTES = int(os.getenv("SSE_MAX_PENDING_BYTES", "65536"))
+
+def content_event(content: str) -> str:
+    """
+    Frame a text delta
+
+    Produces exactly the same text as f"data: {json.dumps({'content': content})}\\n\\n".
+    """
+    return 'data: {"content": ' + encode_basestring_ascii(content) + '}\n\n'
+
+def json_event(data: Dict[str, Any]) -> str:
+    """Frame an arbitrary JSON event"""
+    return f"data: {json.dumps(data)}\n\n"
+
+DONE_EVENT = json_event({"content": "", "done": True})
+
+class SSEWriter:
+    """
+    Collects the text deltas of one response and decides when to send a frame
+    """
+
+    def __init__(self, interval: float = COALESCE_INTERVAL, max_bytes: int = COALESCE_BYTES,
+                 max_pending: int = MAX_PENDING_BYTES):
+        """
+        Args:
+            interval: Seconds to coalesce deltas for, 0 to disable
+            max_bytes: Pending characters that force a frame, 0 to disable
+            max_pending: Pending characters at which reading the upstream pauses
+        """
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+        self.frames = 0
+        # When the first delta arrived, by time.monotonic()
+        self.first_delta_at: Optional[float] = None
+        self._parts: List[str] = []
+        self._pending_from = 0
+        self._pending_size = 0
+        self._last_flush = float("-inf")
+
+    @property
+    def coalescing(self) -> bool:
+        return self.interval > 0 or self.max_bytes > 0
+
+    @property
+    def text(self) -> str:
+        """Everything written so far"""
+        return "".join(self._parts)
+
+    @property
+    def deltas(self) -> int:
+        """Number of deltas written so far"""
+        return len(self._parts)
+
+    @property
+    def pending(self) -> bool:
+        return self._pending_from < len(self._parts)
+
+    @property
+    def pending_size(self) -> int:
+        return self._pending_size
+
+    @property
+    def full(self) -> bool:
+        """Whether reading ahead of the client should pause until the pending text is sent"""
+        return self._pending_size >= self.max_pending
+
+    def append(self, content: str) -> None:
+        """Add a delta without framing it"""
+        if not self._parts:
+            self.first_delta_at = time.monotonic()
+        self._parts.append(content)
+        self._pending_size += len(content)
+
+    def due(self) -> bool:
+        """Whether the pending deltas should be sent now"""
+        if not self.pending:
+            return False
+        if not self.coalescing or self.full:
+            return True
+        if self.max_bytes and self._pending_size >= self.max_bytes:
+            return True
+        return bool(self.interval) and time.monotonic() - self._last_flush >= self.interval
+
+    def add(self, content: str) -> Optional[str]:
+        """
+        Add a delta
+
+        Returns:
+            A frame to send now, or None if the delta is held back
+        """
+        self.append(content)
+        return self.flush() if self.due() else None
+
+    def flush(self) -> Optional[str]:
+        """
+        Returns:
+            A frame with every pending delta, or None if nothing is pending
+        """
+        if not self.pending:
+            return None
+
+        if len(self._parts) - self._pending_from == 1:
+            content = self._parts[-1]
+        else:
+            content = "".join(self._parts[self._pending_from:])
+        self._pending_from = len(self._parts)
+        self._pending_size = 0
+        self._last_flush = time.monotonic()
+        self.frames += 1
+        return self.frame(content)
+
+    def queue_frame(self, position: int) -> str:
+        """Frame the response's position in the queue for the model"""
+        return json_event({"queue_position": position})
+
+    def frame(self, content: str) -> str:
+        """Frame a batch of deltas; override to send them over another transport"""
+        return content_event(content)
+
+    def time_until_flush(self) -> Optional[float]:
+        """Seconds until pending deltas are due, or None if nothing is waiting on the timer"""
+        if not self.interval or not self.pending:
+            return None
+        return max(self._last_flush + self.interval - time.monotonic(), 0)
+
+async def iter_deltas(stream) -> AsyncIterator[str]:
+    """Yield the non-empty text deltas of an OpenAI chat completion stream"""
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+async def write_stream(deltas: AsyncIterator[str], writer: SSEWriter) -> AsyncIterator[str]:
+    """
+    Turn text deltas into SSE frames
+
+    With a coalescing interval, a pump task appends the upstream deltas to the
+    writer and only wakes this generator when a frame is due or a timer has to
+    be armed, so pending deltas are flushed when the interval runs out even if
+    the upstream is slow to send the next delta.
+
+    Args:
+        deltas: Text deltas from the upstream stream
+        writer: Collects the deltas; writer.text holds the full response afterwards
+
+    Yields:
+        SSE frames
+    """
+    if not writer.interval:
+        async for content in deltas:
+            frame = writer.add(content)
+            if frame:
+                yield frame
+    else:
+        ready = asyncio.Event()
+        drained = asyncio.Event()
+        outcome = {}
+
+        async def pump():
+            try:
+                async for content in deltas:
+                    arm_timer = not writer.pending
+                    writer.append(content)
+                    if arm_timer or writer.due():
+                        ready.set()
+                    if writer.full:
+                        # Stop reading the upstream until the client has taken the pending text
+                        drained.clear()
+                        await drained.wait()
+            except Exception as e:
+                outcome["error"] = e
+            outcome["finished"] = True
+            ready.set()
+
+        pump_task = asyncio.ensure_future(pump())
+        try:
+            while "finished" not in outcome:
+                if not ready.is_set():
+                    timeout = writer.time_until_flush()
+                    if timeout is None:
+                        await ready.wait()
+                    else:
+                        try:
+                            async with async_timeout.timeout(timeout):
+                                await ready.wait()
+                        except asyncio.TimeoutError:
+                            pass
+                ready.clear()
+
+                if writer.due():
+                    frame = writer.flush()
+                    drained.set()
+                    yield frame
+        finally:
+            pump_task.cancel()
+            # Wait for the pump to leave the upstream iterator so the caller can close it
+            with anyio.CancelScope(shield=True):
+                await asyncio.wait({pump_task})
+
+        if "error" in outcome:
+            frame = writer.flush()
+            if frame:
+                yield frame
+            raise outcome["error"]
+
+    frame = writer.flush()
+    if frame:
+        yield frame
@@ -0,0 +1,203 @@
+"""
+Resumable Streams
+
+Runs each streamed chat response in a background task that records its SSE
+frames, with an id, in a bounded ring buffer. Clients read the response as a
+subscription to that buffer, so a client whose connection drops can reconnect
+with the Last-Event-ID header, get the events it missed and keep following the
+same generation instead of starting a new completion.
+
+Event ids have the form "<stream id>:<sequence number>". The stream id changes
+with every response, so an id from an earlier turn is never mistaken for a
+position in the current one.
+
+When the last subscriber disconnects, the generation keeps running for
+STREAM_RESUME_GRACE_SECONDS so the client can come back; after that it is
+cancelled, which closes the upstream request and stores the partial reply (see
+stream_openai_response). Finished streams stay available for replay for
+STREAM_RETAIN_SECONDS.
+
+Streams live in the memory of the worker that started them, so with several
+workers a reconnect must reach the same worker (e.g. sticky sessions).
+"""
+
+import asyncio
+import os
+import uuid
+from collections import deque
+from itertools import islice
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+from sse import json_event
+
+STREAM_REPLAY_EVENTS = int(os.getenv("STREAM_REPLAY_EVENTS", "2048"))
+STREAM_RESUME_GRACE_SECONDS = float(os.getenv("STREAM_RESUME_GRACE_SECONDS", "10"))
+STREAM_RETAIN_SECONDS = float(os.getenv("STREAM_RETAIN_SECONDS", "60"))
+
+class ReplayUnavailable(Exception):
+    """The requested events are no longer buffered, or belong to another stream"""
+
+class ResumableStream:
+    """
+    One streamed response, produced once and readable by any number of subscribers
+    """
+
+    def __init__(self, session_id: str, frames: AsyncIterator[str], max_events: int = STREAM_REPLAY_EVENTS,
+                 grace: float = STREAM_RESUME_GRACE_SECONDS):
+        """
+        Args:
+            session_id: The chat session the response belongs to
+            frames: SSE frames of the response, e.g. from stream_openai_response
+            max_events: Size of the replay ring buffer
+            grace: Seconds to keep generating after the last subscriber disconnects
+        """
+        self.session_id = session_id
+        self.stream_id = uuid.uuid4().hex[:12]
+        self.grace = grace
+        self.finished = False
+
+        # (sequence number, frame with its id line)
+        self._events: Deque[Tuple[int, str]] = deque(maxlen=max_events)
+        self._next_seq = 0
+        self._changed = asyncio.Event()
+
+        # Subscriber token -> next sequence number it will read
+        self._positions: Dict[int, int] = {}
+        self._next_token = 0
+        self._progress = asyncio.Event()
+        self._cancel_handle: Optional[asyncio.TimerHandle] = None
+
+        self._task = asyncio.ensure_future(self._produce(frames))
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _produce(self, frames: AsyncIterator[str]) -> None:
+        try:
+            async for frame in frames:
+                # Never overwrite an event a connected subscriber has not read yet
+                while len(self._events) == self._events.maxlen and any(
+                    position <= self._events[0][0] for position in self._positions.values()
+                ):
+                    self._progress.clear()
+                    await self._progress.wait()
+
+                seq = self._next_seq
+                self._next_seq += 1
+                self._events.append((seq, f"id: {self.stream_id}:{seq}\n{frame}"))
+                self._notify()
+        finally:
+            # Close the frames if cancelled while waiting for subscribers, so its cleanup runs now
+            aclose = getattr(frames, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            self.finished = True
+            if self._cancel_handle is not None:
+                self._cancel_handle.cancel()
+            self._notify()
+
+    def position_after(self, last_event_id: Optional[str]) -> int:
+        """
+        The sequence number to resume from after a Last-Event-ID
+
+        Raises:
+            ReplayUnavailable: If the id belongs to another stream or the events after it were dropped
+        """
+        if not last_event_id:
+            position = 0
+        else:
+            stream_id, _, seq = last_event_id.strip().partition(":")
+            if stream_id != self.stream_id or not seq.isdigit():
+                raise ReplayUnavailable("Last-Event-ID does not belong to the current stream")
+            position = int(seq) + 1
+
+        oldest = self._events[0][0] if self._events else self._next_seq
+        if position < oldest:
+            raise ReplayUnavailable("The requested events are no longer buffered")
+        return position
+
+    async def subscribe(self, position: int = 0) -> AsyncIterator[str]:
+        """
+        Yield the stream's frames from a sequence number on, then follow it until it ends
+
+        Args:
+            position: First sequence number to send, from position_after()
+        """
+        token = self._next_token
+        self._next_token += 1
+        self._positions[token] = position
+        if self._cancel_handle is not None:
+            self._cancel_handle.cancel()
+            self._cancel_handle = None
+
+        try:
+            while True:
+                oldest = self._events[0][0] if self._events else self._next_seq
+                if position < oldest:
+                    # Only possible for a subscriber that joined with a stale position
+                    yield json_event({"error": "Stream events were dropped; reload the chat history"})
+                    return
+
+                # Copy first: the producer may append while this generator is suspended
+                pending = list(islice(self._events, position - oldest, None))
+                for seq, frame in pending:
+                    position = seq + 1
+                    self._positions[token] = position
+                    self._progress.set()
+                    yield frame
+
+                if position >= self._next_seq:
+                    if self.finished:
+                        return
+                    await self._changed.wait()
+        finally:
+            del self._positions[token]
+            self._progress.set()
+            if not self._positions and not self.finished:
+                self._schedule_cancel()
+
+    def _schedule_cancel(self) -> None:
+        if self.grace <= 0:
+            self.cancel()
+        else:
+            self._cancel_handle = asyncio.get_running_loop().call_later(self.grace, self.cancel)
+
+    def cancel(self) -> None:
+        """Stop generating; the upstream request is closed and the partial reply stored"""
+        self._task.cancel()
+
+# Session ID -> latest stream of that session
+_streams: Dict[str, ResumableStream] = {}
+
+def start_stream(session_id: str, frames: AsyncIterator[str]) -> ResumableStream:
+    """
+    Start producing a response in the background and register it for resumption
+
+    Args:
+        session_id: The chat session
+        frames: SSE frames of the response
+
+    Returns:
+        The stream; read it with subscribe()
+    """
+    stream = ResumableStream(session_id, frames)
+    _streams[session_id] = stream
+
+    def forget(_task):
+        # Keep the finished stream around for late reconnects, then drop it
+        def remove():
+            if _streams.get(session_id) is stream:
+                del _streams[session_id]
+        asyncio.get_running_loop().call_later(STREAM_RETAIN_SECONDS, remove)
+
+    stream._task.add_done_callback(forget)
+    return stream
+
+def get_stream(session_id: str) -> Optional[ResumableStream]:
+    """The latest stream of a session, if it is still running or retained"""
+    return _streams.get(session_id)
+
+def active_stream_count() -> int:
+    """Number of streams still generating"""
+    return sum(1 for stream in _streams.values() if not stream.finished)
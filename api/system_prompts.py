@@ -0,0 +1,150 @@
+"""
+System Prompts
+
+Builds the system prompt for a scenario and caches it per scenario version and
+step. Scenarios change only on reload, so every prompt is compiled once when
+scenarios load and looked up on each request instead of being rebuilt.
+
+Each prompt is split in two so the provider's prompt-prefix cache can hit:
+    prefix  Scenario role, description and the full step list. Identical for every
+            turn of every session of the scenario, so it always leads the request.
+    step    Guidance for the current step. Sent after the conversation history, so
+            changing steps does not invalidate the cached prefix and history.
+"""
+
+from typing import Dict, Any, Optional, Tuple
+
+# (scenario_key, prompt signature, step_index) -> (prefix, step prompt); step_index None means no current step
+_prompt_cache: Dict[Tuple[str, Tuple, Optional[int]], Tuple[str, str]] = {}
+
+def build_prompt_prefix(scenario_data: Dict[str, Any]) -> str:
+    """
+    Build the part of the system prompt that does not depend on the current step
+    """
+    ai_role = scenario_data["ai_role"]
+    description = scenario_data["description"]
+
+    parts = [f"""You are a medical AI assistant simulating a {ai_role} in the following scenario:
+
+{description}
+
+Your role is to provide realistic and empathetic responses that demonstrate effective medical communication techniques.
+Focus on clear explanations, emotional support, and shared decision-making when appropriate.
+Maintain a professional, compassionate tone throughout the conversation.
+Respond to the patient's concerns directly and do not change the subject.
+"""]
+
+    # Add communication steps as guidelines if available
+    if scenario_data.get("communication_steps"):
+        parts.append("\n\nThe overall communication steps for this scenario are:\n")
+        parts.extend(f"{i}. {step}\n" for i, step in enumerate(scenario_data["communication_steps"], 1))
+
+    return "".join(parts)
+
+def build_step_prompt(current_step: Optional[str] = None, current_guidance: str = "") -> str:
+    """
+    Build the part of the system prompt that describes the current step
+    """
+    if not current_step:
+        return ""
+
+    return f"""Current communication step: {current_step}
+
+Step guidance: {current_guidance}
+
+Please focus on this communication step in your next response.
+"""
+
+def resolve_step(scenario_data: Dict[str, Any], step_index: Optional[int]) -> Tuple[Optional[str], str]:
+    """
+    Find the step name and guidance cue for a step index
+
+    Returns:
+        The step name (None if the index is out of range) and its guidance cue
+    """
+    communication_steps = scenario_data.get("communication_steps", [])
+    if step_index is None or not 0 <= step_index < len(communication_steps):
+        return None, ""
+
+    current_step = communication_steps[step_index]
+    return current_step, scenario_data.get("guidance_cues", {}).get(current_step, "")
+
+def prompt_signature(scenario_data: Dict[str, Any]) -> Tuple:
+    """The parts of a scenario its system prompts are built from, in comparable form"""
+    return (scenario_data["ai_role"], scenario_data["description"],
+            tuple(scenario_data.get("communication_steps", ())),
+            tuple(scenario_data.get("guidance_cues", {}).items()))
+
+def construct_system_prompt(scenario_data, current_step=None, current_guidance=""):
+    """
+    Construct a detailed system prompt based on the scenario data
+    """
+    system_prompt = build_prompt_prefix(scenario_data)
+    step_prompt = build_step_prompt(current_step, current_guidance)
+    if step_prompt:
+        system_prompt += "\n" + step_prompt
+    return system_prompt
+
+def get_system_prompt(scenario_key: str, scenario_data: Dict[str, Any], step_index: Optional[int] = None) -> Tuple[str, str]:
+    """
+    Get the compiled system prompt for a scenario and step
+
+    Sessions keep the scenario data they started with, which may be an older
+    version of a reloaded scenario, so prompts are cached per scenario key and
+    per prompt signature.
+
+    Args:
+        scenario_key: Key of the scenario in the scenario collection
+        scenario_data: The scenario data, used to compile on a cache miss
+        step_index: Index of the current communication step, or None
+
+    Returns:
+        The stable prompt prefix and the prompt for the current step (empty if none)
+    """
+    # Out-of-range steps share the no-step prompt, so client-supplied indexes cannot grow the cache
+    if step_index is not None and not 0 <= step_index < len(scenario_data.get("communication_steps", [])):
+        step_index = None
+    key = (scenario_key, prompt_signature(scenario_data), step_index)
+    cached = _prompt_cache.get(key)
+    if cached is None:
+        current_step, current_guidance = resolve_step(scenario_data, step_index)
+        cached = (build_prompt_prefix(scenario_data), build_step_prompt(current_step, current_guidance))
+        _prompt_cache[key] = cached
+    return cached
+
+def compile_system_prompts(scenarios: Dict[str, Dict[str, Any]]) -> int:
+    """
+    Compile the prompts for every scenario and step, replacing the previous cache
+
+    Call this whenever the scenario collection is loaded or changes.
+
+    Returns:
+        Number of prompts compiled
+    """
+    global _prompt_cache
+    compiled = {}
+    for scenario_key, scenario_data in scenarios.items():
+        prefix = build_prompt_prefix(scenario_data)
+        signature = prompt_signature(scenario_data)
+        compiled[(scenario_key, signature, None)] = (prefix, "")
+        for step_index in range(len(scenario_data.get("communication_steps", []))):
+            current_step, current_guidance = resolve_step(scenario_data, step_index)
+            compiled[(scenario_key, signature, step_index)] = (prefix, build_step_prompt(current_step, current_guidance))
+
+    # Swap in one assignment so readers never see a half-built cache
+    _prompt_cache = compiled
+    return len(compiled)
+
+def invalidate_system_prompts() -> None:
+    """Drop every cached prompt"""
+    global _prompt_cache
+    _prompt_cache = {}
+
+def export_system_prompts() -> Dict[Tuple[str, Tuple, Optional[int]], Tuple[str, str]]:
+    """The current compiled prompt cache, for writing into a scenario bundle"""
+    return _prompt_cache
+
+def install_system_prompts(compiled: Dict[Tuple[str, Tuple, Optional[int]], Tuple[str, str]]) -> None:
+    """Replace the prompt cache with prompts compiled ahead of time"""
+    global _prompt_cache
+    _prompt_cache = dict(compiled)
@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+import chat_state
+from keyword_index import KeywordIndex
+from session_store import SessionStore
+from sqlite_session_store import SQLiteSessionStore
+
+SCENARIO = {
+    "id": "scenario_test",
+    "communication_steps": ["Introduce", "Acknowledge"],
+    "evaluation_keywords": {"Introduce": ["my name is"], "Acknowledge": ["i understand"]}
+}
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    backend = SessionStore() if request.param == "memory" else SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    previous = chat_state.configure_store(backend)
+    yield backend
+    chat_state.configure_store(previous)
+    backend.close()
+
+def test_interleaved_appends_keep_every_keyword_match(store, monkeypatch):
+    session_id = chat_state.create_session("test", SCENARIO)
+
+    # Hold the first append between reading the evaluation state and writing it back
+    scanning = threading.Event()
+    resume = threading.Event()
+    find_appended = KeywordIndex.find_appended
+
+    def paused_find_appended(self, tail, text):
+        if threading.current_thread().name == "first":
+            scanning.set()
+            resume.wait(5)
+        return find_appended(self, tail, text)
+
+    monkeypatch.setattr(KeywordIndex, "find_appended", paused_find_appended)
+
+    first = threading.Thread(
+        name="first", target=chat_state.add_message,
+        args=(session_id, {"role": "user", "content": "Hello, my name is Dr. Lee"})
+    )
+    second = threading.Thread(
+        name="second", target=chat_state.add_message,
+        args=(session_id, {"role": "user", "content": "I understand this is hard"})
+    )
+    first.start()
+    assert scanning.wait(5)
+    second.start()
+    # Give the second append the chance to overtake the first
+    second.join(0.2)
+    resume.set()
+    first.join(5)
+    second.join(5)
+
+    session = chat_state.get_session(session_id)
+    assert chat_state.get_step_matches(session) == [["my name is"], ["i understand"]]
+    assert session["evaluation_state"]["user_messages"] == 2
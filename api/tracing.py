@@ -0,0 +1,282 @@
+"""
+Tracing
+
+Spans for the phases of a chat turn, so a slow response can be broken down into
+proxy time, session lookup, prompt construction, history assembly, the upstream
+connection, time to first token, generation and persistence.
+
+Spans follow the OpenTelemetry data model: 128-bit trace ids, 64-bit span ids,
+parent links, Unix-nanosecond timestamps, attributes and events. They are
+exported locally as JSON lines using the OTLP/JSON field names, one span per
+line, to TRACE_FILE. A W3C traceparent request header continues the caller's
+trace, and every traced response carries the trace id in X-Trace-Id.
+
+The Express proxy stamps requests with X-Request-Start (milliseconds since the
+epoch), and the request span records the time between that and the API
+receiving the request as proxy.wait_ms.
+
+Settings:
+    TRACE_FILE          JSON lines file to export spans to; tracing is off when unset
+    TRACE_SAMPLE_RATE   Fraction of requests without a traceparent that are traced (default 1)
+
+Spans are only created inside a traced request, so when tracing is off, or a
+request is not sampled, span() costs a context variable lookup.
+"""
+
+import atexit
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import profiling
+
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1"))
+TRACING_ENABLED = bool(TRACE_FILE)
+
+TRACE_ID_HEADER = "X-Trace-Id"
+
+class Span:
+    """
+    One timed operation within a trace
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "kind", "start", "end", "attributes", "events", "error")
+
+    # OTLP span kinds
+    INTERNAL = 1
+    SERVER = 2
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, start: Optional[int] = None,
+                 kind: int = INTERNAL):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64).to_bytes(8, "big").hex()
+        self.parent_id = parent_id
+        self.start = start if start is not None else time.time_ns()
+        self.end: Optional[int] = None
+        self.attributes: Dict[str, Any] = {}
+        self.events: List[Tuple[str, int, Dict[str, Any]]] = []
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add_event(self, name: str, timestamp: Optional[int] = None, **attributes) -> None:
+        self.events.append((name, timestamp if timestamp is not None else time.time_ns(), attributes))
+
+    def finish(self, end: Optional[int] = None) -> None:
+        """End the span and export it"""
+        self.end = end if end is not None else time.time_ns()
+        exporter.export(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """The span in OTLP/JSON form"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.events:
+            span["events"] = [
+                {"name": name, "timeUnixNano": str(timestamp), "attributes": _otlp_attributes(attributes)}
+                for name, timestamp, attributes in self.events
+            ]
+        return span
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    result = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        result.append({"key": key, "value": typed})
+    return result
+
+class JsonLinesExporter:
+    """
+    Appends finished spans to a file, one OTLP/JSON span per line
+
+    Spans are buffered and written when a request's root span finishes, so the
+    file is touched once per request rather than once per span. Spans that end
+    after their request, such as a stream the client stopped reading, are
+    written with the next request or at exit.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        self._buffer.append(json.dumps(span.to_otlp()))
+        if span.kind == Span.SERVER or len(self._buffer) >= 512:
+            self.flush()
+
+    def flush(self) -> None:
+        lines, self._buffer = self._buffer, []
+        if not lines:
+            return
+        try:
+            with self._lock, open(self.path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            print(f"Error exporting spans to {self.path}: {str(e)}")
+
+exporter = JsonLinesExporter(TRACE_FILE)
+atexit.register(exporter.flush)
+
+# The innermost open span of the current request, if it is traced
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Time a block as a child of the current span
+
+    Does nothing outside a traced request.
+
+    Yields:
+        The span, or None if the request is not traced
+    """
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(name, parent.trace_id, parent.span_id)
+    child.attributes.update(attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        child.finish()
+
+def record_span(name: str, start: float, end: float, **attributes) -> None:
+    """
+    Export a child of the current span for an interval that has already passed
+
+    Args:
+        start: Start time by time.monotonic()
+        end: End time by time.monotonic()
+    """
+    parent = _current.get()
+    if parent is None:
+        return
+    child = Span(name, parent.trace_id, parent.span_id, start=monotonic_to_unix_ns(start))
+    child.attributes.update(attributes)
+    child.finish(monotonic_to_unix_ns(end))
+
+def monotonic_to_unix_ns(timestamp: float) -> int:
+    """Convert a time.monotonic() reading to Unix nanoseconds"""
+    return time.time_ns() - int((time.monotonic() - timestamp) * 1e9)
+
+def parse_traceparent(value: str) -> Optional[Tuple[str, str, bool]]:
+    """
+    Parse a W3C traceparent header
+
+    Returns:
+        (trace id, parent span id, sampled) or None if the header is malformed
+    """
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening the root span of each HTTP request
+
+    Also starts the sampling profiler for requests that ask for it (see profiling.py).
+    Installed when tracing or profiling is enabled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        parent = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = random.getrandbits(128).to_bytes(16, "big").hex(), None
+            sampled = random.random() < TRACE_SAMPLE_RATE
+        sampled = sampled and TRACING_ENABLED
+
+        profile = profiling.start_request(headers, trace_id)
+        if not sampled and profile is None:
+            await self.app(scope, receive, send)
+            return
+
+        root = Span(f"{scope['method']} {scope['path']}", trace_id, parent_id, kind=Span.SERVER)
+        root.set_attribute("http.method", scope["method"])
+        root.set_attribute("http.target", scope["path"])
+        request_start = headers.get(b"x-request-start")
+        if request_start:
+            try:
+                # "t=<milliseconds>" or a bare number, as set by the proxy
+                started_ms = float(request_start.decode("latin-1").removeprefix("t="))
+                root.set_attribute("proxy.wait_ms", max(root.start / 1e6 - started_ms, 0.0))
+            except ValueError:
+                pass
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.set_attribute("http.status_code", message["status"])
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(TRACE_ID_HEADER.lower().encode(), trace_id.encode())]
+                root.add_event("response_start")
+            await send(message)
+
+        token = _current.set(root if sampled else None)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            root.error = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                root.name = f"{scope['method']} {route.path}"
+                root.set_attribute("http.route", route.path)
+            if profile is not None:
+                root.set_attribute("profile.file", profiling.finish_request(profile) or "")
+            if sampled:
+                root.finish()
@@ -1,31 +1,19 @@
-import os
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from dotenv import load_dotenv
-from openai import OpenAI, AsyncOpenAI
-
-# Load environment variables
-load_dotenv()
-
-# Get API key
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY environment variable is not set")
-
-# Initialize OpenAI clients
-client = OpenAI(api_key=api_key)
-async_client = AsyncOpenAI(api_key=api_key)
+import async_timeout
 
 # Import routers - with explicit relative imports for Vercel
 from .scenarios_route import router as scenarios_router
 from .chat_route import router as chat_router
 from .evaluate_route import router as evaluate_router
+from .openai_provider import OpenAIProvider, get_openai, openai_lifespan
 
 # Initialize FastAPI app
 app = FastAPI(title="MedComm API", 
               description="API for medical communication training scenarios",
-              version="1.0")
+              version="1.0",
+              lifespan=openai_lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -52,16 +40,17 @@ def read_root():
     return {"message": "MedComm API - Medical Communication Training"}
 
 @app.post("/api/test-openai")
-async def test_openai(request: PromptRequest):
+async def test_openai(request: PromptRequest, openai: OpenAIProvider = Depends(get_openai)):
     try:
-        response = client.chat.completions.create(
-            model=request.model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": request.prompt}
-            ],
-            max_tokens=request.max_tokens
-        )
+        async with async_timeout.timeout(openai.request_timeout):
+            response = await openai.async_client.chat.completions.create(
+                model=request.model,
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": request.prompt}
+                ],
+                max_tokens=request.max_tokens
+            )
         
         return {
             "text": response.choices[0].message.content,
@@ -1,13 +1,17 @@
 import os
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from openai import OpenAI, AsyncOpenAI
+import async_timeout
 import uvicorn
 import sys
 
-# Add the current directory to the path
+# Add the current directory and the api directory to the path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "api"))
+
+from openai_provider import OpenAIProvider, get_openai, openai_lifespan
 
 # Load environment variables from .env file
 load_dotenv()
@@ -15,38 +19,20 @@ load_dotenv()
 # Get API key from environment variables
 api_key = os.getenv("OPENAI_API_KEY")
 if not api_key or api_key == "your-api-key-here":
-    print("WARNING: OPENAI_API_KEY environment variable is not set or is using the default value. Mock responses will be used.")
-    # Create mock OpenAI client for testing
-    class MockOpenAI:
-        class ChatCompletions:
-            def create(self, **kwargs):
-                class MockResponse:
-                    class Choice:
-                        class Message:
-                            content = "This is a mock response because no valid OpenAI API key was provided."
-                        
-                        def __init__(self):
-                            self.message = self.Message()
+    print("WARNING: OPENAI_API_KEY environment variable is not set or is using the default value. The mock LLM will be used.")
+    # Serve completions from the in-process mock (see api/mock_llm.py), which streams like the real API
+    os.environ.setdefault("OPENAI_MOCK", "1")
 
-                    def __init__(self):
-                        self.choices = [self.Choice()]
-                
-                return MockResponse()
-        
-        def __init__(self):
-            self.chat = self.ChatCompletions()
-    
-    client = MockOpenAI()
-    async_client = MockOpenAI()
-else:
-    # Initialize OpenAI clients
-    client = OpenAI(api_key=api_key)
-    async_client = AsyncOpenAI(api_key=api_key)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with openai_lifespan(app):
+        yield
 
 # Initialize FastAPI app
 app = FastAPI(title="MedComm API", 
               description="API for medical communication training scenarios",
-              version="1.0")
+              version="1.0",
+              lifespan=lifespan)
 
 # Import routers - do this AFTER initializing client to avoid circular imports
 try:
@@ -79,16 +65,17 @@ def read_root():
     return {"message": "MedComm API - Medical Communication Training"}
 
 @app.post("/api/test-openai")
-async def test_openai(request: PromptRequest):
+async def test_openai(request: PromptRequest, openai: OpenAIProvider = Depends(get_openai)):
     try:
-        response = client.chat.completions.create(
-            model=request.model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": request.prompt}
-            ],
-            max_tokens=request.max_tokens
-        )
+        async with async_timeout.timeout(openai.request_timeout):
+            response = await openai.async_client.chat.completions.create(
+                model=request.model,
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": request.prompt}
+                ],
+                max_tokens=request.max_tokens
+            )
         
         return {
             "text": response.choices[0].message.content,
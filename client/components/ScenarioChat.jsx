@@ -132,58 +132,124 @@ export default function ScenarioChat({ sessionData, onRestart }) {
         throw new Error("ReadableStream not supported in this browser.");
       }
       
-      const reader = response.body.getReader();
       const decoder = new TextDecoder("utf-8");
       
       let fullContent = "";
+      let lastEventId = null;
+      let finished = false;
       
-      const processStream = async () => {
+      // Handle one SSE event; returns true when the stream is over
+      const handleEvent = (block) => {
+        let data = null;
+        for (const line of block.split("\n")) {
+          if (line.startsWith("id: ")) {
+            lastEventId = line.slice(4);
+          } else if (line.startsWith("data: ")) {
+            data = line.slice(6);
+          }
+        }
+        if (data === null) {
+          return false;
+        }
+        
+        try {
+          const event = JSON.parse(data);
+          
+          if (event.error) {
+            console.error("Stream error:", event.error);
+            // Busy or rate limited: tell the user when to try again
+            if (event.code) {
+              setStreamingMessage("");
+              setMessages(prev => [...prev, {
+                role: "system",
+                content: `${event.error} (try again in ${Math.ceil(event.retry_after)} seconds)`
+              }]);
+            }
+            return true;
+          }
+
+          // Waiting for the model; replaced by the reply once it starts
+          if (event.queue_position) {
+            setStreamingMessage(`Waiting for the model (position ${event.queue_position} in line)...`);
+          }
+
+          if (event.content) {
+            fullContent += event.content;
+            setStreamingMessage(fullContent);
+          }
+          
+          if (event.done) {
+            // Message complete, add it to messages array
+            setMessages(prev => [...prev, {
+              role: "assistant",
+              content: fullContent
+            }]);
+            setStreamingMessage("");
+            
+            // After AI responds, we'll handle step progression
+            // For this simple version, we'll advance the step every 2 turns (user message + AI response)
+            if (messages.length % 4 === 1) { // Every 2 exchanges (4 messages including both user and AI)
+              markStepCompleted();
+              advanceToNextStep();
+            }
+            
+            return true;
+          }
+        } catch (e) {
+          console.error("Error parsing SSE data:", e);
+        }
+        return false;
+      };
+      
+      // Read events until the stream ends; events can be split across chunks
+      const readStream = async (streamResponse) => {
+        const reader = streamResponse.body.getReader();
+        let buffer = "";
         while (true) {
           const { done, value } = await reader.read();
           
           if (done) {
-            break;
+            return;
           }
           
-          const chunk = decoder.decode(value);
-          const dataLines = chunk.split("\n\n");
+          buffer += decoder.decode(value, { stream: true });
+          const events = buffer.split("\n\n");
+          buffer = events.pop();
           
-          for (const line of dataLines) {
-            if (line.startsWith("data: ")) {
-              try {
-                const data = JSON.parse(line.slice(6));
-                
-                if (data.error) {
-                  console.error("Stream error:", data.error);
-                  break;
-                }
-                
-                if (data.content) {
-                  fullContent += data.content;
-                  setStreamingMessage(fullContent);
-                }
-                
-                if (data.done) {
-                  // Message complete, add it to messages array
-                  setMessages(prev => [...prev, {
-                    role: "assistant",
-                    content: fullContent
-                  }]);
-                  setStreamingMessage("");
-                  
-                  // After AI responds, we'll handle step progression
-                  // For this simple version, we'll advance the step every 2 turns (user message + AI response)
-                  if (messages.length % 4 === 1) { // Every 2 exchanges (4 messages including both user and AI)
-                    markStepCompleted();
-                    advanceToNextStep();
-                  }
-                  
-                  break;
-                }
-              } catch (e) {
-                console.error("Error parsing SSE data:", e);
-              }
+          for (const block of events) {
+            if (handleEvent(block)) {
+              finished = true;
+              reader.cancel();
+              return;
+            }
+          }
+        }
+      };
+      
+      const processStream = async () => {
+        let streamResponse = response;
+        // If the connection drops mid-response, reconnect and replay the missed events
+        for (let attempt = 0; ; attempt++) {
+          try {
+            await readStream(streamResponse);
+          } catch (err) {
+            console.error("Stream interrupted:", err);
+          }
+          
+          if (finished || !lastEventId || attempt >= 3) {
+            break;
+          }
+          
+          await new Promise(resolve => setTimeout(resolve, 500 * (attempt + 1)));
+          try {
+            streamResponse = await fetch(`/api/chat/stream/${sessionData.session_id}`, {
+              headers: { 'Last-Event-ID': lastEventId },
+            });
+            if (!streamResponse.ok) {
+              break;
             }
+          } catch (err) {
+            console.error("Reconnect failed:", err);
           }
         }
         
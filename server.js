@@ -1,5 +1,8 @@
 import express from "express";
 import fs from "fs";
+import net from "net";
+import { Readable } from "stream";
+import { pipeline } from "stream/promises";
 import { createServer as createViteServer } from "vite";
 import "dotenv/config";
 
@@ -52,8 +55,19 @@ app.get("/token", async (req, res) => {
   }
 });
 
+// Response headers that describe the upstream connection or its encoding rather than
+// the response; fetch has already decoded the body
+const hopByHopHeaders = new Set([
+  "connection", "keep-alive", "transfer-encoding", "content-encoding", "content-length",
+]);
+
 // Proxy API requests to the FastAPI backend
 app.use('/api', async (req, res) => {
+  // Abort the upstream request when the browser goes away, so the API sees the
+  // disconnect and stops generating (and a stream can be resumed)
+  const upstream = new AbortController();
+  res.on("close", () => upstream.abort());
+
   try {
     const targetUrl = `http://localhost:${apiPort}${req.url}`;
     
@@ -62,15 +76,38 @@ app.use('/api', async (req, res) => {
       headers: {
         'Content-Type': 'application/json',
         ...req.headers,
+        // Lets the API measure time spent in the proxy (see api/tracing.py)
+        'X-Request-Start': `t=${Date.now()}`,
       },
       body: req.method !== 'GET' && req.method !== 'HEAD' ? JSON.stringify(req.body) : undefined,
+      signal: upstream.signal,
     });
     
-    const data = await response.json();
-    res.status(response.status).json(data);
+    // Pass the response through unchanged, so the API's ETag, Cache-Control and
+    // Vary reach the browser and its conditional requests can get a 304. The body
+    // is piped rather than sent with res.json, which would add Express's own ETag.
+    res.status(response.status);
+    response.headers.forEach((value, name) => {
+      if (!hopByHopHeaders.has(name)) {
+        res.setHeader(name, value);
+      }
+    });
+    if (!response.body) {
+      res.end();
+      return;
+    }
+    // pipeline tears down both sides if either one fails or closes early
+    await pipeline(Readable.fromWeb(response.body), res);
   } catch (error) {
+    if (upstream.signal.aborted) {
+      return;
+    }
     console.error(`API proxy error for ${req.url}:`, error);
-    res.status(500).json({ error: "Failed to proxy request to API server" });
+    if (res.headersSent) {
+      res.destroy(error);
+    } else {
+      res.status(500).json({ error: "Failed to proxy request to API server" });
+    }
   }
 });
 
@@ -109,3 +146,26 @@ const server = app.listen(port, () => {
     }
   }
 });
+
+// Tunnel WebSocket upgrades for the chat socket straight to the FastAPI backend
+server.on("upgrade", (req, socket, head) => {
+  if (!req.url.startsWith("/api/")) {
+    return;
+  }
+
+  const upstream = net.connect(apiPort, "localhost", () => {
+    const headers = [];
+    for (let i = 0; i < req.rawHeaders.length; i += 2) {
+      headers.push(`${req.rawHeaders[i]}: ${req.rawHeaders[i + 1]}`);
+    }
+    upstream.write(`${req.method} ${req.url} HTTP/${req.httpVersion}\r\n${headers.join("\r\n")}\r\n\r\n`);
+    upstream.write(head);
+    socket.pipe(upstream).pipe(socket);
+  });
+
+  upstream.on("error", (error) => {
+    console.error(`WebSocket proxy error for ${req.url}:`, error);
+    socket.destroy();
+  });
+  socket.on("error", () => upstream.destroy());
+});